@@ -0,0 +1,908 @@
+"""Minimal in-memory AMQP 0-9-1 broker for local runs and benchmarks.
+
+Implements the subset the clients in this repository use: the connection and
+channel handshakes, direct and fanout exchanges, queue declare/bind/purge/
+delete (including x-max-priority, x-message-ttl, x-dead-letter-exchange and
+x-single-active-consumer), basic.qos/consume/cancel/get/publish,
+ack/nack/reject, and publisher confirms. Dead-lettered messages keep their
+headers as they are (no x-death). Messages are kept in memory only; durable
+and delivery_mode are accepted but nothing survives a restart.
+
+    python amqp_broker.py [--host HOST] [--port PORT]
+"""
+import sys
+import time
+import uuid
+import struct
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict, deque
+from typing import Dict, Any, Deque, List, Optional, Set
+import pika.frame
+import pika.spec as spec
+from config import BROKER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('>BHI')  # type, channel, payload size
+FRAME_END = b'\xce'
+HEARTBEAT_FRAME = FRAME_HEADER.pack(spec.FRAME_HEARTBEAT, 0, 0) + FRAME_END
+PROTOCOL_HEADER = b'AMQP\x00\x00\x09\x01'
+
+METHOD_ID = struct.Struct('>I')
+DELIVERY_TAG = struct.Struct('>QB')  # delivery tag, bit flags
+HEADER_SIZE = struct.Struct('>HHQ')  # class id, weight, body size
+
+BASIC_PUBLISH = spec.Basic.Publish.INDEX
+BASIC_ACK = spec.Basic.Ack.INDEX
+BASIC_DELIVER = METHOD_ID.pack(spec.Basic.Deliver.INDEX)
+BASIC_ACK_PREFIX = METHOD_ID.pack(spec.Basic.Ack.INDEX)
+
+# Reply codes from the AMQP 0-9-1 spec
+ACCESS_REFUSED = 403
+NOT_FOUND = 404
+RESOURCE_LOCKED = 405
+PRECONDITION_FAILED = 406
+FRAME_ERROR = 501
+COMMAND_INVALID = 503
+CHANNEL_ERROR = 504
+NOT_ALLOWED = 530
+NOT_IMPLEMENTED = 540
+INTERNAL_ERROR = 541
+
+EXCHANGE_TYPES = ('direct', 'fanout')
+
+class ChannelException(Exception):
+    """Error that closes the channel it happened on."""
+
+    def __init__(self, reply_code: int, reply_text: str, method_index: int = 0):
+        super().__init__(reply_text)
+        self.reply_code = reply_code
+        self.reply_text = reply_text
+        self.method_index = method_index
+
+class ConnectionException(ChannelException):
+    """Error that closes the whole connection."""
+
+def _short_string(value: str) -> bytes:
+    encoded = value.encode()
+    return bytes((len(encoded),)) + encoded
+
+def _header_priority(header) -> int:
+    """Priority property of a content header payload, without decoding the rest."""
+    flags = struct.unpack_from('>H', header, 12)[0]
+    if not flags & spec.BasicProperties.FLAG_PRIORITY:
+        return 0
+    offset = 14
+    if flags & spec.BasicProperties.FLAG_CONTENT_TYPE:
+        offset += 1 + header[offset]
+    if flags & spec.BasicProperties.FLAG_CONTENT_ENCODING:
+        offset += 1 + header[offset]
+    if flags & spec.BasicProperties.FLAG_HEADERS:
+        offset += 4 + struct.unpack_from('>I', header, offset)[0]
+    if flags & spec.BasicProperties.FLAG_DELIVERY_MODE:
+        offset += 1
+    return header[offset]
+
+class Message:
+    """A published message; header and body are kept as received."""
+    __slots__ = ('exchange', 'routing_key', 'route', 'header', 'body', 'redelivered',
+                 'expires_at')
+
+    def __init__(self, exchange: str, routing_key: str, route, header, body):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        # exchange and routing key as encoded in Basic.Publish, reused in Basic.Deliver
+        self.route = route
+        self.header = header
+        self.body = body
+        self.redelivered = False
+        self.expires_at = None
+
+    def copy(self) -> 'Message':
+        return Message(self.exchange, self.routing_key, self.route, self.header, self.body)
+
+class Queue:
+    def __init__(self, name: str, durable: bool = False, exclusive_owner=None,
+                 auto_delete: bool = False, arguments: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.durable = durable
+        self.exclusive_owner = exclusive_owner
+        self.auto_delete = auto_delete
+        self.arguments = arguments or {}
+        self.max_priority = min(int(self.arguments.get('x-max-priority') or 0), 255)
+        ttl = self.arguments.get('x-message-ttl')
+        self.ttl = int(ttl) / 1000 if ttl is not None else None
+        self.dead_letter_exchange = self.arguments.get('x-dead-letter-exchange')
+        self.dead_letter_routing_key = self.arguments.get('x-dead-letter-routing-key')
+        self.single_active_consumer = bool(self.arguments.get('x-single-active-consumer'))
+        # One deque per priority level, highest served first
+        self._levels: List[Deque[Message]] = [deque() for _ in range(self.max_priority + 1)]
+        self._size = 0
+        self.consumers: Deque['Consumer'] = deque()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _level(self, message: Message) -> Deque[Message]:
+        if not self.max_priority:
+            return self._levels[0]
+        return self._levels[min(_header_priority(message.header), self.max_priority)]
+
+    def put(self, message: Message) -> None:
+        if self.ttl is not None:
+            # A message routed to several queues expires separately in each
+            message = message.copy()
+            message.expires_at = time.monotonic() + self.ttl
+        self._level(message).append(message)
+        self._size += 1
+
+    def requeue(self, message: Message) -> None:
+        message.redelivered = True
+        self._level(message).appendleft(message)
+        self._size += 1
+
+    def get(self) -> Optional[Message]:
+        if not self._size:
+            return None
+        for level in reversed(self._levels):
+            if level:
+                self._size -= 1
+                return level.popleft()
+
+    def expire(self, now: float) -> List[Message]:
+        """Remove and return expired messages; like RabbitMQ, only from the head."""
+        expired = []
+        for level in self._levels:
+            while level and level[0].expires_at <= now:
+                expired.append(level.popleft())
+                self._size -= 1
+        return expired
+
+    def purge(self) -> int:
+        count = self._size
+        for level in self._levels:
+            level.clear()
+        self._size = 0
+        return count
+
+    def dispatch(self) -> None:
+        """Hand messages to ready consumers, round-robin."""
+        consumers = self.consumers
+        if self.single_active_consumer:
+            # The oldest consumer gets everything; the others wait for it to go
+            while self._size and consumers and consumers[0].ready():
+                consumers[0].channel.deliver(consumers[0], self, self.get())
+            return
+        while self._size and consumers:
+            for _ in range(len(consumers)):
+                consumer = consumers[0]
+                consumers.rotate(-1)
+                if consumer.ready():
+                    consumer.channel.deliver(consumer, self, self.get())
+                    break
+            else:
+                return
+
+class Exchange:
+    def __init__(self, name: str, type: str = 'direct', durable: bool = False):
+        self.name = name
+        self.type = type
+        self.durable = durable
+        self.bindings: Dict[str, Dict[Queue, None]] = {}
+
+    def bind(self, queue: Queue, routing_key: str) -> None:
+        self.bindings.setdefault(routing_key, {})[queue] = None
+
+    def unbind(self, queue: Queue, routing_key: Optional[str] = None) -> None:
+        for key in list(self.bindings) if routing_key is None else [routing_key]:
+            queues = self.bindings.get(key)
+            if queues is not None:
+                queues.pop(queue, None)
+                if not queues:
+                    del self.bindings[key]
+
+    def route(self, routing_key: str):
+        if self.type == 'fanout':
+            return {queue: None for queues in self.bindings.values() for queue in queues}
+        return self.bindings.get(routing_key, ())
+
+class Consumer:
+    __slots__ = ('tag', 'channel', 'queue', 'no_ack', 'prefix')
+
+    def __init__(self, tag: str, channel: 'Channel', queue: Queue, no_ack: bool):
+        self.tag = tag
+        self.channel = channel
+        self.queue = queue
+        self.no_ack = no_ack
+        self.prefix = BASIC_DELIVER + _short_string(tag)
+
+    def ready(self) -> bool:
+        channel = self.channel
+        return channel.connection.writable and (
+            self.no_ack or not channel.prefetch_count
+            or len(channel.unacked) < channel.prefetch_count
+        )
+
+class Channel:
+    def __init__(self, connection: 'Connection', number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.number = number
+        self.closing = False
+        self.confirm = False
+        self.published = 0
+        self.confirmed = 0
+        self.prefetch_count = 0
+        self.delivery_tag = 0
+        self.unacked: 'OrderedDict[int, tuple]' = OrderedDict()
+        self.consumers: Dict[str, Consumer] = {}
+        # Publish being assembled from method, header and body frames
+        self._publish = None
+        self._header = None
+        self._body_size = 0
+        self._body: List[Any] = []
+        self._received = 0
+
+    # Content frames
+
+    def on_publish(self, payload: memoryview) -> None:
+        exchange_length = payload[6]
+        routing_key_start = 7 + exchange_length
+        routing_key_end = routing_key_start + 1 + payload[routing_key_start]
+        self._publish = (
+            str(payload[7:routing_key_start], 'utf-8'),
+            str(payload[routing_key_start + 1:routing_key_end], 'utf-8'),
+            payload[6:routing_key_end],
+            bool(payload[routing_key_end] & 1)  # mandatory
+        )
+
+    def on_header(self, payload: memoryview) -> None:
+        if self._publish is None:
+            raise ConnectionException(COMMAND_INVALID, "Unexpected content header")
+        self._header = payload
+        self._body_size = HEADER_SIZE.unpack_from(payload, 0)[2]
+        self._body = []
+        self._received = 0
+        if not self._body_size:
+            self._complete(b'')
+
+    def on_body(self, payload: memoryview) -> None:
+        if self._header is None:
+            raise ConnectionException(COMMAND_INVALID, "Unexpected content body")
+        self._received += len(payload)
+        if self._received == self._body_size and not self._body:
+            # Single-frame body: no join; _complete copies it if it is queued
+            self._complete(payload)
+            return
+        self._body.append(payload)
+        if self._received >= self._body_size:
+            self._complete(b''.join(self._body))
+
+    def _complete(self, body) -> None:
+        exchange_name, routing_key, route, mandatory = self._publish
+        header = self._header
+        self._publish = self._header = None
+        self._body = []
+
+        if exchange_name:
+            exchange = self.broker.exchanges.get(exchange_name)
+            if exchange is None:
+                raise ChannelException(NOT_FOUND, f"no exchange '{exchange_name}'", BASIC_PUBLISH)
+            queues = exchange.route(routing_key)
+        else:
+            queue = self.broker.queues.get(routing_key)
+            queues = (queue,) if queue is not None else ()
+
+        if queues:
+            # route, header and body are views into a whole receive chunk;
+            # a queued message must not keep that chunk alive
+            message = Message(exchange_name, routing_key, bytes(route), bytes(header), bytes(body))
+        routed = False
+        for queue in queues:
+            queue.put(message)
+            self.broker.dirty.add(queue)
+            routed = True
+        if not routed and mandatory:
+            self.connection.send_method(self.number, spec.Basic.Return(
+                312, 'NO_ROUTE', exchange_name, routing_key))
+            self.connection.send_content(self.number, header, body)
+        if self.confirm:
+            self.published += 1
+            self.connection.confirming.add(self)
+
+    def send_confirms(self) -> None:
+        """One multiple=True ack covering every publish since the last one."""
+        if self.published > self.confirmed:
+            self.confirmed = self.published
+            self.connection.send_frame(
+                spec.FRAME_METHOD, self.number,
+                BASIC_ACK_PREFIX + DELIVERY_TAG.pack(self.published, 1)
+            )
+
+    # Deliveries and acknowledgements
+
+    def deliver(self, consumer: Consumer, queue: Queue, message: Message) -> None:
+        self.delivery_tag += 1
+        if not consumer.no_ack:
+            self.unacked[self.delivery_tag] = (queue, message)
+        self.connection.send_frame(
+            spec.FRAME_METHOD, self.number,
+            consumer.prefix + DELIVERY_TAG.pack(self.delivery_tag, message.redelivered)
+            + message.route
+        )
+        self.connection.send_content(self.number, message.header, message.body)
+
+    def _settled(self, delivery_tag: int, multiple: bool, method_index: int) -> List[tuple]:
+        unacked = self.unacked
+        if multiple:
+            settled = []
+            while unacked:
+                tag = next(iter(unacked))
+                if delivery_tag and tag > delivery_tag:
+                    break
+                settled.append(unacked.pop(tag))
+        else:
+            entry = unacked.pop(delivery_tag, None)
+            if entry is None:
+                raise ChannelException(PRECONDITION_FAILED,
+                                       f"unknown delivery tag {delivery_tag}", method_index)
+            settled = [entry]
+        self._refill()
+        return settled
+
+    def _refill(self) -> None:
+        """Consumers on this channel may have room again."""
+        for consumer in self.consumers.values():
+            self.broker.dirty.add(consumer.queue)
+
+    def ack(self, payload: memoryview) -> None:
+        delivery_tag, flags = DELIVERY_TAG.unpack_from(payload, 4)
+        self._settled(delivery_tag, flags & 1, BASIC_ACK)
+
+    def nack(self, delivery_tag: int, multiple: bool, requeue: bool, method_index: int) -> None:
+        settled = self._settled(delivery_tag, multiple, method_index)
+        if requeue:
+            for queue, message in reversed(settled):
+                queue.requeue(message)
+                self.broker.dirty.add(queue)
+        else:
+            for queue, message in settled:
+                self.broker.dead_letter(queue, message)
+
+    def requeue_unacked(self) -> None:
+        for queue, message in reversed(self.unacked.values()):
+            queue.requeue(message)
+            self.broker.dirty.add(queue)
+        self.unacked.clear()
+
+    def close(self) -> None:
+        """Drop consumers and requeue unacked deliveries."""
+        for consumer in list(self.consumers.values()):
+            self.broker.cancel(consumer)
+        self.requeue_unacked()
+        self.connection.confirming.discard(self)
+
+class Connection(asyncio.Protocol):
+    def __init__(self, broker: 'Broker'):
+        self.broker = broker
+        self.transport = None
+        self.peer = None
+        self.channels: Dict[int, Channel] = {}
+        self.confirming: Set[Channel] = set()
+        self.writable = True
+        self.frame_max = broker.config['frame_max']
+        self.heartbeat = 0
+        self._started = False
+        self._closing = False
+        self._partial = b''
+        self._output: List[Any] = []
+        self._heartbeat_timer = None
+
+    # Transport callbacks
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.broker.connections.add(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.broker.connections.discard(self)
+        self.broker.pending_output.discard(self)
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.cancel()
+        for channel in self.channels.values():
+            channel.close()
+        self.channels.clear()
+        self.broker.drop_exclusive(self)
+        self.broker.process()
+        logger.debug(f"Connection from {self.peer} closed")
+
+    def pause_writing(self) -> None:
+        self.writable = False
+
+    def resume_writing(self) -> None:
+        self.writable = True
+        for channel in self.channels.values():
+            channel._refill()
+        self.broker.process()
+
+    def data_received(self, data: bytes) -> None:
+        if self._partial:
+            data = self._partial + data
+            self._partial = b''
+        # Frames are parsed in place; payloads are views into data, which is immutable
+        view = memoryview(data)
+        end = len(data)
+        offset = 0
+        try:
+            if not self._started:
+                if end < len(PROTOCOL_HEADER):
+                    self._partial = data
+                    return
+                if data[:len(PROTOCOL_HEADER)] != PROTOCOL_HEADER:
+                    self.transport.write(PROTOCOL_HEADER)
+                    self.transport.close()
+                    return
+                self._started = True
+                offset = len(PROTOCOL_HEADER)
+                self.send_method(0, spec.Connection.Start(
+                    server_properties={
+                        'product': 'amqp_broker',
+                        'capabilities': {
+                            'publisher_confirms': True,
+                            'basic.nack': True,
+                            'consumer_cancel_notify': True,
+                            'exchange_exchange_bindings': False,
+                            'per_consumer_qos': False
+                        }
+                    }
+                ))
+
+            while offset + FRAME_HEADER.size <= end and not self._closing:
+                frame_type, channel_number, size = FRAME_HEADER.unpack_from(view, offset)
+                payload_start = offset + FRAME_HEADER.size
+                frame_end = payload_start + size
+                if frame_end >= end:
+                    break
+                if view[frame_end] != 0xce:
+                    raise ConnectionException(FRAME_ERROR, "Missing frame end octet")
+                self._frame(frame_type, channel_number, view[payload_start:frame_end])
+                offset = frame_end + 1
+        except ConnectionException as e:
+            self.close_connection(e)
+            offset = end
+        except Exception as e:
+            logger.exception(f"Error handling frames from {self.peer}")
+            self.close_connection(ConnectionException(INTERNAL_ERROR, str(e)))
+            offset = end
+        if offset < end and not self._closing:
+            self._partial = bytes(view[offset:])
+
+        for channel in self.confirming:
+            channel.send_confirms()
+        self.confirming.clear()
+        self.broker.process()
+
+    # Frame handling
+
+    def _frame(self, frame_type: int, channel_number: int, payload: memoryview) -> None:
+        if frame_type == spec.FRAME_HEARTBEAT:
+            return
+        if channel_number == 0:
+            if frame_type != spec.FRAME_METHOD:
+                raise ConnectionException(COMMAND_INVALID, "Content frame on channel 0")
+            self._connection_method(self._decode(payload))
+            return
+
+        channel = self.channels.get(channel_number)
+        if frame_type == spec.FRAME_METHOD:
+            method_index = METHOD_ID.unpack_from(payload, 0)[0]
+            if channel is None:
+                if method_index != spec.Channel.Open.INDEX:
+                    raise ConnectionException(CHANNEL_ERROR, f"Channel {channel_number} is not open",
+                                              method_index)
+                self.channels[channel_number] = Channel(self, channel_number)
+                self.send_method(channel_number, spec.Channel.OpenOk())
+                return
+            if channel.closing:
+                # Ignore everything until the client acknowledges our Channel.Close
+                if method_index == spec.Channel.CloseOk.INDEX:
+                    del self.channels[channel_number]
+                return
+            try:
+                if method_index == BASIC_PUBLISH:
+                    channel.on_publish(payload)
+                elif method_index == BASIC_ACK:
+                    channel.ack(payload)
+                else:
+                    self._channel_method(channel, self._decode(payload))
+            except ConnectionException:
+                raise
+            except ChannelException as e:
+                self.close_channel(channel, e)
+            return
+
+        if channel is None:
+            raise ConnectionException(CHANNEL_ERROR, f"Channel {channel_number} is not open")
+        if channel.closing:
+            return
+        try:
+            if frame_type == spec.FRAME_HEADER:
+                channel.on_header(payload)
+            elif frame_type == spec.FRAME_BODY:
+                channel.on_body(payload)
+            else:
+                raise ConnectionException(FRAME_ERROR, f"Unknown frame type {frame_type}")
+        except ConnectionException:
+            raise
+        except ChannelException as e:
+            self.close_channel(channel, e)
+
+    def _decode(self, payload: memoryview) -> spec.amqp_object.Method:
+        method_index = METHOD_ID.unpack_from(payload, 0)[0]
+        method_class = spec.methods.get(method_index)
+        if method_class is None:
+            raise ConnectionException(NOT_IMPLEMENTED, f"Unknown method {method_index}", method_index)
+        return method_class().decode(bytes(payload), 4)
+
+    def _connection_method(self, method) -> None:
+        if isinstance(method, spec.Connection.StartOk):
+            if method.mechanism != 'PLAIN':
+                raise ConnectionException(ACCESS_REFUSED, f"Unsupported mechanism {method.mechanism}")
+            config = self.broker.config
+            self.send_method(0, spec.Connection.Tune(
+                config['channel_max'], config['frame_max'], config['heartbeat']
+            ))
+        elif isinstance(method, spec.Connection.TuneOk):
+            if method.frame_max:
+                self.frame_max = min(method.frame_max, self.broker.config['frame_max'])
+            self.heartbeat = method.heartbeat
+            if self.heartbeat:
+                self._schedule_heartbeat()
+        elif isinstance(method, spec.Connection.Open):
+            self.send_method(0, spec.Connection.OpenOk())
+            logger.debug(f"Connection from {self.peer} opened vhost {method.virtual_host}")
+        elif isinstance(method, spec.Connection.Close):
+            self.send_method(0, spec.Connection.CloseOk())
+            self._closing = True
+            self.flush()
+            self.transport.close()
+        elif isinstance(method, spec.Connection.CloseOk):
+            self.transport.close()
+        else:
+            raise ConnectionException(NOT_IMPLEMENTED, f"{method.NAME} is not supported",
+                                      method.INDEX)
+
+    def _channel_method(self, channel: Channel, method) -> None:
+        broker = self.broker
+        number = channel.number
+        reply = None
+
+        if isinstance(method, spec.Basic.Nack):
+            channel.nack(method.delivery_tag, method.multiple, method.requeue, method.INDEX)
+        elif isinstance(method, spec.Basic.Reject):
+            channel.nack(method.delivery_tag, False, method.requeue, method.INDEX)
+        elif isinstance(method, spec.Basic.Qos):
+            channel.prefetch_count = method.prefetch_count
+            channel._refill()
+            reply = spec.Basic.QosOk()
+        elif isinstance(method, spec.Basic.Consume):
+            queue = broker.queue(method.queue, self, method.INDEX)
+            if method.exclusive and queue.consumers:
+                raise ChannelException(ACCESS_REFUSED, f"queue '{queue.name}' has consumers",
+                                       method.INDEX)
+            tag = method.consumer_tag or f'ctag-{uuid.uuid4().hex}'
+            if tag in channel.consumers:
+                raise ConnectionException(NOT_ALLOWED, f"consumer tag '{tag}' already in use",
+                                          method.INDEX)
+            if not method.nowait:
+                # ConsumeOk must go out before the first delivery
+                self.send_method(number, spec.Basic.ConsumeOk(tag))
+            consumer = Consumer(tag, channel, queue, method.no_ack)
+            channel.consumers[tag] = consumer
+            queue.consumers.append(consumer)
+            broker.dirty.add(queue)
+        elif isinstance(method, spec.Basic.Cancel):
+            consumer = channel.consumers.get(method.consumer_tag)
+            if consumer is not None:
+                broker.cancel(consumer)
+            if not method.nowait:
+                reply = spec.Basic.CancelOk(method.consumer_tag)
+        elif isinstance(method, spec.Basic.Get):
+            queue = broker.queue(method.queue, self, method.INDEX)
+            message = queue.get()
+            if message is None:
+                reply = spec.Basic.GetEmpty()
+            else:
+                channel.delivery_tag += 1
+                if not method.no_ack:
+                    channel.unacked[channel.delivery_tag] = (queue, message)
+                self.send_method(number, spec.Basic.GetOk(
+                    channel.delivery_tag, message.redelivered, message.exchange,
+                    message.routing_key, len(queue)
+                ))
+                self.send_content(number, message.header, message.body)
+        elif isinstance(method, spec.Basic.Recover):
+            channel.requeue_unacked()
+            reply = spec.Basic.RecoverOk()
+        elif isinstance(method, spec.Confirm.Select):
+            channel.confirm = True
+            if not method.nowait:
+                reply = spec.Confirm.SelectOk()
+        elif isinstance(method, spec.Exchange.Declare):
+            exchange = broker.exchanges.get(method.exchange)
+            if method.passive:
+                if exchange is None:
+                    raise ChannelException(NOT_FOUND, f"no exchange '{method.exchange}'",
+                                           method.INDEX)
+            elif exchange is None:
+                if method.type not in EXCHANGE_TYPES:
+                    raise ConnectionException(COMMAND_INVALID,
+                                              f"unsupported exchange type '{method.type}'",
+                                              method.INDEX)
+                if method.exchange.startswith('amq.'):
+                    raise ChannelException(ACCESS_REFUSED, "exchange names starting with "
+                                           "'amq.' are reserved", method.INDEX)
+                broker.exchanges[method.exchange] = Exchange(method.exchange, method.type,
+                                                             method.durable)
+            elif exchange.type != method.type:
+                raise ChannelException(PRECONDITION_FAILED, f"exchange '{method.exchange}' "
+                                       f"is of type '{exchange.type}'", method.INDEX)
+            if not method.nowait:
+                reply = spec.Exchange.DeclareOk()
+        elif isinstance(method, spec.Exchange.Delete):
+            if not method.exchange:
+                raise ChannelException(ACCESS_REFUSED, "cannot delete the default exchange",
+                                       method.INDEX)
+            broker.exchanges.pop(method.exchange, None)
+            if not method.nowait:
+                reply = spec.Exchange.DeleteOk()
+        elif isinstance(method, spec.Queue.Declare):
+            if method.passive:
+                queue = broker.queue(method.queue, self, method.INDEX)
+            else:
+                queue = broker.declare_queue(method, self)
+            if not method.nowait:
+                reply = spec.Queue.DeclareOk(queue.name, len(queue), len(queue.consumers))
+        elif isinstance(method, spec.Queue.Bind):
+            queue = broker.queue(method.queue, self, method.INDEX)
+            broker.exchange(method.exchange, method.INDEX).bind(queue, method.routing_key)
+            if not method.nowait:
+                reply = spec.Queue.BindOk()
+        elif isinstance(method, spec.Queue.Unbind):
+            queue = broker.queue(method.queue, self, method.INDEX)
+            broker.exchange(method.exchange, method.INDEX).unbind(queue, method.routing_key)
+            reply = spec.Queue.UnbindOk()
+        elif isinstance(method, spec.Queue.Purge):
+            count = broker.queue(method.queue, self, method.INDEX).purge()
+            if not method.nowait:
+                reply = spec.Queue.PurgeOk(count)
+        elif isinstance(method, spec.Queue.Delete):
+            queue = broker.queue(method.queue, self, method.INDEX)
+            if method.if_unused and queue.consumers:
+                raise ChannelException(PRECONDITION_FAILED, f"queue '{queue.name}' in use",
+                                       method.INDEX)
+            if method.if_empty and len(queue):
+                raise ChannelException(PRECONDITION_FAILED, f"queue '{queue.name}' not empty",
+                                       method.INDEX)
+            count = broker.delete_queue(queue)
+            if not method.nowait:
+                reply = spec.Queue.DeleteOk(count)
+        elif isinstance(method, spec.Channel.Close):
+            channel.close()
+            del self.channels[number]
+            reply = spec.Channel.CloseOk()
+        elif isinstance(method, spec.Channel.Flow):
+            reply = spec.Channel.FlowOk(method.active)
+        else:
+            raise ConnectionException(NOT_IMPLEMENTED, f"{method.NAME} is not supported",
+                                      method.INDEX)
+
+        if reply is not None:
+            self.send_method(number, reply)
+
+    # Closing
+
+    def close_channel(self, channel: Channel, error: ChannelException) -> None:
+        logger.warning(f"Closing channel {channel.number} of {self.peer}: "
+                       f"{error.reply_code} {error.reply_text}")
+        channel.close()
+        channel.closing = True
+        self.send_method(channel.number, spec.Channel.Close(
+            error.reply_code, error.reply_text, error.method_index >> 16, error.method_index & 0xffff
+        ))
+
+    def close_connection(self, error: ChannelException) -> None:
+        logger.warning(f"Closing connection from {self.peer}: {error.reply_code} {error.reply_text}")
+        self._closing = True
+        self._partial = b''
+        self.send_method(0, spec.Connection.Close(
+            error.reply_code, error.reply_text, error.method_index >> 16, error.method_index & 0xffff
+        ))
+        self.flush()
+        # Give the client a moment to send Connection.CloseOk
+        asyncio.get_running_loop().call_later(1, self.transport.close)
+
+    # Output
+
+    def send_frame(self, frame_type: int, channel_number: int, payload) -> None:
+        if not self._output:
+            self.broker.pending_output.add(self)
+        self._output.append(FRAME_HEADER.pack(frame_type, channel_number, len(payload)))
+        self._output.append(payload)
+        self._output.append(FRAME_END)
+
+    def send_method(self, channel_number: int, method) -> None:
+        if not self._output:
+            self.broker.pending_output.add(self)
+        self._output.append(pika.frame.Method(channel_number, method).marshal())
+
+    def send_content(self, channel_number: int, header, body) -> None:
+        self.send_frame(spec.FRAME_HEADER, channel_number, header)
+        chunk = self.frame_max - FRAME_HEADER.size - 1
+        if len(body) <= chunk:
+            if body:
+                self.send_frame(spec.FRAME_BODY, channel_number, body)
+            return
+        for start in range(0, len(body), chunk):
+            self.send_frame(spec.FRAME_BODY, channel_number, body[start:start + chunk])
+
+    def flush(self) -> None:
+        if self._output:
+            self.transport.write(b''.join(self._output))
+            self._output = []
+
+    def _schedule_heartbeat(self) -> None:
+        self._heartbeat_timer = asyncio.get_running_loop().call_later(
+            self.heartbeat / 2, self._send_heartbeat
+        )
+
+    def _send_heartbeat(self) -> None:
+        if self.transport.is_closing():
+            return
+        self.transport.write(HEARTBEAT_FRAME)
+        self._schedule_heartbeat()
+
+class Broker:
+    """Exchanges, queues and the connections using them, on one event loop."""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = config or BROKER_CONFIG
+        self.exchanges: Dict[str, Exchange] = {
+            'amq.direct': Exchange('amq.direct', 'direct', True),
+            'amq.fanout': Exchange('amq.fanout', 'fanout', True)
+        }
+        self.queues: Dict[str, Queue] = {}
+        # Queues with x-message-ttl, checked every expiry_interval
+        self.expiring: Set[Queue] = set()
+        self.connections: Set[Connection] = set()
+        # Work collected while handling a batch of frames, done once at the end
+        self.dirty: Set[Queue] = set()
+        self.pending_output: Set[Connection] = set()
+        self.server = None
+
+    def exchange(self, name: str, method_index: int = 0) -> Exchange:
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            raise ChannelException(NOT_FOUND, f"no exchange '{name}'", method_index)
+        return exchange
+
+    def queue(self, name: str, connection: Connection, method_index: int = 0) -> Queue:
+        queue = self.queues.get(name)
+        if queue is None:
+            raise ChannelException(NOT_FOUND, f"no queue '{name}'", method_index)
+        if queue.exclusive_owner is not None and queue.exclusive_owner is not connection:
+            raise ChannelException(RESOURCE_LOCKED, f"queue '{name}' is exclusive to another "
+                                   "connection", method_index)
+        return queue
+
+    def declare_queue(self, method: spec.Queue.Declare, connection: Connection) -> Queue:
+        name = method.queue or f'amq.gen-{uuid.uuid4().hex}'
+        queue = self.queues.get(name)
+        if queue is not None:
+            return self.queue(name, connection, method.INDEX)
+        if name.startswith('amq.') and method.queue:
+            raise ChannelException(ACCESS_REFUSED, "queue names starting with 'amq.' are "
+                                   "reserved", method.INDEX)
+        queue = self.queues[name] = Queue(
+            name, method.durable, connection if method.exclusive else None,
+            method.auto_delete, method.arguments
+        )
+        if queue.ttl is not None:
+            self.expiring.add(queue)
+        return queue
+
+    def delete_queue(self, queue: Queue) -> int:
+        for consumer in list(queue.consumers):
+            consumer.channel.connection.send_method(consumer.channel.number,
+                                                    spec.Basic.Cancel(consumer.tag, True))
+            self.cancel(consumer, auto_delete=False)
+        for exchange in self.exchanges.values():
+            exchange.unbind(queue)
+        self.queues.pop(queue.name, None)
+        self.dirty.discard(queue)
+        self.expiring.discard(queue)
+        return queue.purge()
+
+    def cancel(self, consumer: Consumer, auto_delete: bool = True) -> None:
+        consumer.channel.consumers.pop(consumer.tag, None)
+        queue = consumer.queue
+        try:
+            queue.consumers.remove(consumer)
+        except ValueError:
+            pass
+        if auto_delete and queue.auto_delete and not queue.consumers:
+            self.delete_queue(queue)
+
+    def drop_exclusive(self, connection: Connection) -> None:
+        for queue in [q for q in self.queues.values() if q.exclusive_owner is connection]:
+            self.delete_queue(queue)
+
+    def dead_letter(self, queue: Queue, message: Message) -> None:
+        """Republish a rejected or expired message to the queue's dead-letter exchange."""
+        exchange_name = queue.dead_letter_exchange
+        if exchange_name is None:
+            return
+        routing_key = queue.dead_letter_routing_key or message.routing_key
+        if exchange_name:
+            exchange = self.exchanges.get(exchange_name)
+            targets = exchange.route(routing_key) if exchange is not None else ()
+        else:
+            target = self.queues.get(routing_key)
+            targets = (target,) if target is not None else ()
+        dead = Message(exchange_name, routing_key,
+                       _short_string(exchange_name) + _short_string(routing_key),
+                       message.header, message.body)
+        for target in targets:
+            target.put(dead)
+            self.dirty.add(target)
+
+    def expire_messages(self) -> None:
+        """Periodic timer: dead-letter expired messages and deliver the results."""
+        now = time.monotonic()
+        for queue in list(self.expiring):
+            for message in queue.expire(now):
+                self.dead_letter(queue, message)
+        self.process()
+        asyncio.get_running_loop().call_later(self.config['expiry_interval'],
+                                              self.expire_messages)
+
+    def process(self) -> None:
+        """Dispatch to consumers of queues that changed, then write all output."""
+        while self.dirty:
+            self.dirty.pop().dispatch()
+        for connection in self.pending_output:
+            connection.flush()
+        self.pending_output.clear()
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None) -> None:
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: Connection(self),
+            host or self.config['host'],
+            port or self.config['port']
+        )
+        for sock in self.server.sockets:
+            logger.info(f"Broker listening on {sock.getsockname()}")
+        loop.call_later(self.config['expiry_interval'], self.expire_messages)
+
+    async def serve_forever(self, host: Optional[str] = None, port: Optional[int] = None) -> None:
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+def run(host: Optional[str] = None, port: Optional[int] = None) -> None:
+    """Run a broker until interrupted; also the target for a broker process."""
+    try:
+        asyncio.run(Broker().serve_forever(host, port))
+    except KeyboardInterrupt:
+        logger.info("Broker stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimal in-memory AMQP 0-9-1 broker")
+    parser.add_argument('--host', default=BROKER_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=BROKER_CONFIG['port'])
+    options = parser.parse_args(sys.argv[1:])
+    run(options.host, options.port)
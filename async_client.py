@@ -0,0 +1,353 @@
+import pika
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, UTC
+from typing import Dict, Any, Callable, List, Optional
+from pika.adapters.asyncio_connection import AsyncioConnection
+from config import (RABBITMQ_CONFIG, RETRY_CONFIG, PUBLISHER_CONFIG, PRIORITY_CONFIG,
+                    SHARDING_CONFIG)
+from message_codecs import CodecError, get_codec
+from message_ids import next_message_id
+from logging_setup import SampledLogger
+from payload_compression import Compressor
+from connection_helper import (topology, order_priority, order_routing_key, consumer_shards,
+                               shard_queue_name, priority_queue_name)
+from publisher import PendingPublish, pop_confirmed
+
+logger = logging.getLogger(__name__)
+# Per-message records, subject to LOGGING_CONFIG sampling
+message_log = SampledLogger(__name__)
+
+def connection_parameters() -> pika.ConnectionParameters:
+    credentials = pika.PlainCredentials(
+        RABBITMQ_CONFIG['credentials']['username'],
+        RABBITMQ_CONFIG['credentials']['password']
+    )
+    return pika.ConnectionParameters(
+        host=RABBITMQ_CONFIG['host'],
+        port=RABBITMQ_CONFIG['port'],
+        virtual_host=RABBITMQ_CONFIG['virtual_host'],
+        credentials=credentials,
+        heartbeat=600
+    )
+
+def _resolve(future: asyncio.Future) -> Callable[[Any], None]:
+    """Build a pika callback that completes future with its first argument."""
+    def callback(result: Any = None, *args) -> None:
+        if not future.done():
+            future.set_result(result)
+    return callback
+
+async def _rpc(method: Callable, *args, **kwargs) -> Any:
+    """Await a pika channel method that reports completion through callback=."""
+    future = asyncio.get_running_loop().create_future()
+    method(*args, callback=_resolve(future), **kwargs)
+    return await future
+
+async def connect_async() -> AsyncioConnection:
+    """Open an AsyncioConnection on the running loop with the usual retries."""
+    loop = asyncio.get_running_loop()
+
+    for attempt in range(RETRY_CONFIG['max_retries']):
+        opened = loop.create_future()
+
+        def on_open_error(connection, error, opened=opened):
+            if not opened.done():
+                if not isinstance(error, BaseException):
+                    error = pika.exceptions.AMQPConnectionError(error)
+                opened.set_exception(error)
+
+        AsyncioConnection(
+            connection_parameters(),
+            on_open_callback=_resolve(opened),
+            on_open_error_callback=on_open_error,
+            custom_ioloop=loop
+        )
+        try:
+            connection = await opened
+            logger.info("Successfully connected to RabbitMQ")
+            return connection
+        except Exception as e:
+            logger.error(f"Connection attempt {attempt + 1} failed: {str(e)}")
+            if attempt + 1 < RETRY_CONFIG['max_retries']:
+                await asyncio.sleep(RETRY_CONFIG['retry_delay'])
+            else:
+                raise
+
+async def open_channel(connection: AsyncioConnection) -> pika.channel.Channel:
+    future = asyncio.get_running_loop().create_future()
+    connection.channel(on_open_callback=_resolve(future))
+    return await future
+
+async def declare_topology(channel: pika.channel.Channel) -> None:
+    """Declare the same exchange, queues and bindings as the blocking clients."""
+    for method, arguments in topology():
+        await _rpc(getattr(channel, method), **arguments)
+
+async def _close_connection(connection: AsyncioConnection) -> None:
+    if connection.is_closed:
+        return
+    closed = asyncio.get_running_loop().create_future()
+    connection.add_on_close_callback(_resolve(closed))
+    if not connection.is_closing:
+        connection.close()
+    await closed
+
+class AsyncMessagePublisher:
+    """Publisher on a channel of an AsyncioConnection.
+
+    Several publishers (and consumers) can share one connection, each on its
+    own channel, all driven by a single event loop.
+    """
+
+    def __init__(self, connection: Optional[AsyncioConnection] = None,
+                 content_type: Optional[str] = None):
+        self.config = RABBITMQ_CONFIG
+        self.publisher_config = PUBLISHER_CONFIG
+        self.codec = get_codec(content_type or self.publisher_config['content_type'])
+        self.compressor = Compressor(
+            self.publisher_config['compression'],
+            threshold=self.publisher_config['compression_threshold'],
+            level=self.publisher_config['compression_level']
+        )
+        self.connection = connection
+        self._owns_connection = connection is None
+        self.channel = None
+        self._pending: 'OrderedDict[int, PendingPublish]' = OrderedDict()
+        self._next_delivery_tag = 1
+        self._window = None
+
+    async def connect(self) -> None:
+        if self.connection is None:
+            self.connection = await connect_async()
+        self.channel = await open_channel(self.connection)
+        self.channel.add_on_close_callback(self._on_channel_closed)
+        await declare_topology(self.channel)
+
+        self._pending.clear()
+        self._next_delivery_tag = 1
+        self._window = asyncio.Semaphore(self.publisher_config['max_in_flight'])
+        await _rpc(self.channel.confirm_delivery, ack_nack_callback=self._on_delivery_confirmation)
+
+    def _track(self, pending: PendingPublish) -> None:
+        self._pending[self._next_delivery_tag] = pending
+        self._next_delivery_tag += 1
+        self.channel.basic_publish(
+            exchange=self.config['exchange_name'],
+            routing_key=pending.routing_key,
+            body=pending.body,
+            properties=pending.properties
+        )
+
+    def _on_delivery_confirmation(self, frame: pika.frame.Method) -> None:
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for pending in pop_confirmed(self._pending, method.delivery_tag, method.multiple):
+            if pending.future.done():
+                continue
+            if acked:
+                pending.future.set_result(pending.message_id)
+            elif pending.attempts <= self.publisher_config['max_publish_retries']:
+                logger.warning(f"Message {pending.message_id} nacked by broker, "
+                               f"retrying (attempt {pending.attempts})")
+                pending.attempts += 1
+                self._track(pending)
+            else:
+                logger.error(f"Message {pending.message_id} nacked by broker, giving up")
+                pending.future.set_exception(
+                    Exception(f"Message {pending.message_id} was nacked by the broker")
+                )
+
+    def _on_channel_closed(self, channel: pika.channel.Channel, reason: Exception) -> None:
+        logger.warning(f"Publisher channel closed: {reason}")
+        while self._pending:
+            _, pending = self._pending.popitem(last=False)
+            if not pending.future.done():
+                pending.future.set_exception(reason)
+
+    async def publish_message(self, message_data: Dict[str, Any]) -> Any:
+        """Publish an order and wait for the broker to confirm it.
+
+        Publishes from concurrent tasks are pipelined on the channel, with at
+        most max_in_flight of them unconfirmed at any time.
+        """
+        message = {
+            'timestamp': datetime.now(UTC).isoformat(),
+            'data': message_data,
+            'message_id': next_message_id(),
+            'source': 'production_system'
+        }
+        body, compression = self.compressor.compress(self.codec.encode(message))
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # make message persistent
+            message_id=str(message['message_id']),
+            content_type=self.codec.content_type,
+            content_encoding=compression or self.codec.content_encoding,
+            priority=order_priority(message_data)
+        )
+
+        async with self._window:
+            future = asyncio.get_running_loop().create_future()
+            self._track(PendingPublish(
+                message['message_id'], order_routing_key(message_data),
+                body, properties, future
+            ))
+            try:
+                message_id = await asyncio.wait_for(
+                    future, self.publisher_config['confirm_timeout']
+                )
+            except Exception as e:
+                logger.error(f"Error publishing message: {str(e)}")
+                raise
+        message_log.info("Published message %s", message_id)
+        return message_id
+
+    async def close(self) -> None:
+        if self.channel is not None and self.channel.is_open:
+            self.channel.close()
+        if self._owns_connection and self.connection is not None:
+            await _close_connection(self.connection)
+
+class IncomingMessage:
+    """A decoded delivery handed out by AsyncMessageConsumer."""
+    __slots__ = ('channel', 'delivery_tag', 'properties', 'message')
+
+    def __init__(self, channel: pika.channel.Channel, delivery_tag: int,
+                 properties: pika.BasicProperties, message: Dict[str, Any]):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.properties = properties
+        self.message = message
+
+    def ack(self) -> None:
+        self.channel.basic_ack(delivery_tag=self.delivery_tag)
+
+    def nack(self, requeue: bool = True) -> None:
+        self.channel.basic_nack(delivery_tag=self.delivery_tag, requeue=requeue)
+
+class AsyncMessageConsumer:
+    """Consumer on a channel of an AsyncioConnection with an async-iterator API.
+
+        async for incoming in consumer:
+            ...
+            incoming.ack()
+    """
+
+    def __init__(self, connection: Optional[AsyncioConnection] = None, prefetch_count: int = 1,
+                 shards: Optional[List[int]] = None):
+        self.config = RABBITMQ_CONFIG
+        self.connection = connection
+        self._owns_connection = connection is None
+        self.prefetch_count = prefetch_count
+        self.shards = consumer_shards(shards)
+        self.channel = None
+        self.consumer_tags: List[str] = []
+        self.processed_count = 0
+        self.decompressor = Compressor()
+        self._deliveries: Optional[asyncio.Queue] = None
+
+    async def connect(self) -> None:
+        if self.connection is None:
+            self.connection = await connect_async()
+        self.channel = await open_channel(self.connection)
+        self.channel.add_on_close_callback(self._on_channel_closed)
+        await declare_topology(self.channel)
+
+    async def start(self) -> None:
+        """Set QoS and register the consumer; deliveries then feed the iterator."""
+        self._deliveries = asyncio.Queue()
+        await _rpc(self.channel.basic_qos, prefetch_count=self.prefetch_count)
+        queues = self.queue_names()
+        self.consumer_tags = [
+            self.channel.basic_consume(queue=queue, on_message_callback=self._on_message)
+            for queue in queues
+        ]
+        logger.info(f"Started consuming from queue: {', '.join(queues)}")
+
+    def queue_names(self) -> List[str]:
+        """This consumer's shards, the per-priority queues or the main queue.
+
+        Per-priority queues are consumed side by side on the one channel,
+        without MessageConsumer's weighted polling.
+        """
+        if SHARDING_CONFIG['shards']:
+            return [shard_queue_name(shard) for shard in self.shards]
+        if PRIORITY_CONFIG['per_priority_queues']:
+            return [priority_queue_name(level) for level in PRIORITY_CONFIG['levels']]
+        return [self.config['queue_name']]
+
+    def _on_message(self, channel, method, properties, body: bytes) -> None:
+        self._deliveries.put_nowait((method.delivery_tag, properties, body))
+
+    def _on_channel_closed(self, channel: pika.channel.Channel, reason: Exception) -> None:
+        logger.warning(f"Consumer channel closed: {reason}")
+        if self._deliveries is not None:
+            self._deliveries.put_nowait(None)
+
+    def validate_message(self, message: Dict[str, Any]) -> bool:
+        required_fields = ['timestamp', 'data', 'message_id', 'source']
+        return all(field in message for field in required_fields)
+
+    def __aiter__(self) -> 'AsyncMessageConsumer':
+        return self
+
+    async def __anext__(self) -> IncomingMessage:
+        while True:
+            delivery = await self._deliveries.get()
+            if delivery is None:
+                raise StopAsyncIteration
+            delivery_tag, properties, body = delivery
+            try:
+                body = self.decompressor.decompress(body, properties.content_encoding)
+                message = get_codec(properties.content_type).decode(body)
+            except CodecError as e:
+                logger.error(f"Error decoding message: {str(e)}")
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+                continue
+            if not self.validate_message(message):
+                logger.error("Invalid message format")
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+                continue
+            return IncomingMessage(self.channel, delivery_tag, properties, message)
+
+    async def process_message(self, message: Dict[str, Any]) -> None:
+        """Process the received message; mirrors MessageConsumer.process_message."""
+        order_data = message['data']
+        order_id = order_data.get('order_id', 'unknown')
+        priority = order_data.get('priority', 'unknown')
+
+        message_log.info("Processing order: %s", order_id)
+        if priority == 'high':
+            await asyncio.sleep(0.5)
+        elif priority == 'medium':
+            await asyncio.sleep(1)
+        else:
+            await asyncio.sleep(1.5)
+
+    async def run(self) -> None:
+        """Consume until stopped, acking processed orders and requeueing failures."""
+        async for incoming in self:
+            try:
+                await self.process_message(incoming.message)
+                incoming.ack()
+                self.processed_count += 1
+            except Exception as e:
+                logger.error(f"Error processing message: {str(e)}")
+                incoming.nack(requeue=True)
+        logger.info(f"Consumer stopped. Total messages processed: {self.processed_count}")
+
+    async def stop(self) -> None:
+        """Cancel the consumer; the iterator ends once buffered deliveries drain."""
+        if self.channel is not None and self.channel.is_open:
+            for consumer_tag in self.consumer_tags:
+                await _rpc(self.channel.basic_cancel, consumer_tag)
+        self.consumer_tags = []
+        if self._deliveries is not None:
+            self._deliveries.put_nowait(None)
+
+    async def close(self) -> None:
+        if self.channel is not None and self.channel.is_open:
+            self.channel.close()
+        if self._owns_connection and self.connection is not None:
+            await _close_connection(self.connection)
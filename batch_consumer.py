@@ -0,0 +1,202 @@
+import time
+import logging
+import functools
+from collections import OrderedDict
+from datetime import datetime, UTC
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from config import CONSUMER_CONFIG, BATCH_CONSUMER_CONFIG
+from consumer import (MessageConsumer, ACK, REJECT, REQUEUE, SETTLED, DUPLICATES,
+                      END_TO_END_LATENCY)
+from message_codecs import CodecError
+from logging_setup import SampledLogger
+import metrics
+
+logger = logging.getLogger(__name__)
+# Per-message records, subject to LOGGING_CONFIG sampling
+message_log = SampledLogger(__name__)
+
+BATCH_PROCESSING_TIME = metrics.histogram('amqp_batch_processing_seconds',
+                                          'Time spent in process_batch')
+BATCH_SIZE = metrics.histogram('amqp_batch_size', 'Messages per processed batch',
+                               buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+class BatchConsumer(MessageConsumer):
+    """MessageConsumer that hands deliveries to process_batch in groups.
+
+    Deliveries accumulate until batch_size have arrived or max_wait seconds
+    have passed since the first one. After process_batch the batch is
+    settled with one basic_ack(multiple=True) per channel; only messages
+    that failed to decode (rejected) or that process_batch reports as
+    failed (requeued) get their own basic_nack, which is sent first. With
+    retry queues enabled those are republished to their retry or
+    dead-letter queue instead and covered by the multiple ack.
+
+    Batches are processed one at a time and in delivery order, on a single
+    worker thread when worker_threads is set, so a multiple ack never
+    covers a delivery of a batch that is still being processed.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, max_wait: Optional[float] = None,
+                 worker_threads: Optional[int] = None):
+        self.batch_size = batch_size or BATCH_CONSUMER_CONFIG['batch_size']
+        self.max_wait = max_wait or BATCH_CONSUMER_CONFIG['max_wait']
+        self._batch: List[tuple] = []
+        self._batch_timer = None
+        if worker_threads is None:
+            worker_threads = CONSUMER_CONFIG['worker_threads']
+        super().__init__(worker_threads=min(worker_threads, 1))
+        # A batch can only fill if the broker lets that many deliveries be unacked
+        self.consumer_config = dict(
+            CONSUMER_CONFIG,
+            prefetch_count=max(CONSUMER_CONFIG['prefetch_count'], self.batch_size * 2)
+        )
+
+    def process_batch(self, messages: List[Dict[str, Any]]) -> Iterable[int]:
+        """Process a batch of decoded, valid messages.
+
+        Returns the indices of messages that failed and should be requeued;
+        raising requeues the whole batch. Override this for bulk sinks.
+        """
+        message_log.info("Processing batch of %d orders", len(messages))
+        for message in messages:
+            order_data = message['data']
+            message_log.info("Order %s: Status=%s, Priority=%s, Amount=$%s",
+                             order_data.get('order_id', 'unknown'), order_data.get('status'),
+                             order_data.get('priority'), order_data.get('total_amount', 0))
+        return ()
+
+    def dispatch_capacity(self) -> int:
+        return self.batch_size * 2
+
+    def callback(self, ch, method, properties, body: bytes) -> None:
+        self._outstanding += 1
+        if self.dedup is not None and properties.message_id is not None \
+                and properties.message_id in self.dedup:
+            message_log.info("Skipping duplicate message %s", properties.message_id)
+            DUPLICATES.inc()
+            self.settle(ch, method.delivery_tag, ACK)
+            return
+        self._batch.append((ch, method, properties, body))
+        if len(self._batch) >= self.batch_size:
+            self.flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self.connection.call_later(self.max_wait, self._on_batch_timeout)
+
+    def _on_batch_timeout(self) -> None:
+        self._batch_timer = None
+        self.flush_batch()
+
+    def flush_batch(self) -> None:
+        """Process the deliveries accumulated so far; must run on the connection thread."""
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        if self.executor is not None:
+            self.executor.submit(self._work_batch, batch)
+            return
+        self.settle_batch(self.handle_batch(batch))
+
+    def _work_batch(self, batch: List[tuple]) -> None:
+        settlements = self.handle_batch(batch)
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self.settle_batch, settlements)
+            )
+        except Exception as e:
+            # Connection is gone; the broker redelivers the unacked messages
+            logger.error(f"Could not schedule settling a batch of {len(batch)}: {str(e)}")
+
+    def handle_batch(self, batch: List[tuple]) -> List[Tuple[Any, int, str, tuple]]:
+        """Decode, validate and process a batch.
+
+        Returns (channel, delivery_tag, outcome, (routing_key, properties, body))
+        for each delivery, in order.
+        """
+        outcomes = [REJECT] * len(batch)
+        messages = []
+        positions = []
+        for index, (ch, method, properties, body) in enumerate(batch):
+            try:
+                message = self.decode(properties, body)
+            except CodecError as e:
+                logger.error(f"Error decoding message: {str(e)}")
+                continue
+            except Exception as e:
+                logger.error(f"Error decoding message: {str(e)}")
+                outcomes[index] = REQUEUE
+                continue
+            if not self.validate_message(message):
+                logger.error("Invalid message format")
+                continue
+            outcomes[index] = ACK
+            messages.append(message)
+            positions.append(index)
+
+        if messages:
+            started = time.perf_counter()
+            try:
+                failed = set(self.process_batch(messages) or ())
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(messages)} messages: {str(e)}")
+                failed = set(range(len(messages)))
+            elapsed = time.perf_counter() - started
+            BATCH_PROCESSING_TIME.observe(elapsed)
+            BATCH_SIZE.observe(len(messages))
+            if self.prefetch_controller is not None:
+                self.prefetch_controller.record_processing(elapsed / len(messages))
+
+            now = datetime.now(UTC)
+            acked = 0
+            for offset, (message, index) in enumerate(zip(messages, positions)):
+                if offset in failed:
+                    outcomes[index] = REQUEUE
+                    continue
+                try:
+                    END_TO_END_LATENCY.observe(
+                        (now - datetime.fromisoformat(message['timestamp'])).total_seconds()
+                    )
+                except (TypeError, ValueError):
+                    pass  # timestamp missing a timezone or not ISO 8601
+                acked += 1
+                message_id = batch[index][2].message_id
+                if self.dedup is not None and message_id is not None:
+                    self.dedup.add(message_id)
+            with self._count_lock:
+                self.processed_count += acked
+
+        return [(ch, method.delivery_tag, outcome, (method.routing_key, properties, body))
+                for (ch, method, properties, body), outcome in zip(batch, outcomes)]
+
+    def settle_batch(self, settlements: List[Tuple[Any, int, str, tuple]]) -> None:
+        """Nack the failures one by one, then ack the rest per channel in one frame."""
+        last_acked: Dict[Any, int] = OrderedDict()
+        for ch, delivery_tag, outcome, delivery in settlements:
+            SETTLED[outcome].inc()
+            if outcome != ACK:
+                outcome = self.route_failure(ch, outcome, delivery)
+            if outcome == ACK:
+                last_acked[ch] = max(delivery_tag, last_acked.get(ch, 0))
+            else:
+                ch.basic_nack(delivery_tag=delivery_tag, requeue=outcome == REQUEUE)
+        for ch, delivery_tag in last_acked.items():
+            ch.basic_ack(delivery_tag=delivery_tag, multiple=True)
+        self._outstanding -= len(settlements)
+        self._last_settled_at = time.perf_counter()
+        message_log.info("Settled batch of %d deliveries", len(settlements))
+
+    def stop_consuming(self) -> None:
+        """Process the partial batch, then stop; must run on the connection thread."""
+        self.flush_batch()
+        super().stop_consuming()
+
+if __name__ == "__main__":
+    consumer = BatchConsumer()
+    try:
+        consumer.start_consuming()
+    except KeyboardInterrupt:
+        logger.info("Shutting down consumer")
+    finally:
+        consumer.close()
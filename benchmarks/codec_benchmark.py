@@ -0,0 +1,36 @@
+"""Encode/decode cost and wire size of each registered codec.
+
+Run from the repository root:
+
+    python -m benchmarks.codec_benchmark [number_of_orders]
+"""
+import sys
+import timeit
+from datetime import datetime, UTC
+from message_codecs import CODECS
+from publisher import MessagePublisher
+
+def sample_messages(count: int):
+    return [
+        {
+            'timestamp': datetime.now(UTC).isoformat(),
+            'data': MessagePublisher.generate_random_order(),
+            'message_id': index,
+            'source': 'production_system'
+        }
+        for index in range(count)
+    ]
+
+def run(count: int = 10000) -> None:
+    messages = sample_messages(count)
+    print(f"{'codec':<30} {'encode us':>10} {'decode us':>10} {'avg bytes':>10}")
+    for content_type, codec in CODECS.items():
+        bodies = [codec.encode(message) for message in messages]
+        encode = min(timeit.repeat(lambda: [codec.encode(m) for m in messages], number=1, repeat=3))
+        decode = min(timeit.repeat(lambda: [codec.decode(b) for b in bodies], number=1, repeat=3))
+        size = sum(len(body) for body in bodies) / count
+        print(f"{content_type:<30} {encode / count * 1e6:>10.2f} "
+              f"{decode / count * 1e6:>10.2f} {size:>10.1f}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
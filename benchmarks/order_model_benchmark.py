@@ -0,0 +1,68 @@
+"""Decode cost and memory of typed order messages against plain dicts.
+
+The dict path is what MessageConsumer does by default: decode, check the
+four envelope keys, then read fields with .get. The typed path decodes,
+validates the whole order into order_model classes, then reads attributes.
+Memory is what holding every decoded message costs, measured with
+tracemalloc.
+
+Run from the repository root:
+
+    python -m benchmarks.order_model_benchmark [number_of_orders]
+"""
+import sys
+import gc
+import timeit
+import tracemalloc
+from message_codecs import JsonCodec
+from order_model import decode_order_message
+from benchmarks.codec_benchmark import sample_messages
+
+REQUIRED_FIELDS = ['timestamp', 'data', 'message_id', 'source']
+
+def dict_path(codec: JsonCodec, body: bytes) -> float:
+    message = codec.decode(body)
+    if not all(field in message for field in REQUIRED_FIELDS):
+        raise ValueError("Invalid message format")
+    order = message['data']
+    order.get('order_id', 'unknown')
+    order.get('status', 'unknown')
+    order.get('priority', 'unknown')
+    order.get('customer', {}).get('id')
+    order.get('shipping_address', {}).get('city')
+    return sum(item.get('item_total', 0) for item in order.get('items', ()))
+
+def typed_path(codec: JsonCodec, body: bytes) -> float:
+    message = decode_order_message(codec.decode(body))
+    order = message.data
+    order.order_id
+    order.status
+    order.priority
+    order.customer.id
+    order.shipping_address.city
+    return sum(item.item_total for item in order.items)
+
+def retained_bytes(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+def run(count: int = 10000) -> None:
+    codec = JsonCodec()
+    bodies = [codec.encode(message) for message in sample_messages(count)]
+    print(f"{'path':<8} {'us/msg':>8} {'bytes/msg':>10}")
+    for name, path, build in (
+        ('dict', dict_path, lambda: [codec.decode(body) for body in bodies]),
+        ('typed', typed_path,
+         lambda: [decode_order_message(codec.decode(body)) for body in bodies])
+    ):
+        seconds = min(timeit.repeat(lambda: [path(codec, body) for body in bodies],
+                                    number=1, repeat=3))
+        print(f"{name:<8} {seconds / count * 1e6:>8.2f} {retained_bytes(build) / count:>10.0f}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
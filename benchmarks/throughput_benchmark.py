@@ -0,0 +1,255 @@
+"""Publisher/consumer throughput and latency against a broker.
+
+Publishers and the consumer each run in their own process with their own
+connection. Publish-confirm latency is measured from handing a message (or,
+with --batch-size above 1, its batch) to MessagePublisher until the broker
+acks it; end-to-end latency from the message's timestamp field until the
+consumer processes it. Results are printed as JSON.
+
+With --embedded-broker the run uses amqp_broker in a separate process
+instead of an external RabbitMQ, so it needs no network.
+
+Run from the repository root:
+
+    python -m benchmarks.throughput_benchmark --messages 20000 --size 1024 \\
+        --batch-size 100 --prefetch 200 --publishers 2 --output result.json
+"""
+import sys
+import json
+import queue
+import socket
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, UTC
+from typing import Dict, Any, List
+from config import RABBITMQ_CONFIG, CONSUMER_CONFIG, PUBLISHER_CONFIG
+from message_codecs import get_codec
+from publisher import MessagePublisher
+from consumer import MessageConsumer
+from connection_helper import get_pool
+from metrics import percentiles
+import amqp_broker
+
+def sized_order(size: int, content_type: str) -> Dict[str, Any]:
+    """A random order padded with line items until its body is about size bytes."""
+    codec = get_codec(content_type)
+    order = MessagePublisher.generate_random_order()
+    envelope = {
+        'timestamp': datetime.now(UTC).isoformat(),
+        'data': order,
+        'message_id': 0,
+        'source': 'production_system'
+    }
+    while len(codec.encode(envelope)) < size and len(order['items']) < 255:
+        order['items'].append(dict(order['items'][-1]))
+    return order
+
+def configure(options: argparse.Namespace) -> None:
+    """Apply broker and client settings in this process."""
+    logging.getLogger().setLevel(options.log_level)
+    RABBITMQ_CONFIG['host'] = options.host
+    RABBITMQ_CONFIG['port'] = options.port
+    PUBLISHER_CONFIG['max_in_flight'] = options.max_in_flight
+    CONSUMER_CONFIG['prefetch_count'] = options.prefetch
+
+class BenchmarkConsumer(MessageConsumer):
+    """MessageConsumer with no-op processing that stops after a set count."""
+
+    def __init__(self, expected: int, **kwargs):
+        self.expected = expected
+        self.latencies: List[float] = []
+        self.first_at = None
+        self.last_at = None
+        self._benchmark_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def process_message(self, message: Dict[str, Any]) -> None:
+        now = datetime.now(UTC)
+        latency = (now - datetime.fromisoformat(message['timestamp'])).total_seconds()
+        with self._benchmark_lock:
+            self.latencies.append(latency)
+            self.last_at = time.perf_counter()
+            if self.first_at is None:
+                self.first_at = self.last_at
+            if len(self.latencies) == self.expected:
+                self.request_stop()
+
+def run_consumer(options: argparse.Namespace, ready, results) -> None:
+    configure(options)
+    consumer = BenchmarkConsumer(options.messages, worker_threads=options.consumer_workers)
+    ready.set()
+    consumer.start_consuming()
+    get_pool().close()
+    count = len(consumer.latencies)
+    seconds = (consumer.last_at - consumer.first_at) if count > 1 else 0.0
+    results.put(('consumer', {
+        'messages': count,
+        'seconds': seconds,
+        'rate': count / seconds if seconds > 0 else 0.0,
+        'latencies': consumer.latencies
+    }))
+
+def run_publisher(options: argparse.Namespace, count: int, start, results) -> None:
+    configure(options)
+    publisher = MessagePublisher(confirm_delivery=options.confirm,
+                                 content_type=options.content_type)
+    template = sized_order(options.size, options.content_type)
+    orders = [dict(template, order_id=f'ORD{index}') for index in range(count)]
+    latencies: List[float] = []
+
+    def on_confirm(future, sent_at: float = 0.0) -> None:
+        if future.exception() is None:
+            latencies.append(time.perf_counter() - sent_at)
+
+    start.wait()
+    started = time.perf_counter()
+    for offset in range(0, count, options.batch_size):
+        sent_at = time.perf_counter()
+        callback = lambda future, sent_at=sent_at: on_confirm(future, sent_at)
+        if options.batch_size == 1:
+            publisher.publish_message(orders[offset], on_confirm=callback)
+        else:
+            publisher.publish_batch(orders[offset:offset + options.batch_size], on_confirm=callback)
+    publisher.wait_for_confirms()
+    finished = time.perf_counter()
+    publisher.close()
+    get_pool().close()
+    results.put(('publisher', {
+        'messages': count,
+        'started': started,
+        'finished': finished,
+        'latencies': latencies
+    }))
+
+def start_embedded_broker(host: str, port: int, timeout: float = 10) -> multiprocessing.Process:
+    """Run amqp_broker in a child process and wait until it accepts connections."""
+    process = multiprocessing.Process(target=amqp_broker.run, args=(host, port),
+                                      name='benchmark-broker', daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise
+            time.sleep(0.05)
+
+def run(options: argparse.Namespace) -> Dict[str, Any]:
+    configure(options)
+    broker = start_embedded_broker(options.host, options.port) if options.embedded_broker else None
+    with get_pool().channel() as channel:
+        channel.queue_purge(queue=RABBITMQ_CONFIG['queue_name'])
+    # Children open their own connections; don't hand them this one's socket
+    get_pool().close()
+
+    results = multiprocessing.Queue()
+    ready = multiprocessing.Event()
+    start = multiprocessing.Event()
+    consumer = multiprocessing.Process(target=run_consumer, args=(options, ready, results),
+                                       name='benchmark-consumer')
+    consumer.start()
+    shares = [options.messages // options.publishers] * options.publishers
+    shares[0] += options.messages - sum(shares)
+    publishers = [
+        multiprocessing.Process(target=run_publisher, args=(options, share, start, results),
+                                name=f'benchmark-publisher-{index}')
+        for index, share in enumerate(shares)
+    ]
+    for process in publishers:
+        process.start()
+    ready.wait(options.timeout)
+    start.set()
+
+    reports = {'publisher': [], 'consumer': []}
+    deadline = time.monotonic() + options.timeout
+    while len(reports['publisher']) + len(reports['consumer']) < len(publishers) + 1:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            role, report = results.get(timeout=remaining)
+        except queue.Empty:
+            break
+        reports[role].append(report)
+    for process in publishers + [consumer]:
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+    if broker is not None:
+        broker.terminate()
+        broker.join()
+
+    published = sum(report['messages'] for report in reports['publisher'])
+    publish_seconds = (
+        max(report['finished'] for report in reports['publisher'])
+        - min(report['started'] for report in reports['publisher'])
+    ) if reports['publisher'] else 0.0
+    consumed = reports['consumer'][0] if reports['consumer'] else \
+        {'messages': 0, 'seconds': 0.0, 'rate': 0.0, 'latencies': []}
+    return {
+        'config': {
+            'messages': options.messages,
+            'size': options.size,
+            'content_type': options.content_type,
+            'batch_size': options.batch_size,
+            'prefetch': options.prefetch,
+            'publishers': options.publishers,
+            'consumer_workers': options.consumer_workers,
+            'confirm': options.confirm,
+            'broker': 'embedded' if options.embedded_broker else f'{options.host}:{options.port}'
+        },
+        'publish': {
+            'messages': published,
+            'seconds': publish_seconds,
+            'rate': published / publish_seconds if publish_seconds > 0 else 0.0,
+            'confirm_latency_ms': percentiles(
+                [sample for report in reports['publisher'] for sample in report['latencies']]
+            )
+        },
+        'consume': {
+            'messages': consumed['messages'],
+            'seconds': consumed['seconds'],
+            'rate': consumed['rate'],
+            'end_to_end_latency_ms': percentiles(consumed['latencies'])
+        },
+        'complete': published == options.messages and consumed['messages'] == options.messages
+    }
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=RABBITMQ_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=RABBITMQ_CONFIG['port'])
+    parser.add_argument('--embedded-broker', action='store_true',
+                        help='run amqp_broker locally instead of using an external broker')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=0, help='minimum body size in bytes')
+    parser.add_argument('--content-type', default=PUBLISHER_CONFIG['content_type'])
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='messages per publish_batch call; 1 uses publish_message')
+    parser.add_argument('--prefetch', type=int, default=100)
+    parser.add_argument('--publishers', type=int, default=1, help='publisher processes')
+    parser.add_argument('--consumer-workers', type=int, default=0,
+                        help='consumer worker threads (0 processes on the connection thread)')
+    parser.add_argument('--max-in-flight', type=int, default=PUBLISHER_CONFIG['max_in_flight'])
+    parser.add_argument('--no-confirm', dest='confirm', action='store_false',
+                        help='publish without publisher confirms')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    result = run(options)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    sys.exit(0 if result['complete'] else 1)
@@ -25,15 +25,173 @@ RETRY_CONFIG = {
     }
 }
 
+# Connection Pool Configuration
+POOL_CONFIG = {
+    'max_connections': 1,  # Long-lived connections shared by a process
+    'max_idle_channels': 8  # Idle channels kept open per connection
+}
+
+# Publisher Configuration
+PUBLISHER_CONFIG = {
+    'confirm_delivery': False,  # Enable pipelined publisher confirms
+    'max_in_flight': 1000,  # Unconfirmed publishes allowed on the wire
+    'max_publish_retries': 3,  # Re-publish attempts for nacked messages
+    'confirm_timeout': 30,  # seconds
+    'batch_size': 500,  # Orders per batch in publish_stream
+    'content_type': 'application/json',  # Codec: application/json, application/msgpack,
+                                         # application/x-order-struct
+    'compression': None,  # None, 'zlib' or 'lzma'
+    'compression_threshold': 1024,  # bytes; smaller bodies are sent uncompressed
+    'compression_level': 6
+}
+
+# Priority Configuration
+PRIORITY_CONFIG = {
+    # x-max-priority for the main queue; 0 keeps a classic non-priority queue.
+    # An existing queue must be deleted before this can be changed.
+    'max_priority': 0,
+    'levels': {'high': 9, 'medium': 5, 'low': 1},  # order 'priority' -> AMQP priority
+    'per_priority_queues': False,  # Route each level to its own queue
+    'weights': {'high': 6, 'medium': 3, 'low': 1}  # Consumer polling weights per level
+}
+
+# Sharding Configuration
+SHARDING_CONFIG = {
+    # Spread orders over this many shard queues by consistent hashing of
+    # 'key'; takes the place of per-priority queues. 0 keeps a single queue.
+    'shards': 0,
+    'key': 'customer.id',  # Dotted path into the order; equal keys share a shard
+    'virtual_nodes': 64,  # Hash ring points per shard
+    'consumer_shards': None,  # Shards a standalone consumer reads; None reads all
+    # Only one consumer per shard receives at a time, keeping per-key order
+    # while the supervisor moves shards between workers
+    'single_active_consumer': True
+}
+
+# Publisher Outbox Configuration
+OUTBOX_CONFIG = {
+    'enabled': False,  # Spool to disk while the broker is down or blocking
+    'directory': 'outbox',  # One directory per publisher process
+    'segment_size': 64 * 1024 * 1024,  # bytes per segment file
+    'fsync_interval': 0.05,  # seconds between batched fsyncs
+    'drain_interval': 1.0,  # seconds between outbox checks when idle
+    'drain_batch_size': 500  # records replayed per confirm round-trip
+}
+
+# Message ID Configuration
+# The default node id hashes host name and pid into 10 bits, so publishers
+# on different hosts can draw the same node and mint the same IDs. Give
+# every publishing process its own node_id before turning on deduplication.
+MESSAGE_ID_CONFIG = {
+    'node_id': None  # 0-1023, unique per publishing process; None derives it from host and pid
+}
+
+# Consumer Deduplication Configuration
+DEDUP_CONFIG = {
+    'enabled': False,  # Skip deliveries whose message_id was already processed; needs unique node_ids
+    'max_entries': 100000,  # IDs remembered exactly (LRU)
+    'bloom_capacity': 0,  # > 0 also remembers IDs in Bloom filters of this size
+    'bloom_error_rate': 0.0001  # Share of new IDs a Bloom filter mistakes for duplicates
+}
+
+# Consumer Configuration
+CONSUMER_CONFIG = {
+    'prefetch_count': 1,
+    'worker_threads': 0,  # 0 processes messages on the connection thread
+    # Dotted path into the message (e.g. 'data.customer.id'); with worker
+    # threads, messages sharing the key are processed one at a time, in order
+    'ordering_key': None,
+    'max_lane_depth': 100,  # messages queued per key before more are held back
+    # Decode into order_model classes, rejecting malformed orders before processing
+    'typed_orders': False,
+    'adaptive_prefetch': False,  # Tune prefetch from processing time and broker RTT
+    'min_prefetch': 1,
+    'max_prefetch': 500,
+    'prefetch_interval': 5  # seconds between prefetch re-evaluations
+}
+
+# Retry Queues Configuration
+RETRY_QUEUES_CONFIG = {
+    # Retry failed deliveries through TTL queues instead of requeueing them
+    # at once; after the last delay they go to the dead-letter queue
+    'enabled': False,
+    'delays': [1, 10, 60]  # seconds, one retry queue per delay
+}
+
+# Batch Consumer Configuration
+BATCH_CONSUMER_CONFIG = {
+    'batch_size': 100,  # deliveries per process_batch call
+    'max_wait': 0.5  # seconds a partial batch waits for more deliveries
+}
+
+# Consumer Supervisor Configuration
+SUPERVISOR_CONFIG = {
+    'workers': 0,  # 0 starts one consumer process per CPU
+    'restart_backoff': 1,  # seconds, doubled for each consecutive crash
+    'max_restart_backoff': 60,  # seconds
+    'stable_after': 60,  # seconds a worker must run before its backoff resets
+    'shutdown_timeout': 30,  # seconds to wait for workers to drain
+    'status_interval': 30  # seconds between processed-count reports
+}
+
+# Autoscale Configuration
+AUTOSCALE_CONFIG = {
+    'enabled': False,  # size the supervisor's workers from queue depth
+    'min_workers': 1,
+    'max_workers': 8,
+    'interval': 5,  # seconds between queue depth samples
+    'target_drain_seconds': 60,  # clear a backlog within this long
+    'scale_up_cooldown': 15,  # seconds between scale-ups
+    'scale_down_cooldown': 120,  # seconds a lower count must hold before each step down
+    'smoothing': 0.3  # weight of the newest rate sample
+}
+
+# Threaded Publisher Configuration
+THREADED_PUBLISHER_CONFIG = {
+    'io_threads': 1,  # publisher threads, each with its own connection
+    'max_queue': 10000,  # queued messages per I/O thread before publish() blocks
+    'max_batch': 500,  # messages sent per flush
+    'idle_interval': 1.0  # seconds an idle I/O thread waits between checks
+}
+
+# Scheduler Configuration
+SCHEDULER_CONFIG = {
+    'burst': 1,  # token bucket depth: messages that may go out at once
+    'max_batch': 500,  # most messages written per flush while catching up
+    'report_interval': 5  # seconds between achieved-rate log lines
+}
+
+# Metrics Configuration
+METRICS_CONFIG = {
+    'enabled': False,  # Serve Prometheus metrics over HTTP
+    'host': 'localhost',
+    'port': 9108  # Supervised consumer workers use port + 1 + worker index
+}
+
+# Local Broker Configuration (amqp_broker.py)
+BROKER_CONFIG = {
+    'host': 'localhost',
+    'port': 5672,
+    'frame_max': 131072,
+    'channel_max': 2047,
+    'heartbeat': 60,  # seconds proposed to clients; 0 disables heartbeats
+    'expiry_interval': 0.05  # seconds between checks for expired (TTL) messages
+}
+
+# Logging Configuration
+LOGGING_CONFIG = {
+    'level': logging.INFO,
+    'file': 'amqp_operations.log',
+    'max_bytes': 50 * 1024 * 1024,  # Rotate the log file at this size
+    'backup_count': 5,
+    'queue': True,  # Format and write records on a background thread
+    'sample_rate': 1,  # Keep 1 in N per-message records (warnings and errors are always kept)
+    'rate_limit': 0  # Max per-message records per second, 0 for no limit
+}
+
 # Setup logging with more detailed formatting
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s',
-    handlers=[
-        logging.FileHandler('amqp_operations.log'),
-        logging.StreamHandler()
-    ]
-)
+from logging_setup import setup_logging
+setup_logging(LOGGING_CONFIG)
 
 # Add log level for connection issues
 logging.getLogger('pika').setLevel(logging.WARNING)
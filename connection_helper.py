@@ -1,22 +1,167 @@
+import os
 import pika
 import time
+import atexit
 import logging
-from typing import Tuple
-from config import RABBITMQ_CONFIG, RETRY_CONFIG
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+from pika.adapters.blocking_connection import BlockingChannel
+from config import (RABBITMQ_CONFIG, RETRY_CONFIG, PRIORITY_CONFIG, POOL_CONFIG,
+                    RETRY_QUEUES_CONFIG, SHARDING_CONFIG)
+from sharding import get_ring, order_key
+import metrics
 
 logger = logging.getLogger(__name__)
 
-def create_connection() -> Tuple[pika.BlockingConnection, pika.channel.Channel]:
-    """Create a connection to RabbitMQ with error handling."""
+RECONNECTS = metrics.counter('amqp_reconnects_total',
+                             'Connections opened to replace ones that were lost')
+
+def priority_queue_name(level: str) -> str:
+    return f"{RABBITMQ_CONFIG['queue_name']}.{level}"
+
+def priority_routing_key(level: str) -> str:
+    return f"{RABBITMQ_CONFIG['routing_key']}.{level}"
+
+def shard_queue_name(shard: int) -> str:
+    return f"{RABBITMQ_CONFIG['queue_name']}.shard.{shard}"
+
+def shard_routing_key(shard: int) -> str:
+    return f"{RABBITMQ_CONFIG['routing_key']}.shard.{shard}"
+
+def consumer_shards(shards: Optional[List[int]] = None) -> List[int]:
+    """Shards one consumer reads: those given, else consumer_shards, else all."""
+    if shards is None:
+        shards = SHARDING_CONFIG['consumer_shards']
+    if shards is None:
+        shards = range(SHARDING_CONFIG['shards'])
+    return list(shards)
+
+def consumed_queues() -> List[Tuple[str, str]]:
+    """(queue, routing key) of every queue the consumers read from."""
+    if SHARDING_CONFIG['shards']:
+        return [(shard_queue_name(shard), shard_routing_key(shard))
+                for shard in range(SHARDING_CONFIG['shards'])]
+    if PRIORITY_CONFIG['per_priority_queues']:
+        return [(priority_queue_name(level), priority_routing_key(level))
+                for level in PRIORITY_CONFIG['levels']]
+    return [(RABBITMQ_CONFIG['queue_name'], RABBITMQ_CONFIG['routing_key'])]
+
+def retry_queue_name(queue: str, delay: float) -> str:
+    return f"{queue}.retry.{delay:g}s"
+
+def dead_letter_queue_name(queue: str) -> str:
+    return f"{queue}.dead"
+
+def topology() -> List[Tuple[str, Dict[str, Any]]]:
+    """Channel method calls that declare the exchange, queues and bindings.
+
+    Shared by the blocking and asyncio clients so every client declares the
+    same topology with the same arguments.
+    """
+    queue_arguments = None
+    if PRIORITY_CONFIG['max_priority']:
+        queue_arguments = {'x-max-priority': PRIORITY_CONFIG['max_priority']}
+
+    declarations = [
+        ('exchange_declare', {
+            'exchange': RABBITMQ_CONFIG['exchange_name'],
+            'exchange_type': 'direct',
+            'durable': True
+        }),
+        ('queue_declare', {
+            'queue': RABBITMQ_CONFIG['queue_name'],
+            'durable': True,
+            'arguments': queue_arguments
+        }),
+        ('queue_bind', {
+            'exchange': RABBITMQ_CONFIG['exchange_name'],
+            'queue': RABBITMQ_CONFIG['queue_name'],
+            'routing_key': RABBITMQ_CONFIG['routing_key']
+        })
+    ]
+
+    if SHARDING_CONFIG['shards']:
+        shard_arguments = dict(queue_arguments or {})
+        if SHARDING_CONFIG['single_active_consumer']:
+            shard_arguments['x-single-active-consumer'] = True
+        for queue, routing_key in consumed_queues():
+            declarations.append(('queue_declare', {
+                'queue': queue,
+                'durable': True,
+                'arguments': shard_arguments or None
+            }))
+            declarations.append(('queue_bind', {
+                'exchange': RABBITMQ_CONFIG['exchange_name'],
+                'queue': queue,
+                'routing_key': routing_key
+            }))
+    elif PRIORITY_CONFIG['per_priority_queues']:
+        for level in PRIORITY_CONFIG['levels']:
+            declarations.append(('queue_declare', {
+                'queue': priority_queue_name(level),
+                'durable': True
+            }))
+            declarations.append(('queue_bind', {
+                'exchange': RABBITMQ_CONFIG['exchange_name'],
+                'queue': priority_queue_name(level),
+                'routing_key': priority_routing_key(level)
+            }))
+
+    if RETRY_QUEUES_CONFIG['enabled']:
+        for queue, routing_key in consumed_queues():
+            # Nothing consumes a retry queue: messages wait out its TTL and are
+            # dead-lettered back to the main exchange with the queue's routing key
+            for delay in RETRY_QUEUES_CONFIG['delays']:
+                declarations.append(('queue_declare', {
+                    'queue': retry_queue_name(queue, delay),
+                    'durable': True,
+                    'arguments': {
+                        'x-message-ttl': int(delay * 1000),
+                        'x-dead-letter-exchange': RABBITMQ_CONFIG['exchange_name'],
+                        'x-dead-letter-routing-key': routing_key
+                    }
+                }))
+            declarations.append(('queue_declare', {
+                'queue': dead_letter_queue_name(queue),
+                'durable': True
+            }))
+    return declarations
+
+def declare_topology(channel: BlockingChannel) -> None:
+    for method, arguments in topology():
+        getattr(channel, method)(**arguments)
+
+def order_priority(order: Dict[str, Any]) -> Optional[int]:
+    """AMQP priority for an order, or None when the queue has no priorities."""
+    if not PRIORITY_CONFIG['max_priority']:
+        return None
+    levels = PRIORITY_CONFIG['levels']
+    return levels.get(order.get('priority'), min(levels.values()))
+
+def order_routing_key(order: Dict[str, Any]) -> str:
+    """Routing key for an order, honouring shards and per-priority queues."""
+    if SHARDING_CONFIG['shards']:
+        ring = get_ring(SHARDING_CONFIG['shards'], SHARDING_CONFIG['virtual_nodes'])
+        return shard_routing_key(ring.shard_for(order_key(order, SHARDING_CONFIG['key'])))
+    if PRIORITY_CONFIG['per_priority_queues']:
+        level = order.get('priority')
+        if level not in PRIORITY_CONFIG['levels']:
+            level = min(PRIORITY_CONFIG['levels'], key=PRIORITY_CONFIG['levels'].get)
+        return priority_routing_key(level)
+    return RABBITMQ_CONFIG['routing_key']
+
+def open_connection(max_retries: Optional[int] = None,
+                    connection_attempts: int = 3) -> pika.BlockingConnection:
+    """Open a BlockingConnection to RabbitMQ with error handling and retries."""
+    if max_retries is None:
+        max_retries = RETRY_CONFIG['max_retries']
     credentials = pika.PlainCredentials(
         RABBITMQ_CONFIG['credentials']['username'],
         RABBITMQ_CONFIG['credentials']['password']
     )
     
-    connection = None
-    channel = None
-    
-    for attempt in range(RETRY_CONFIG['max_retries']):
+    for attempt in range(max_retries):
         try:
             connection = pika.BlockingConnection(
                 pika.ConnectionParameters(
@@ -25,32 +170,12 @@ def create_connection() -> Tuple[pika.BlockingConnection, pika.channel.Channel]:
                     virtual_host=RABBITMQ_CONFIG['virtual_host'],
                     credentials=credentials,
                     heartbeat=600,
-                    connection_attempts=3,
+                    connection_attempts=connection_attempts,
                     retry_delay=2
                 )
             )
-            channel = connection.channel()
-            
-            # Declare exchange and queue
-            channel.exchange_declare(
-                exchange=RABBITMQ_CONFIG['exchange_name'],
-                exchange_type='direct',
-                durable=True
-            )
-            
-            channel.queue_declare(
-                queue=RABBITMQ_CONFIG['queue_name'],
-                durable=True
-            )
-            
-            channel.queue_bind(
-                exchange=RABBITMQ_CONFIG['exchange_name'],
-                queue=RABBITMQ_CONFIG['queue_name'],
-                routing_key=RABBITMQ_CONFIG['routing_key']
-            )
-            
             logger.info("Successfully connected to RabbitMQ")
-            return connection, channel
+            return connection
             
         except pika.exceptions.AMQPConnectionError as e:
             error_msg = str(e).lower()
@@ -61,9 +186,151 @@ def create_connection() -> Tuple[pika.BlockingConnection, pika.channel.Channel]:
             else:
                 logger.error(f"{RETRY_CONFIG['error_messages']['unknown']} Error: {str(e)}")
             
-            if attempt + 1 < RETRY_CONFIG['max_retries']:
+            if attempt + 1 < max_retries:
                 time.sleep(RETRY_CONFIG['retry_delay'])
             else:
                 raise Exception("Failed to connect to RabbitMQ after multiple attempts")
-    
-    return None, None
+
+class ConnectionPool:
+    """Long-lived connections that hand out channels with the topology declared.
+
+    The topology is declared on the first channel of each connection and
+    skipped for later channels on it. A replacement connection declares it
+    again, since the broker may have restarted and lost the queues.
+    Channels must be used from the thread that acquired them (pika
+    connections are not thread-safe); the pool's own bookkeeping is.
+    """
+
+    def __init__(self, max_connections: Optional[int] = None,
+                 max_idle_channels: Optional[int] = None):
+        self.max_connections = max_connections or POOL_CONFIG['max_connections']
+        self.max_idle_channels = max_idle_channels or POOL_CONFIG['max_idle_channels']
+        self._connections: List[pika.BlockingConnection] = []
+        self._idle: Dict[int, List[BlockingChannel]] = {}
+        self._leased: Dict[int, int] = {}
+        self._declared: Dict[int, Set[str]] = {}
+        self._lock = threading.RLock()
+        self._opened = 0
+
+    def _prune(self) -> None:
+        """Forget closed connections along with their idle channels."""
+        for connection in [c for c in self._connections if not c.is_open]:
+            self._connections.remove(connection)
+            self._idle.pop(id(connection), None)
+            self._leased.pop(id(connection), None)
+            self._declared.pop(id(connection), None)
+
+    def get_connection(self, max_retries: Optional[int] = None,
+                       connection_attempts: int = 3) -> pika.BlockingConnection:
+        """Return a live connection, opening one if the pool is not full.
+
+        Once full, the connection with the fewest leased channels is reused.
+        The retry arguments are passed to open_connection().
+        """
+        with self._lock:
+            self._prune()
+            if len(self._connections) < self.max_connections:
+                connection = open_connection(max_retries, connection_attempts)
+                if self._opened >= self.max_connections:
+                    RECONNECTS.inc()
+                self._opened += 1
+                self._connections.append(connection)
+                self._idle[id(connection)] = []
+                self._leased[id(connection)] = 0
+                self._declared[id(connection)] = set()
+                return connection
+            return min(self._connections, key=lambda c: self._leased[id(c)])
+
+    def acquire_channel(self, connection: Optional[pika.BlockingConnection] = None) -> BlockingChannel:
+        """Hand out an open channel, reusing idle ones before opening new ones."""
+        with self._lock:
+            if connection is None or not connection.is_open:
+                connection = self.get_connection()
+            idle = self._idle[id(connection)]
+            channel = None
+            while idle:
+                candidate = idle.pop()
+                if candidate.is_open:
+                    channel = candidate
+                    break
+            if channel is None:
+                channel = connection.channel()
+            self.ensure_topology(channel)
+            self._leased[id(connection)] += 1
+            return channel
+
+    def ensure_topology(self, channel: BlockingChannel) -> None:
+        with self._lock:
+            # Keyed by the declarations themselves so a config change redeclares
+            declarations = repr(topology())
+            declared = self._declared.setdefault(id(channel.connection), set())
+            if declarations not in declared:
+                declare_topology(channel)
+                declared.add(declarations)
+
+    def invalidate_topology(self) -> None:
+        """Force the next channel to redeclare (e.g. after queues were deleted)."""
+        with self._lock:
+            for declared in self._declared.values():
+                declared.clear()
+
+    def release_channel(self, channel: BlockingChannel, reusable: bool = True) -> None:
+        """Return a channel to the pool.
+
+        Channels that carry state (consumers, confirm mode, QoS) must be
+        released with reusable=False; they are closed instead of pooled.
+        """
+        with self._lock:
+            key = id(channel.connection)
+            if key in self._leased:
+                self._leased[key] -= 1
+            idle = self._idle.get(key)
+            if reusable and idle is not None and channel.is_open \
+                    and len(idle) < self.max_idle_channels:
+                idle.append(channel)
+            elif channel.is_open:
+                channel.close()
+
+    @contextmanager
+    def channel(self) -> Iterator[BlockingChannel]:
+        channel = self.acquire_channel()
+        try:
+            yield channel
+        finally:
+            self.release_channel(channel)
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                if connection.is_open:
+                    connection.close()
+            self._connections.clear()
+            self._idle.clear()
+            self._leased.clear()
+            self._declared.clear()
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+
+def get_pool() -> ConnectionPool:
+    """The process-wide pool; a forked child gets its own."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ConnectionPool()
+        _pool_pid = os.getpid()
+    return _pool
+
+@atexit.register
+def _close_pool() -> None:
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+
+def create_connection() -> Tuple[pika.BlockingConnection, BlockingChannel]:
+    """Create a connection to RabbitMQ with error handling.
+
+    Both come from the shared pool, so repeated calls reuse the connection
+    and skip the topology declarations after the first.
+    """
+    pool = get_pool()
+    connection = pool.get_connection()
+    return connection, pool.acquire_channel(connection)
@@ -1,66 +1,89 @@
 import pika
-import json
+import pika.exceptions
 import logging
 import time
-from typing import Dict, Any
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, UTC
-from config import RABBITMQ_CONFIG, RETRY_CONFIG
+from message_codecs import CodecError, get_codec
+from payload_compression import Compressor
+from dedup_cache import DedupCache
+from keyed_dispatcher import KeyedDispatcher
+from order_model import decode_order_message
+from sharding import order_key
+from connection_helper import get_pool, priority_queue_name, shard_queue_name, consumer_shards
+from config import (RABBITMQ_CONFIG, CONSUMER_CONFIG, PRIORITY_CONFIG, DEDUP_CONFIG,
+                    METRICS_CONFIG, RETRY_QUEUES_CONFIG, SHARDING_CONFIG)
+from prefetch_controller import AdaptivePrefetchController
+from retry_queues import RetryRouter
+from logging_setup import SampledLogger
+import metrics
 
 logger = logging.getLogger(__name__)
+# Per-message records, subject to LOGGING_CONFIG sampling
+message_log = SampledLogger(__name__)
+
+# Delivery outcomes returned by MessageConsumer.handle_delivery
+ACK = 'ack'
+REJECT = 'reject'  # nack without requeue
+REQUEUE = 'requeue'  # nack and requeue
+
+SETTLED = {
+    outcome: metrics.counter('amqp_messages_consumed_total', 'Deliveries settled, by outcome',
+                             outcome=outcome)
+    for outcome in (ACK, REJECT, REQUEUE)
+}
+DUPLICATES = metrics.counter('amqp_duplicates_skipped_total',
+                             'Deliveries acked without processing as already processed')
+PROCESSING_TIME = metrics.histogram('amqp_processing_seconds', 'Time spent in process_message')
+END_TO_END_LATENCY = metrics.histogram('amqp_end_to_end_seconds',
+                                       'Time from the message timestamp until it was processed')
 
 class MessageConsumer:
-    def __init__(self):
+    def __init__(self, worker_threads: Optional[int] = None,
+                 shards: Optional[List[int]] = None):
         self.config = RABBITMQ_CONFIG
+        self.consumer_config = CONSUMER_CONFIG
+        self.priority_config = PRIORITY_CONFIG
+        if worker_threads is None:
+            worker_threads = self.consumer_config['worker_threads']
+        self.worker_threads = worker_threads
+        self.shards = consumer_shards(shards)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.dispatcher: Optional[KeyedDispatcher] = None
+        self._count_lock = threading.Lock()
+        self.decompressor = Compressor()
+        self.dedup: Optional[DedupCache] = None
+        if DEDUP_CONFIG['enabled']:
+            self.dedup = DedupCache(
+                DEDUP_CONFIG['max_entries'],
+                bloom_capacity=DEDUP_CONFIG['bloom_capacity'],
+                error_rate=DEDUP_CONFIG['bloom_error_rate']
+            )
+        self.prefetch_controller: Optional[AdaptivePrefetchController] = None
+        self.retry_router: Optional[RetryRouter] = None
+        if RETRY_QUEUES_CONFIG['enabled']:
+            self.retry_router = RetryRouter()
+        if METRICS_CONFIG['enabled']:
+            metrics.start_metrics_server()
+        self._outstanding = 0
+        self._last_settled_at = None
+        self._consuming = False
+        self._priority_buffers: Dict[str, deque] = {}
+        self._priority_channels: Dict[str, Any] = {}
+        self._priority_credit: Dict[str, int] = {}
         self.connect()
         self.processed_count = 0
 
     def connect(self) -> None:
-        credentials = pika.PlainCredentials(
-            self.config['credentials']['username'],
-            self.config['credentials']['password']
-        )
-        
-        for attempt in range(RETRY_CONFIG['max_retries']):
-            try:
-                self.connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(
-                        host=self.config['host'],
-                        port=self.config['port'],
-                        virtual_host=self.config['virtual_host'],
-                        credentials=credentials,
-                        heartbeat=600
-                    )
-                )
-                self.channel = self.connection.channel()
-                
-                # Declare exchange
-                self.channel.exchange_declare(
-                    exchange=self.config['exchange_name'],
-                    exchange_type='direct',
-                    durable=True
-                )
-                
-                # Declare queue
-                self.channel.queue_declare(
-                    queue=self.config['queue_name'],
-                    durable=True
-                )
-                
-                # Bind queue to exchange
-                self.channel.queue_bind(
-                    exchange=self.config['exchange_name'],
-                    queue=self.config['queue_name'],
-                    routing_key=self.config['routing_key']
-                )
-                
-                logger.info("Successfully connected to RabbitMQ")
-                break
-            except Exception as e:
-                logger.error(f"Connection attempt {attempt + 1} failed: {str(e)}")
-                if attempt + 1 < RETRY_CONFIG['max_retries']:
-                    time.sleep(RETRY_CONFIG['retry_delay'])
-                else:
-                    raise
+        # Connections are long-lived and shared through the pool, which also
+        # skips re-declaring the topology on later channels and reconnects
+        self.pool = get_pool()
+        self.connection = self.pool.get_connection()
+        self.channel = self.pool.acquire_channel(self.connection)
 
     def validate_message(self, message: Dict[str, Any]) -> bool:
         required_fields = ['timestamp', 'data', 'message_id', 'source']
@@ -75,8 +98,9 @@ class MessageConsumer:
             priority = order_data.get('priority', 'unknown')
             total_amount = order_data.get('total_amount', 0)
             
-            logger.info(f"Processing order: {order_id}")
-            logger.info(f"Order details: Status={status}, Priority={priority}, Amount=${total_amount}")
+            message_log.info("Processing order: %s", order_id)
+            message_log.info("Order details: Status=%s, Priority=%s, Amount=$%s",
+                             status, priority, total_amount)
             
             # Simulate processing based on priority
             if priority == 'high':
@@ -86,61 +110,352 @@ class MessageConsumer:
             else:
                 time.sleep(1.5)
                 
-            self.processed_count += 1
-            logger.info(f"Order {order_id} processed successfully. Total processed: {self.processed_count}")
+            with self._count_lock:
+                self.processed_count += 1
+                processed_count = self.processed_count
+            message_log.info("Order %s processed successfully. Total processed: %d",
+                             order_id, processed_count)
             
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             raise
 
-    def callback(self, ch, method, properties, body: bytes) -> None:
+    def decode(self, properties: pika.BasicProperties, body: bytes) -> Dict[str, Any]:
+        # content_encoding says how to decompress, content_type picks the
+        # codec, which decodes the raw body bytes
+        body = self.decompressor.decompress(body, properties.content_encoding)
+        message = get_codec(properties.content_type).decode(body)
+        if self.consumer_config['typed_orders']:
+            # An OrderMessage; SchemaError is a CodecError, so bad orders are rejected
+            return decode_order_message(message)
+        return message
+
+    def handle_delivery(self, properties: pika.BasicProperties, body: bytes,
+                        message: Optional[Dict[str, Any]] = None) -> str:
+        """Decode (unless already decoded), validate and process one delivery.
+
+        Returns its outcome.
+        """
         try:
-            message = json.loads(body.decode())
-            logger.info(f"Received message {message.get('message_id')}")
+            if message is None:
+                message = self.decode(properties, body)
+            message_log.info("Received message %s", message.get('message_id'))
             
             if not self.validate_message(message):
                 logger.error("Invalid message format")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-                return
+                return REJECT
 
+            started = time.perf_counter()
             self.process_message(message)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            elapsed = time.perf_counter() - started
+            PROCESSING_TIME.observe(elapsed)
+            try:
+                END_TO_END_LATENCY.observe(
+                    (datetime.now(UTC) - datetime.fromisoformat(message['timestamp'])).total_seconds()
+                )
+            except (TypeError, ValueError):
+                pass  # timestamp missing a timezone or not ISO 8601
+            if self.prefetch_controller is not None:
+                self.prefetch_controller.record_processing(elapsed)
+            if self.dedup is not None and properties.message_id is not None:
+                self.dedup.add(properties.message_id)
+            return ACK
             
-        except json.JSONDecodeError as e:
+        except CodecError as e:
             logger.error(f"Error decoding message: {str(e)}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return REJECT
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return REQUEUE
+
+    def settle(self, ch, delivery_tag: int, outcome: str,
+               delivery: Optional[Tuple[str, pika.BasicProperties, bytes]] = None) -> None:
+        """Ack or nack a delivery; must run on the connection thread.
+
+        With retry queues enabled, a failed delivery given as (routing_key,
+        properties, body) is republished to its retry or dead-letter queue
+        and then acked instead of nacked.
+        """
+        self._outstanding -= 1
+        self._last_settled_at = time.perf_counter()
+        SETTLED[outcome].inc()
+        if outcome != ACK:
+            outcome = self.route_failure(ch, outcome, delivery)
+        if outcome == ACK:
+            ch.basic_ack(delivery_tag=delivery_tag)
+        else:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=outcome == REQUEUE)
+
+    def route_failure(self, ch, outcome: str,
+                      delivery: Optional[Tuple[str, pika.BasicProperties, bytes]]) -> str:
+        """Send a failed delivery to its retry tier; returns how to settle the original.
+
+        ACK once the broker has confirmed the copy, REQUEUE if the copy could
+        not be placed, and the outcome unchanged without retry queues.
+        """
+        if self.retry_router is None or delivery is None:
+            return outcome
+        routing_key, properties, body = delivery
+        try:
+            # Requeued failures may succeed later; rejected ones never will
+            target = self.retry_router.route(ch, routing_key, properties, body,
+                                             retry=outcome == REQUEUE)
+        except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            logger.error(f"Could not move message {properties.message_id} to its retry "
+                         f"queue, requeueing it: {str(e)}")
+            return REQUEUE
+        return outcome if target is None else ACK
+
+    def callback(self, ch, method, properties, body: bytes) -> None:
+        if self.prefetch_controller is not None and self._outstanding == 0 \
+                and self._last_settled_at is not None:
+            # Starved: the gap since the last ack approximates a broker round-trip
+            self.prefetch_controller.record_round_trip(time.perf_counter() - self._last_settled_at)
+        self._outstanding += 1
+        if self.dedup is not None and properties.message_id is not None \
+                and properties.message_id in self.dedup:
+            # Already processed (requeued after a late failure or published twice)
+            message_log.info("Skipping duplicate message %s", properties.message_id)
+            DUPLICATES.inc()
+            self.settle(ch, method.delivery_tag, ACK)
+            return
+        if self.dispatcher is not None:
+            self._dispatch_ordered(ch, method, properties, body)
+            return
+        if self.executor is not None:
+            self.executor.submit(self._work, ch, method, properties, body)
+            return
+        self.settle(ch, method.delivery_tag, self.handle_delivery(properties, body),
+                    (method.routing_key, properties, body))
+
+    def _dispatch_ordered(self, ch, method, properties: pika.BasicProperties,
+                          body: bytes) -> None:
+        """Decode here to find the ordering key, then queue the delivery in its lane."""
+        try:
+            message = self.decode(properties, body)
+        except Exception as e:
+            # Leave the outcome to handle_delivery, which decodes again and fails the same way
+            logger.error(f"Error decoding message: {str(e)}")
+            message = None
+        key = order_key(message, self.consumer_config['ordering_key']) if message else ''
+        if not key:
+            # Nothing to keep in order with
+            self.executor.submit(self._work, ch, method, properties, body, message)
+            return
+        self.dispatcher.submit(key, (ch, method, properties, body, message))
+
+    def _work(self, ch, method, properties: pika.BasicProperties, body: bytes,
+              message: Optional[Dict[str, Any]] = None) -> None:
+        """Run a delivery on a pool thread and hand the ack back to pika's thread."""
+        outcome = self.handle_delivery(properties, body, message)
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self.settle, ch, method.delivery_tag, outcome,
+                                  (method.routing_key, properties, body))
+            )
+        except Exception as e:
+            # Connection is gone; the broker redelivers the unacked message
+            logger.error(f"Could not schedule {outcome} for delivery "
+                         f"{method.delivery_tag}: {str(e)}")
+
+    def _lane_freed(self) -> None:
+        """KeyedDispatcher.on_free: release held deliveries on pika's thread."""
+        try:
+            self.connection.add_callback_threadsafe(self._release_held)
+        except Exception as e:
+            # Connection is gone; held deliveries are requeued with the channel
+            logger.error(f"Could not schedule releasing held deliveries: {str(e)}")
+
+    def _release_held(self) -> None:
+        if self.dispatcher is not None and self.dispatcher.held:
+            self.dispatcher.release()
+
+    def _set_prefetch(self, prefetch_count: int) -> None:
+        started = time.perf_counter()
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        weights = self.priority_config['weights']
+        for level, channel in self._priority_channels.items():
+            channel.basic_qos(prefetch_count=max(prefetch_count, weights.get(level, 1)))
+        if self.prefetch_controller is not None:
+            # basic_qos is a synchronous RPC, so its duration is a round-trip sample
+            self.prefetch_controller.record_round_trip(time.perf_counter() - started)
+            self.prefetch_controller.update(prefetch_count)
+
+    def _adjust_prefetch(self) -> None:
+        """Periodic timer on the connection thread that re-issues basic_qos."""
+        if self.prefetch_controller is None or self.connection.is_closed:
+            return
+        target = self.prefetch_controller.target()
+        if target != self.prefetch_controller.prefetch:
+            self._set_prefetch(target)
+            sample = self.prefetch_controller.metrics()
+            logger.info(f"Prefetch set to {target} (processing={sample['processing_time']:.4f}s, "
+                        f"round_trip={sample['round_trip']:.4f}s)")
+        self.connection.call_later(self.consumer_config['prefetch_interval'], self._adjust_prefetch)
+
+    def _drain_workers(self) -> None:
+        """Let in-flight work finish and flush the acks it scheduled."""
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        # Held deliveries stay unacked and are requeued when the channel closes
+        self.dispatcher = None
+        if self.connection and not self.connection.is_closed:
+            self.connection.process_data_events(time_limit=0)
 
     def start_consuming(self) -> None:
         """Start consuming messages with enhanced error handling."""
         try:
-            # Set QoS
-            self.channel.basic_qos(prefetch_count=1)
-            
-            # Setup consumer
-            self.channel.basic_consume(
-                queue=self.config['queue_name'],
-                on_message_callback=self.callback
-            )
-            
-            logger.info(f"Started consuming from queue: {self.config['queue_name']}")
-            logger.info("Press CTRL+C to exit")
+            # Set QoS; with a worker pool keep every worker fed
+            prefetch_count = self.consumer_config['prefetch_count']
+            if self.worker_threads > 0:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.worker_threads,
+                    thread_name_prefix='consumer-worker'
+                )
+                prefetch_count = max(prefetch_count, self.worker_threads)
+                if self.consumer_config['ordering_key']:
+                    self.dispatcher = KeyedDispatcher(
+                        self.executor, lambda item: self._work(*item),
+                        self.consumer_config['max_lane_depth'], on_free=self._lane_freed
+                    )
+            if self.consumer_config['adaptive_prefetch']:
+                self.prefetch_controller = AdaptivePrefetchController(
+                    min_prefetch=max(prefetch_count, self.consumer_config['min_prefetch']),
+                    max_prefetch=self.consumer_config['max_prefetch'],
+                    workers=max(1, self.worker_threads)
+                )
+                prefetch_count = self.prefetch_controller.prefetch
+                self.connection.call_later(self.consumer_config['prefetch_interval'],
+                                           self._adjust_prefetch)
+            self._set_prefetch(prefetch_count)
+            if self.retry_router is not None:
+                # Retries are republished on the consuming channel; confirms make
+                # basic_publish wait for the broker before the original is acked
+                self.channel.confirm_delivery()
             
-            self.channel.start_consuming()
+            if self.priority_config['per_priority_queues'] and not SHARDING_CONFIG['shards']:
+                self._consume_by_priority(prefetch_count)
+            else:
+                # Setup consumer
+                queues = self.queue_names()
+                for queue in queues:
+                    self.channel.basic_consume(queue=queue, on_message_callback=self.callback)
+                
+                logger.info(f"Started consuming from queue: {', '.join(queues)} "
+                            f"(prefetch={prefetch_count}, workers={self.worker_threads})")
+                logger.info("Press CTRL+C to exit")
+                
+                self.channel.start_consuming()
+            self._drain_workers()
+            logger.info(f"Consumer stopped. Total messages processed: {self.processed_count}")
             
         except KeyboardInterrupt:
             logger.info(f"Shutting down consumer. Total messages processed: {self.processed_count}")
-            self.channel.stop_consuming()
+            self.stop_consuming()
+            self._drain_workers()
         except Exception as e:
             logger.error(f"Error in consumer: {str(e)}")
         finally:
             self.close()
 
+    def queue_names(self) -> List[str]:
+        """Queues consumed on the main channel: this consumer's shards or the main queue."""
+        if SHARDING_CONFIG['shards']:
+            return [shard_queue_name(shard) for shard in self.shards]
+        return [self.config['queue_name']]
+
+    def _consume_by_priority(self, prefetch_count: int) -> None:
+        """Consume the per-priority queues on one channel each with weighted polling.
+
+        Deliveries are buffered per level (bounded by each channel's prefetch)
+        and dispatched by smooth weighted round-robin, so a backlog of low
+        priority orders never sits in front of high priority ones.
+        """
+        weights = self.priority_config['weights']
+        capacity = self.dispatch_capacity()
+        self._priority_buffers = {level: deque() for level in self.priority_config['levels']}
+        self._priority_credit = {level: 0 for level in self._priority_buffers}
+
+        for level, buffer in self._priority_buffers.items():
+            channel = self._priority_channels[level] = self.connection.channel()
+            channel.basic_qos(prefetch_count=max(prefetch_count, weights.get(level, 1)))
+            if self.retry_router is not None:
+                channel.confirm_delivery()
+            channel.basic_consume(
+                queue=priority_queue_name(level),
+                on_message_callback=functools.partial(self._buffer_delivery, buffer)
+            )
+
+        logger.info(f"Started consuming from priority queues: "
+                    f"{', '.join(priority_queue_name(level) for level in self._priority_buffers)} "
+                    f"(weights={weights}, workers={self.worker_threads})")
+        logger.info("Press CTRL+C to exit")
+
+        self._consuming = True
+        while self._consuming:
+            for _ in range(capacity - self._outstanding):
+                level = self._next_priority_level()
+                if level is None:
+                    break
+                self.callback(*self._priority_buffers[level].popleft())
+
+            idle = self._outstanding >= capacity or not any(self._priority_buffers.values())
+            self.connection.process_data_events(time_limit=1 if idle else 0)
+
+    def dispatch_capacity(self) -> int:
+        """Deliveries handed to callback() at once in priority mode."""
+        return max(1, self.worker_threads)
+
+    def _buffer_delivery(self, buffer: deque, ch, method, properties, body: bytes) -> None:
+        buffer.append((ch, method, properties, body))
+
+    def _next_priority_level(self) -> Optional[str]:
+        """Pick the next non-empty level by smooth weighted round-robin."""
+        weights = self.priority_config['weights']
+        best = None
+        total = 0
+        for level, buffer in self._priority_buffers.items():
+            if not buffer:
+                continue
+            weight = weights.get(level, 1)
+            self._priority_credit[level] += weight
+            total += weight
+            if best is None or self._priority_credit[level] > self._priority_credit[best]:
+                best = level
+        if best is not None:
+            self._priority_credit[best] -= total
+        return best
+
+    def stop_consuming(self) -> None:
+        """Stop consuming; must run on the connection thread."""
+        self._consuming = False
+        self.channel.stop_consuming()
+
+    def request_stop(self) -> None:
+        """Stop consuming after the current delivery.
+
+        Safe to call from other threads and from signal handlers.
+        """
+        self.connection.add_callback_threadsafe(self.stop_consuming)
+
     def close(self) -> None:
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+        """Stop workers and release the channel; the pooled connection stays open."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.dispatcher = None
+        if self.channel is not None:
+            # The channel carries our consumer and QoS, so it is not reused
+            self.pool.release_channel(self.channel, reusable=False)
+            self.channel = None
+        # Per-level channels are opened outside the pool; closing them
+        # cancels their consumers on the shared connection
+        for channel in self._priority_channels.values():
+            if channel.is_open:
+                channel.close()
+        self._priority_channels = {}
 
 if __name__ == "__main__":
     consumer = MessageConsumer()
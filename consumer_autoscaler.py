@@ -0,0 +1,105 @@
+import math
+from typing import Dict, Any, Optional
+from config import AUTOSCALE_CONFIG
+
+class QueueDepthAutoscaler:
+    """Chooses a consumer worker count from sampled queue depth.
+
+    Each sample gives the queue's ready message count and consumer count
+    (from a passive queue_declare) plus how many messages our workers have
+    processed so far. From consecutive samples it estimates the per-consumer
+    drain rate and the arrival rate, and sizes the workers to keep up with
+    arrivals and clear the backlog within target_drain_seconds.
+
+    Scaling up takes effect after scale_up_cooldown; scaling down only once
+    a lower count has been wanted for scale_down_cooldown, one step at a
+    time, so short lulls do not shed capacity.
+    """
+
+    def __init__(self, min_workers: Optional[int] = None, max_workers: Optional[int] = None,
+                 target_drain_seconds: Optional[float] = None,
+                 scale_up_cooldown: Optional[float] = None,
+                 scale_down_cooldown: Optional[float] = None,
+                 smoothing: Optional[float] = None):
+        config = AUTOSCALE_CONFIG
+        self.min_workers = min_workers or config['min_workers']
+        self.max_workers = max(self.min_workers, max_workers or config['max_workers'])
+        self.target_drain_seconds = target_drain_seconds or config['target_drain_seconds']
+        self.scale_up_cooldown = config['scale_up_cooldown'] if scale_up_cooldown is None \
+            else scale_up_cooldown
+        self.scale_down_cooldown = config['scale_down_cooldown'] if scale_down_cooldown is None \
+            else scale_down_cooldown
+        self.smoothing = smoothing or config['smoothing']
+
+        self.consumer_rate: Optional[float] = None  # msg/s one consumer drains when busy
+        self.arrival_rate = 0.0
+        self.depth = 0
+        self.desired = self.min_workers
+        self._last_sample = None
+        self._last_scaled_at = float('-inf')
+        self._lower_since: Optional[float] = None
+
+    def _smooth(self, previous: Optional[float], sample: float) -> float:
+        if previous is None:
+            return sample
+        return previous + self.smoothing * (sample - previous)
+
+    def update(self, now: float, depth: int, consumers: int, processed: int, workers: int) -> int:
+        """Record a sample and return the worker count to run now."""
+        self.depth = depth
+        if self._last_sample is not None:
+            last_now, last_depth, last_processed = self._last_sample
+            elapsed = now - last_now
+            if elapsed > 0:
+                drained = (processed - last_processed) / elapsed
+                # Consumers outside this supervisor drain at the same per-consumer rate
+                active = max(consumers, workers, 1)
+                if workers and last_depth > 0 and depth > 0:
+                    # Only a saturated interval tells us what a consumer can do
+                    self.consumer_rate = self._smooth(self.consumer_rate, drained / workers)
+                fleet_drained = drained * active / workers if workers else 0.0
+                arrived = max(0.0, fleet_drained + (depth - last_depth) / elapsed)
+                self.arrival_rate = self._smooth(self.arrival_rate, arrived)
+        self._last_sample = (now, depth, processed)
+
+        self.desired = self._clamp(self._target(consumers, workers))
+        return self._apply(now, workers)
+
+    def _target(self, consumers: int, workers: int) -> int:
+        others = max(0, consumers - workers)
+        if not self.consumer_rate:
+            # No throughput estimate yet: add a worker while a backlog exists
+            return workers + 1 if self.depth else workers
+        needed = (self.arrival_rate + self.depth / self.target_drain_seconds) / self.consumer_rate
+        return math.ceil(needed) - others
+
+    def _clamp(self, count: int) -> int:
+        return max(self.min_workers, min(self.max_workers, count))
+
+    def _apply(self, now: float, workers: int) -> int:
+        if workers < self.min_workers or workers > self.max_workers:
+            return self._clamp(workers)
+        if self.desired > workers:
+            self._lower_since = None
+            if now - self._last_scaled_at >= self.scale_up_cooldown:
+                self._last_scaled_at = now
+                return self.desired
+        elif self.desired < workers:
+            if self._lower_since is None:
+                self._lower_since = now
+            elif now - self._lower_since >= self.scale_down_cooldown \
+                    and now - self._last_scaled_at >= self.scale_down_cooldown:
+                self._last_scaled_at = now
+                self._lower_since = now
+                return workers - 1
+        else:
+            self._lower_since = None
+        return workers
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'depth': self.depth,
+            'arrival_rate': self.arrival_rate,
+            'consumer_rate': self.consumer_rate,
+            'desired': self.desired
+        }
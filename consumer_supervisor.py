@@ -0,0 +1,248 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+import pika.exceptions
+from typing import Dict, Any, List, Optional, Set, Tuple
+from config import (CONSUMER_CONFIG, SUPERVISOR_CONFIG, AUTOSCALE_CONFIG, METRICS_CONFIG,
+                    SHARDING_CONFIG)
+from consumer import MessageConsumer
+from consumer_autoscaler import QueueDepthAutoscaler
+from connection_helper import get_pool, consumed_queues
+from metrics import start_metrics_server
+from logging_setup import forward_child_logs
+from sharding import assigned_shards
+
+logger = logging.getLogger(__name__)
+
+class SupervisedConsumer(MessageConsumer):
+    """MessageConsumer that publishes its processed count to the supervisor."""
+
+    def __init__(self, shared_count, **kwargs):
+        self.shared_count = shared_count
+        # Counts are cumulative across restarts of the same worker slot
+        self._count_base = shared_count.value
+        super().__init__(**kwargs)
+
+    def process_message(self, message: Dict[str, Any]) -> None:
+        super().process_message(message)
+        # Under the count lock, so a worker thread cannot write an older total
+        with self._count_lock:
+            self.shared_count.value = self._count_base + self.processed_count
+
+def run_worker(index: int, shared_count, worker_threads: int,
+               shards: Optional[List[int]] = None) -> None:
+    """Entry point of one consumer process."""
+    # Ctrl+C reaches the whole process group; the supervisor turns it into SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if METRICS_CONFIG['enabled']:
+        # One endpoint per worker; the consumer then reuses it
+        start_metrics_server(port=METRICS_CONFIG['port'] + 1 + index)
+    consumer = SupervisedConsumer(shared_count, worker_threads=worker_threads, shards=shards)
+    signal.signal(signal.SIGTERM, lambda signum, frame: consumer.request_stop())
+    logger.info(f"Consumer worker {index} started (pid {os.getpid()})")
+    consumer.start_consuming()
+    # Worker processes skip atexit handlers, so close the pool explicitly
+    get_pool().close()
+
+class ConsumerSupervisor:
+    """Runs N MessageConsumer processes, restarting crashed ones with backoff.
+
+    In autoscale mode N follows the queue depth between the autoscaler's
+    bounds: workers beyond the current count are retired with SIGTERM so
+    they drain their in-flight messages, and are not restarted.
+
+    With sharded queues each worker reads every N-th shard, and N is capped
+    at the shard count. When N changes, workers whose shards changed are
+    restarted with their new assignment.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, worker_threads: Optional[int] = None,
+                 autoscale: Optional[bool] = None):
+        self.config = SUPERVISOR_CONFIG
+        if autoscale is None:
+            autoscale = AUTOSCALE_CONFIG['enabled']
+        self.autoscaler = QueueDepthAutoscaler() if autoscale else None
+        if self.autoscaler is not None:
+            # Start small and let the queue depth decide
+            num_workers = max(self.autoscaler.min_workers,
+                              min(self.autoscaler.max_workers, num_workers or 0))
+        elif not num_workers:
+            num_workers = self.config['workers'] or os.cpu_count() or 1
+        if SHARDING_CONFIG['shards']:
+            # A worker without a shard would have nothing to consume
+            num_workers = min(num_workers, SHARDING_CONFIG['shards'])
+            if self.autoscaler is not None:
+                self.autoscaler.max_workers = max(
+                    self.autoscaler.min_workers,
+                    min(self.autoscaler.max_workers, SHARDING_CONFIG['shards'])
+                )
+        if worker_threads is None:
+            worker_threads = CONSUMER_CONFIG['worker_threads']
+        self.num_workers = num_workers
+        self.worker_threads = worker_threads
+
+        slots = self.autoscaler.max_workers if self.autoscaler is not None else num_workers
+        self.counts = [multiprocessing.Value('q', 0) for _ in range(slots)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * slots
+        self.started_at = [0.0] * slots
+        self.crashes = [0] * slots
+        self.restart_at = [0.0] * slots
+        self.retiring: Set[int] = set()
+        self.shards: List[Optional[List[int]]] = [None] * slots
+        self._stopping = False
+
+    @property
+    def processed_count(self) -> int:
+        return sum(count.value for count in self.counts)
+
+    def worker_shards(self, index: int) -> Optional[List[int]]:
+        """Shards worker index reads at the current worker count; None when unsharded."""
+        if not SHARDING_CONFIG['shards']:
+            return None
+        return assigned_shards(SHARDING_CONFIG['shards'], index, self.num_workers)
+
+    def start_worker(self, index: int) -> None:
+        self.shards[index] = self.worker_shards(index)
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(index, self.counts[index], self.worker_threads, self.shards[index]),
+            name=f'consumer-{index}'
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def _reap(self, index: int) -> None:
+        """Schedule a restart for a worker that exited on its own."""
+        process = self.processes[index]
+        self.processes[index] = None
+        now = time.monotonic()
+
+        if index in self.retiring:
+            self.retiring.discard(index)
+            self.crashes[index] = 0
+            # Scaled back up while it was draining: bring it straight back
+            self.restart_at[index] = now
+            logger.info(f"Consumer worker {index} retired (exit code {process.exitcode})")
+            return
+
+        if now - self.started_at[index] >= self.config['stable_after']:
+            self.crashes[index] = 0
+        delay = min(
+            self.config['restart_backoff'] * 2 ** self.crashes[index],
+            self.config['max_restart_backoff']
+        )
+        self.crashes[index] += 1
+        self.restart_at[index] = now + delay
+        logger.error(f"Consumer worker {index} exited with code {process.exitcode}, "
+                     f"restarting in {delay}s")
+
+    def scale_to(self, count: int) -> None:
+        """Run count workers: start missing slots, retire the ones above count."""
+        logger.info(f"Scaling consumer workers from {self.num_workers} to {count}")
+        self.num_workers = count
+        for index, process in enumerate(self.processes):
+            if index < count:
+                if process is None:
+                    self.crashes[index] = 0
+                    self.start_worker(index)
+            elif process is not None and index not in self.retiring:
+                self.retiring.add(index)
+                process.terminate()
+        for index in range(count):
+            process = self.processes[index]
+            if process is not None and index not in self.retiring \
+                    and self.shards[index] != self.worker_shards(index):
+                # Retiring restarts it at once, reading its new shards; single
+                # active consumer keeps each shard in order across the handover
+                self.retiring.add(index)
+                process.terminate()
+
+    def sample_queue(self) -> Tuple[int, int]:
+        """Ready messages and consumers on the consumed queues (passive queue_declare)."""
+        depth = consumers = 0
+        with get_pool().channel() as channel:
+            for name, _ in consumed_queues():
+                method = channel.queue_declare(queue=name, passive=True).method
+                depth += method.message_count
+                # Every worker consumes each queue (or one shard queue each, where
+                # any count above one comes from outside), so take the largest
+                consumers = max(consumers, method.consumer_count)
+        return depth, consumers
+
+    def autoscale(self, now: float) -> None:
+        try:
+            depth, consumers = self.sample_queue()
+        except pika.exceptions.AMQPError as e:
+            logger.warning(f"Could not sample queue depth: {str(e)}")
+            return
+        count = self.autoscaler.update(now, depth, consumers, self.processed_count,
+                                       self.num_workers)
+        if count != self.num_workers:
+            scaling = self.autoscaler.metrics()
+            logger.info(f"Queue depth {depth}, arrival rate {scaling['arrival_rate']:.1f}/s, "
+                        f"per-consumer rate {scaling['consumer_rate'] or 0:.1f}/s")
+            self.scale_to(count)
+
+    def _request_shutdown(self, signum, frame) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        """Start the workers and supervise them until SIGTERM/SIGINT."""
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+        # Workers log through this process so only it rotates the log file
+        forward_child_logs()
+
+        logger.info(f"Starting {self.num_workers} consumer workers "
+                    f"({self.worker_threads} threads each)")
+        for index in range(self.num_workers):
+            self.start_worker(index)
+
+        last_status = last_sample = time.monotonic()
+        while not self._stopping:
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    self._reap(index)
+                elif process is None and index < self.num_workers \
+                        and now >= self.restart_at[index]:
+                    self.start_worker(index)
+
+            if self.autoscaler is not None and now - last_sample >= AUTOSCALE_CONFIG['interval']:
+                self.autoscale(now)
+                last_sample = now
+
+            if now - last_status >= self.config['status_interval']:
+                alive = sum(1 for index, p in enumerate(self.processes)
+                            if p is not None and p.is_alive() and index not in self.retiring)
+                logger.info(f"Workers alive: {alive}/{self.num_workers}. "
+                            f"Total messages processed: {self.processed_count}")
+                last_status = now
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """Ask every worker to drain (SIGTERM), then kill any that do not exit."""
+        logger.info("Shutting down consumer workers")
+        running = [p for p in self.processes if p is not None and p.is_alive()]
+        for process in running:
+            process.terminate()
+
+        deadline = time.monotonic() + self.config['shutdown_timeout']
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {process.name} did not drain in time, killing it")
+                process.kill()
+                process.join()
+
+        logger.info(f"All workers stopped. Total messages processed: {self.processed_count}")
+        get_pool().close()
+
+if __name__ == "__main__":
+    supervisor = ConsumerSupervisor()
+    supervisor.run()
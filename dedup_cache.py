@@ -0,0 +1,90 @@
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Hashable
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.0001):
+        self.capacity = capacity
+        bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+class DedupCache:
+    """Bounded memory of processed message IDs.
+
+    The last max_entries IDs are kept exactly in an LRU. With bloom_capacity
+    set, IDs are also added to two rotating Bloom filters, which remember
+    between bloom_capacity and twice that many IDs in a few bits each, at
+    the cost of treating about error_rate of new IDs as already seen.
+    """
+
+    def __init__(self, max_entries: int = 100000, bloom_capacity: int = 0,
+                 error_rate: float = 0.0001):
+        self.max_entries = max_entries
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._recent: 'OrderedDict[Hashable, None]' = OrderedDict()
+        self._bloom = self._new_bloom() if bloom_capacity else None
+        self._previous_bloom = None
+        self.hits = 0
+
+    def _new_bloom(self) -> BloomFilter:
+        # Both generations are checked, so each gets half the error budget
+        return BloomFilter(self.bloom_capacity, self.error_rate / 2)
+
+    def __contains__(self, message_id: Hashable) -> bool:
+        with self._lock:
+            if message_id in self._recent:
+                self._recent.move_to_end(message_id)
+                self.hits += 1
+                return True
+            if self._bloom is not None:
+                key = str(message_id)
+                if key in self._bloom or \
+                        (self._previous_bloom is not None and key in self._previous_bloom):
+                    self.hits += 1
+                    return True
+            return False
+
+    def add(self, message_id: Hashable) -> None:
+        with self._lock:
+            self._recent[message_id] = None
+            self._recent.move_to_end(message_id)
+            if len(self._recent) > self.max_entries:
+                self._recent.popitem(last=False)
+            if self._bloom is not None:
+                if self._bloom.count >= self.bloom_capacity:
+                    self._previous_bloom = self._bloom
+                    self._bloom = self._new_bloom()
+                self._bloom.add(str(message_id))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._recent),
+                'bloom_entries': self._bloom.count if self._bloom is not None else 0,
+                'hits': self.hits
+            }
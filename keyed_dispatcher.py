@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class KeyedDispatcher:
+    """Runs work items on an executor in per-key serial lanes.
+
+    Items with the same key run one at a time, in the order submitted;
+    items with different keys run in parallel on the executor's threads.
+    A lane holds at most max_depth items (queued plus running). Further
+    items for a full lane are held back, still in order, until release()
+    finds room, so one hot key cannot fill the worker pipeline.
+
+    submit() and release() must be called from one thread (the consumer's
+    connection thread); handler runs on the executor. When a full lane gets
+    room, on_free is called from the executor thread and must arrange for
+    release() to run on the submitting thread.
+    """
+
+    def __init__(self, executor: Executor, handler: Callable[[Any], None], max_depth: int,
+                 on_free: Optional[Callable[[], None]] = None):
+        self.executor = executor
+        self.handler = handler
+        self.max_depth = max(1, max_depth)
+        self.on_free = on_free
+        self._lanes: Dict[Hashable, Deque[Any]] = {}
+        self._lock = threading.Lock()
+        self._held: Deque[Tuple[Hashable, Any]] = deque()
+        self._held_keys: Dict[Hashable, int] = {}
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    def lane_count(self) -> int:
+        with self._lock:
+            return len(self._lanes)
+
+    def submit(self, key: Hashable, item: Any) -> None:
+        # Anything held for this key must go first
+        if key in self._held_keys or not self._enqueue(key, item):
+            self._held.append((key, item))
+            self._held_keys[key] = self._held_keys.get(key, 0) + 1
+
+    def release(self) -> None:
+        """Move held items into lanes that have room again."""
+        blocked = set()
+        for _ in range(len(self._held)):
+            key, item = self._held.popleft()
+            if key not in blocked and self._enqueue(key, item):
+                count = self._held_keys[key] - 1
+                if count:
+                    self._held_keys[key] = count
+                else:
+                    del self._held_keys[key]
+            else:
+                # Later items of a blocked key stay behind it
+                blocked.add(key)
+                self._held.append((key, item))
+
+    def _enqueue(self, key: Hashable, item: Any) -> bool:
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                self._lanes[key] = deque([item])
+            elif len(lane) >= self.max_depth:
+                return False
+            else:
+                lane.append(item)
+                return True
+        self.executor.submit(self._run, key)
+        return True
+
+    def _run(self, key: Hashable) -> None:
+        """Work through one lane until it is empty; one _run per lane at a time."""
+        lane = self._lanes[key]
+        while True:
+            try:
+                self.handler(lane[0])
+            except Exception as e:
+                logger.error(f"Error in ordered lane {key!r}: {str(e)}")
+            with self._lock:
+                # Items are only held back for full lanes, so only then is
+                # anyone waiting for this slot
+                freed = len(lane) >= self.max_depth
+                lane.popleft()
+                done = not lane
+                if done:
+                    del self._lanes[key]
+            if freed and self.on_free is not None:
+                self.on_free()
+            if done:
+                return
@@ -0,0 +1,170 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.util
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Any, List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
+
+_settings: Dict[str, Any] = {'sample_rate': 1, 'rate_limit': 0}
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+_outputs: List[logging.Handler] = []
+# Set by forward_child_logs(): forked children send records here
+_child_queue: Optional[multiprocessing.Queue] = None
+_child_listener: Optional[QueueListener] = None
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The stock prepare() formats the message in the logging thread; records
+    only ever cross threads here, so they can be queued as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def _start_listener(handlers: List[logging.Handler]) -> None:
+    global _listener
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+def _flush_at_child_exit(handler: QueueHandler) -> None:
+    # multiprocessing children leave through os._exit and skip atexit
+    multiprocessing.util.Finalize(handler, _stop_listener, exitpriority=10)
+
+def _after_fork_in_child() -> None:
+    outputs = _outputs
+    if _child_queue is not None:
+        # Only the parent writes the log file; a size-rotated file shared by
+        # several processes loses or clobbers records at rollover
+        outputs = [QueueHandler(_child_queue)]
+        if _queue_handler is None:
+            root = logging.getLogger()
+            for handler in _outputs:
+                root.removeHandler(handler)
+            root.addHandler(outputs[0])
+            return
+    if _queue_handler is not None:
+        _start_listener(outputs)
+
+def forward_child_logs() -> None:
+    """Have processes forked from here on log through this one.
+
+    Children put their records on a multiprocessing queue and a listener
+    thread here hands them to this process's file and stderr handlers. Call
+    it before starting worker processes.
+    """
+    global _child_queue, _child_listener
+    if _child_queue is not None:
+        return
+    _child_queue = multiprocessing.Queue()
+    _child_listener = QueueListener(_child_queue, *_outputs, respect_handler_level=True)
+    _child_listener.start()
+    atexit.register(_child_listener.stop)
+
+def setup_logging(config: Dict[str, Any]) -> None:
+    """Install the root handlers: a size-rotated log file and stderr.
+
+    With config['queue'] set the handlers run on a QueueListener thread, so
+    logging calls only enqueue the record. A forked child starts its own
+    listener, since the parent's thread does not exist there, and stops it
+    (flushing the queue) when it exits. After forward_child_logs() the
+    child's records go to the parent instead of to its own handlers.
+    """
+    global _queue_handler, _outputs
+    _settings.update(sample_rate=config['sample_rate'], rate_limit=config['rate_limit'])
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = [
+        RotatingFileHandler(config['file'], maxBytes=config['max_bytes'],
+                            backupCount=config['backup_count']),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _outputs = handlers
+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+    if config['queue']:
+        _queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+        _start_listener(_outputs)
+        atexit.register(_stop_listener)
+        multiprocessing.util.register_after_fork(_queue_handler, _flush_at_child_exit)
+        handlers = [_queue_handler]
+    logging.basicConfig(level=config['level'], handlers=handlers)
+
+class SampledLogger:
+    """Logger for per-message records.
+
+    Only one in sample_rate debug/info records is kept, and at most
+    rate_limit of them per second; the rest cost a counter increment.
+    Sampling is counted per format string, so the lines logged for one
+    message are all kept or all dropped together.
+    Warnings and errors are always logged. Use %-style arguments so
+    dropped records are never formatted.
+    """
+
+    def __init__(self, name: str, sample_rate: Optional[int] = None,
+                 rate_limit: Optional[float] = None):
+        self.logger = logging.getLogger(name)
+        self.sample_rate = sample_rate or _settings['sample_rate']
+        self.rate_limit = _settings['rate_limit'] if rate_limit is None else rate_limit
+        self._counters: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._tokens = self.rate_limit
+        self._refilled_at = time.monotonic()
+        if self.sample_rate <= 1 and not self.rate_limit:
+            # Nothing to drop: skip the wrapper entirely
+            self.debug = self.logger.debug
+            self.info = self.logger.info
+
+    def _sampled_out(self, msg: str) -> bool:
+        counter = self._counters.get(msg)
+        if counter is None:
+            counter = self._counters.setdefault(msg, itertools.count())
+        return next(counter) % self.sample_rate != 0
+
+    def _rate_limited(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit,
+                               self._tokens + (now - self._refilled_at) * self.rate_limit)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def _log(self, level: int, msg: str, args: tuple) -> None:
+        # Sampling comes first: most calls end at the counter
+        if self.sample_rate > 1 and self._sampled_out(msg):
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.rate_limit and self._rate_limited():
+            return
+        self.logger._log(level, msg, args, stacklevel=3)
+
+    def debug(self, msg: str, *args) -> None:
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg: str, *args) -> None:
+        self._log(logging.INFO, msg, args)
+
+    def warning(self, msg: str, *args, **kwargs) -> None:
+        self.logger.warning(msg, *args, **kwargs)
+
+    def error(self, msg: str, *args, **kwargs) -> None:
+        self.logger.error(msg, *args, **kwargs)
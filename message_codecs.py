@@ -0,0 +1,201 @@
+import json
+import struct
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Any, Optional
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+DEFAULT_CONTENT_TYPE = 'application/json'
+
+class CodecError(ValueError):
+    """Raised when a body cannot be encoded or decoded."""
+
+class JsonCodec:
+    content_type = 'application/json'
+    content_encoding = 'utf-8'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return self._encoder.encode(message).encode()
+
+    def decode(self, body: bytes) -> Dict[str, Any]:
+        try:
+            # json.loads detects UTF-8 itself, so the body is not .decode()d first
+            return json.loads(body)
+        except ValueError as e:
+            raise CodecError(str(e)) from e
+
+class MsgpackCodec:
+    content_type = 'application/msgpack'
+    content_encoding = None
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, body: bytes) -> Dict[str, Any]:
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise CodecError(str(e)) from e
+
+class OrderStructCodec:
+    """Fixed-schema binary encoding of the order envelope.
+
+    Field names are implied by position and numbers are packed with struct.
+    All strings are concatenated into a single UTF-8 block preceded by their
+    character lengths, so decoding is one struct read per section plus one
+    UTF-8 decode. Only messages that match the schema exactly can be encoded.
+    """
+    content_type = 'application/x-order-struct'
+    content_encoding = None
+
+    VERSION = 1
+    ENVELOPE_KEYS = {'timestamp', 'data', 'message_id', 'source'}
+    ORDER_KEYS = {'order_id', 'customer', 'items', 'total_amount', 'shipping_address',
+                  'status', 'priority'}
+    CUSTOMER_KEYS = {'id', 'name', 'email'}
+    ITEM_KEYS = {'product_id', 'product_name', 'quantity', 'price', 'item_total'}
+    ADDRESS_KEYS = {'street', 'city', 'state', 'zip'}
+    ORDER_STRINGS = 11  # strings per order besides the two per item
+
+    # version, timestamp (us since epoch), message_id, total_amount, item count
+    _header = struct.Struct('<BqqdB')
+    _epoch = datetime(1970, 1, 1, tzinfo=UTC)
+
+    def __init__(self):
+        self._structs: Dict[str, struct.Struct] = {}
+
+    def _struct(self, fmt: str) -> struct.Struct:
+        compiled = self._structs.get(fmt)
+        if compiled is None:
+            compiled = self._structs[fmt] = struct.Struct(fmt)
+        return compiled
+
+    def _check(self, mapping: Dict[str, Any], keys, name: str) -> None:
+        if not isinstance(mapping, dict) or mapping.keys() != keys:
+            raise CodecError(f"{name} does not match the order schema")
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        self._check(message, self.ENVELOPE_KEYS, 'envelope')
+        order = message['data']
+        self._check(order, self.ORDER_KEYS, 'order')
+        customer = order['customer']
+        address = order['shipping_address']
+        items = order['items']
+        self._check(customer, self.CUSTOMER_KEYS, 'customer')
+        self._check(address, self.ADDRESS_KEYS, 'shipping_address')
+
+        try:
+            timestamp = datetime.fromisoformat(message['timestamp'])
+        except (TypeError, ValueError) as e:
+            raise CodecError(f"Invalid timestamp: {str(e)}") from e
+        if timestamp.tzinfo is None or timestamp.isoformat() != message['timestamp']:
+            raise CodecError("timestamp must be a timezone-aware ISO 8601 string")
+        timestamp_us = (timestamp - self._epoch) // timedelta(microseconds=1)
+
+        strings = [
+            message['source'], order['order_id'],
+            customer['id'], customer['name'], customer['email'],
+            address['street'], address['city'], address['state'], address['zip'],
+            order['status'], order['priority']
+        ]
+        numbers = []
+        for item in items:
+            self._check(item, self.ITEM_KEYS, 'item')
+            strings.append(item['product_id'])
+            strings.append(item['product_name'])
+            numbers.append(item['quantity'])
+            numbers.append(item['price'])
+            numbers.append(item['item_total'])
+
+        try:
+            count = len(items)
+            return b''.join((
+                self._header.pack(self.VERSION, timestamp_us, message['message_id'],
+                                  order['total_amount'], count),
+                self._struct(f'<{"Idd" * count}').pack(*numbers),
+                self._struct(f'<{len(strings)}H').pack(*map(len, strings)),
+                ''.join(strings).encode()
+            ))
+        except (struct.error, TypeError) as e:
+            raise CodecError(f"Order does not match the schema: {str(e)}") from e
+
+    def decode(self, body: bytes) -> Dict[str, Any]:
+        # Sections are unpacked straight out of the body buffer without copies
+        view = memoryview(body)
+        try:
+            version, timestamp_us, message_id, total_amount, count = \
+                self._header.unpack_from(view, 0)
+            if version != self.VERSION:
+                raise CodecError(f"Unsupported order struct version {version}")
+            offset = self._header.size
+            numbers_struct = self._struct(f'<{"Idd" * count}')
+            numbers = numbers_struct.unpack_from(view, offset)
+            offset += numbers_struct.size
+            lengths_struct = self._struct(f'<{self.ORDER_STRINGS + 2 * count}H')
+            lengths = lengths_struct.unpack_from(view, offset)
+            offset += lengths_struct.size
+            text = str(view[offset:], 'utf-8')
+        except (struct.error, UnicodeDecodeError) as e:
+            raise CodecError(f"Malformed order struct: {str(e)}") from e
+        if len(text) != sum(lengths):
+            raise CodecError("String block does not match the declared lengths")
+
+        strings = []
+        position = 0
+        for length in lengths:
+            strings.append(text[position:position + length])
+            position += length
+
+        items = []
+        for index in range(count):
+            quantity, price, item_total = numbers[3 * index:3 * index + 3]
+            items.append({
+                'product_id': strings[11 + 2 * index],
+                'product_name': strings[12 + 2 * index],
+                'quantity': quantity,
+                'price': price,
+                'item_total': item_total
+            })
+
+        return {
+            'timestamp': (self._epoch + timedelta(microseconds=timestamp_us)).isoformat(),
+            'data': {
+                'order_id': strings[1],
+                'customer': {'id': strings[2], 'name': strings[3], 'email': strings[4]},
+                'items': items,
+                'total_amount': total_amount,
+                'shipping_address': {
+                    'street': strings[5],
+                    'city': strings[6],
+                    'state': strings[7],
+                    'zip': strings[8]
+                },
+                'status': strings[9],
+                'priority': strings[10]
+            },
+            'message_id': message_id,
+            'source': strings[0]
+        }
+
+CODECS: Dict[str, Any] = {}
+
+def register_codec(codec) -> None:
+    CODECS[codec.content_type] = codec
+
+register_codec(JsonCodec())
+register_codec(OrderStructCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+def get_codec(content_type: Optional[str]):
+    """Codec for a content_type; messages without one are treated as JSON."""
+    try:
+        return CODECS[content_type or DEFAULT_CONTENT_TYPE]
+    except KeyError:
+        raise CodecError(f"No codec registered for content type {content_type!r}")
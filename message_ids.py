@@ -0,0 +1,88 @@
+import os
+import time
+import zlib
+import socket
+import threading
+from typing import Optional
+from config import MESSAGE_ID_CONFIG
+
+# 2024-01-01T00:00:00Z in milliseconds; 41 timestamp bits last until 2093
+EPOCH_MS = 1704067200000
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+def default_node_id() -> int:
+    """Node number derived from the host name and process id.
+
+    Only 1024 values exist, so two hosts can end up with the same node;
+    set MESSAGE_ID_CONFIG['node_id'] where IDs must be unique.
+    """
+    return (zlib.crc32(socket.gethostname().encode()) + os.getpid()) & MAX_NODE
+
+class IdGenerator:
+    """Monotonic 63-bit IDs: milliseconds since EPOCH_MS, node, sequence.
+
+    Up to 4096 IDs per millisecond per node; beyond that (or if the wall
+    clock steps backwards) the timestamp part runs ahead of the clock
+    instead of blocking, so IDs keep increasing. The result fits a signed
+    64-bit integer and sorts by creation time.
+    """
+
+    def __init__(self, node_id: Optional[int] = None):
+        if node_id is None:
+            node_id = default_node_id()
+        if not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f"node_id must be between 0 and {MAX_NODE}")
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._last = 0
+
+    def next_id(self) -> int:
+        floor = (int(time.time() * 1000) - EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS)
+        with self._lock:
+            # Next sequence number of the last millisecond, unless time moved on
+            last = self._last + (1 << NODE_BITS)
+            if last < floor:
+                last = floor
+            self._last = last
+        return last | self.node_id
+
+    def next_ids(self, count: int) -> range:
+        """count consecutive IDs reserved at once, as from count next_id() calls."""
+        floor = (int(time.time() * 1000) - EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS)
+        step = 1 << NODE_BITS
+        with self._lock:
+            first = self._last + step
+            if first < floor:
+                first = floor
+            last = self._last = first + (count - 1) * step
+        return range(first | self.node_id, (last | self.node_id) + 1, step)
+
+def split_id(message_id: int) -> tuple:
+    """(unix time in ms, node, sequence) of an ID, for debugging."""
+    return (
+        (message_id >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS,
+        message_id & MAX_NODE,
+        (message_id >> NODE_BITS) & MAX_SEQUENCE
+    )
+
+_generator: Optional[IdGenerator] = None
+_generator_pid: Optional[int] = None
+
+def _process_generator() -> IdGenerator:
+    """The process-wide generator; a forked child gets its own."""
+    global _generator, _generator_pid
+    if _generator is None or _generator_pid != os.getpid():
+        _generator = IdGenerator(MESSAGE_ID_CONFIG['node_id'])
+        _generator_pid = os.getpid()
+    return _generator
+
+def next_message_id() -> int:
+    """Next ID from the process-wide generator."""
+    return _process_generator().next_id()
+
+def next_message_ids(count: int) -> range:
+    """count consecutive IDs from the process-wide generator."""
+    return _process_generator().next_ids(count)
@@ -0,0 +1,185 @@
+import os
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+from config import METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Latency bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class _Sharded:
+    """Per-thread slots: each thread only writes its own, so recording takes no lock."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[list] = []
+        self._lock = threading.Lock()
+
+    def _new_shard(self) -> list:
+        shard = [0] * self._size
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def _totals(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        return [sum(values) for values in zip(*shards)] if shards else [0] * self._size
+
+class Counter(_Sharded):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: int = 1) -> None:
+        try:
+            self._local.shard[0] += amount
+        except AttributeError:
+            self._new_shard()[0] += amount
+
+    @property
+    def value(self) -> int:
+        return self._totals()[0]
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        return [f'{name}{labels} {self.value}']
+
+class Histogram(_Sharded):
+    """Fixed-bucket histogram; observe() is a bisect and two additions."""
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        # One slot per bucket, one for +Inf, and the sum last
+        super().__init__(len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value: float) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        totals = self._totals()
+        prefix = labels[:-1] + ',' if labels else '{'
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), totals):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{prefix}le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{labels} {totals[-1]}')
+        lines.append(f'{name}_count{labels} {cumulative}')
+        return lines
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+class Registry:
+    """Named metrics, each with any number of label combinations."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help, {formatted labels: metric})
+        self._metrics: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+
+    def _get(self, kind: str, factory, name: str, help: str, labels: Dict[str, str]):
+        formatted = _format_labels(labels)
+        with self._lock:
+            family = self._metrics.get(name)
+            if family is None:
+                family = self._metrics[name] = (kind, help, {})
+            elif family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            metric = family[2].get(formatted)
+            if metric is None:
+                metric = family[2][formatted] = factory()
+            return metric
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        return self._get('counter', Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                  **labels: str) -> Histogram:
+        return self._get('histogram', lambda: Histogram(buckets), name, help, labels)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in self._metrics.items()]
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in metrics:
+                lines.extend(metric.samples(name, labels))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, **labels: str) -> Counter:
+    return REGISTRY.counter(name, help, **labels)
+
+def histogram(name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+              **labels: str) -> Histogram:
+    return REGISTRY.histogram(name, help, buckets, **labels)
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p99/p999/max of latency samples (seconds), in milliseconds."""
+    if not samples:
+        return {'p50': None, 'p99': None, 'p999': None, 'max': None}
+    ordered = sorted(samples)
+
+    def rank(quantile: float) -> float:
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))] * 1000
+
+    return {'p50': rank(0.5), 'p99': rank(0.99), 'p999': rank(0.999), 'max': ordered[-1] * 1000}
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_pid: Optional[int] = None
+
+def start_metrics_server(host: Optional[str] = None,
+                         port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread; at most one server per process."""
+    global _server, _server_pid
+    if _server is not None and _server_pid == os.getpid():
+        return _server
+    host = host or METRICS_CONFIG['host']
+    port = METRICS_CONFIG['port'] if port is None else port
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Could not start metrics server on {host}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    _server, _server_pid = server, os.getpid()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
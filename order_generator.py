@@ -0,0 +1,172 @@
+import random
+from itertools import islice, permutations
+from typing import Dict, Any, Iterator, List, Optional
+
+try:
+    import numpy
+except ImportError:  # optional dependency
+    numpy = None
+
+from message_ids import next_message_id, next_message_ids
+
+PRODUCTS = [
+    {'id': 'PROD123', 'name': 'Laptop', 'price': 999.99},
+    {'id': 'PROD456', 'name': 'Smartphone', 'price': 499.99},
+    {'id': 'PROD789', 'name': 'Headphones', 'price': 99.99},
+    {'id': 'PROD012', 'name': 'Monitor', 'price': 299.99},
+    {'id': 'PROD345', 'name': 'Keyboard', 'price': 79.99}
+]
+MAX_ITEMS = 3
+MAX_QUANTITY = 5
+CITIES = ['Boston', 'New York', 'Chicago', 'San Francisco']
+STATES = ['MA', 'NY', 'IL', 'CA']
+STATUSES = ['pending', 'processing', 'shipped']
+PRIORITIES = ['low', 'medium', 'high']
+CUSTOMER_IDS = (1000, 10000)
+STREET_NUMBERS = (1, 1000)
+ZIP_CODES = (10000, 100000)
+
+# Every (product, quantity) line item at product * (MAX_QUANTITY + 1) + quantity,
+# so orders copy a dict instead of building one
+_ITEMS = [
+    {
+        'product_id': product['id'],
+        'product_name': product['name'],
+        'quantity': quantity,
+        'price': product['price'],
+        'item_total': product['price'] * quantity
+    }
+    for product in PRODUCTS for quantity in range(MAX_QUANTITY + 1)
+]
+_STREETS = [f'{number} Main St' for number in range(STREET_NUMBERS[1])]
+# Ordered product selections of each size, for the random.Random fallback
+_SELECTIONS = [list(permutations(range(len(PRODUCTS)), size))
+               for size in range(1, MAX_ITEMS + 1)]
+_customers: List[tuple] = []
+
+def _customer_table() -> List[tuple]:
+    """(id, name, email) for every customer number, offset by CUSTOMER_IDS[0]."""
+    if not _customers:
+        for number in range(*CUSTOMER_IDS):
+            customer_id = f'CUST{number}'
+            _customers.append((customer_id, f'Customer {customer_id}',
+                               f'customer{customer_id.lower()}@example.com'))
+    return _customers
+
+class OrderGenerator:
+    """Random orders shaped like MessagePublisher.generate_random_order, in bulk.
+
+    Orders are drawn block_size at a time. With NumPy installed every random
+    field of a block is drawn in a few array operations and totals are
+    summed vectorised, leaving only dict assembly per order; without it a
+    seeded random.Random is used instead, which is several times slower.
+    The same seed gives the same orders (apart from order_id, which stays
+    unique) as long as the backend and block_size are the same.
+    """
+
+    def __init__(self, seed: Optional[int] = None, block_size: int = 10000,
+                 use_numpy: Optional[bool] = None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        self.block_size = block_size
+        self.use_numpy = use_numpy
+        if use_numpy:
+            self._rng = numpy.random.default_rng(seed)
+            self._prices = numpy.array([product['price'] for product in PRODUCTS])
+        else:
+            self._random = random.Random(seed)
+
+    def generate(self, count: int) -> List[Dict[str, Any]]:
+        """count new orders."""
+        if self.use_numpy:
+            return self._generate_numpy(count)
+        return [self._generate_one() for _ in range(count)]
+
+    def _generate_numpy(self, count: int) -> List[Dict[str, Any]]:
+        rng = self._rng
+        item_counts = rng.integers(1, MAX_ITEMS + 1, count)
+        # Distinct products per order: the first columns of a random permutation
+        products = numpy.argsort(rng.random((count, len(PRODUCTS))), axis=1)[:, :MAX_ITEMS]
+        quantities = rng.integers(1, MAX_QUANTITY + 1, (count, MAX_ITEMS))
+        used = numpy.arange(MAX_ITEMS) < item_counts[:, None]
+        totals = (self._prices[products] * quantities * used).sum(axis=1).round(2)
+        items = products * (MAX_QUANTITY + 1) + quantities
+
+        customers = _customer_table()
+        columns = zip(
+            next_message_ids(count), item_counts.tolist(), items.tolist(), totals.tolist(),
+            rng.integers(len(customers), size=count).tolist(),
+            rng.integers(*STREET_NUMBERS, count).tolist(),
+            rng.integers(len(CITIES), size=count).tolist(),
+            rng.integers(len(STATES), size=count).tolist(),
+            rng.integers(*ZIP_CODES, count).tolist(),
+            rng.integers(len(STATUSES), size=count).tolist(),
+            rng.integers(len(PRIORITIES), size=count).tolist()
+        )
+        return [
+            self._order(order_id, [dict(_ITEMS[item]) for item in item_row[:item_count]],
+                        total, customers[customer], street, city, state, zip_code,
+                        status, priority)
+            for (order_id, item_count, item_row, total, customer, street,
+                 city, state, zip_code, status, priority) in columns
+        ]
+
+    def _generate_one(self) -> Dict[str, Any]:
+        draw = self._random.random
+        selection = _SELECTIONS[int(draw() * MAX_ITEMS)]
+        products = selection[int(draw() * len(selection))]
+        items = [dict(_ITEMS[product * (MAX_QUANTITY + 1) + 1 + int(draw() * MAX_QUANTITY)])
+                 for product in products]
+        customers = _customer_table()
+        return self._order(
+            next_message_id(), items, round(sum(item['item_total'] for item in items), 2),
+            customers[int(draw() * len(customers))],
+            STREET_NUMBERS[0] + int(draw() * (STREET_NUMBERS[1] - STREET_NUMBERS[0])),
+            int(draw() * len(CITIES)), int(draw() * len(STATES)),
+            ZIP_CODES[0] + int(draw() * (ZIP_CODES[1] - ZIP_CODES[0])),
+            int(draw() * len(STATUSES)), int(draw() * len(PRIORITIES))
+        )
+
+    @staticmethod
+    def _order(order_id: int, items: List[Dict[str, Any]], total: float, customer: tuple,
+               street: int, city: int, state: int, zip_code: int, status: int,
+               priority: int) -> Dict[str, Any]:
+        return {
+            'order_id': f'ORD{order_id}',
+            'customer': {'id': customer[0], 'name': customer[1], 'email': customer[2]},
+            'items': items,
+            'total_amount': total,
+            'shipping_address': {
+                'street': _STREETS[street],
+                'city': CITIES[city],
+                'state': STATES[state],
+                'zip': str(zip_code)
+            },
+            'status': STATUSES[status],
+            'priority': PRIORITIES[priority]
+        }
+
+    def stream(self, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Orders one at a time, endlessly or up to limit (for publish_stream)."""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            count = self.block_size if remaining is None else min(self.block_size, remaining)
+            yield from self.generate(count)
+            if remaining is not None:
+                remaining -= count
+
+    def encoded_batches(self, publisher, batch_size: int,
+                        limit: Optional[int] = None) -> Iterator[List[tuple]]:
+        """Batches already encoded by publisher.encode_orders, for publish_encoded.
+
+        Encoding (and compression) happens here, so materialising the batches
+        first keeps all per-message CPU work out of the publish loop.
+        """
+        orders = self.stream(limit)
+        while True:
+            batch = list(islice(orders, batch_size))
+            if not batch:
+                return
+            yield publisher.encode_orders(batch)
@@ -0,0 +1,140 @@
+"""Typed order messages with validation compiled from a schema.
+
+Each Model subclass lists its fields in SCHEMA as name -> type, where a type
+is str, int, float (ints accepted), another Model, a [Model] list, or a
+tuple of the above. When the class is created, its SCHEMA is compiled
+into a from_dict function. That function checks and converts a decoded
+payload in one pass and raises SchemaError, naming the field, on the first
+missing or mistyped value. Unknown keys are ignored.
+
+Instances use __slots__, so a buffered order costs a fraction of its
+nested dicts. They also keep mapping-style access (message['data'],
+order.get('status')), so code written against the dict messages still
+works.
+"""
+from typing import Callable, Dict, Any
+from message_codecs import CodecError
+
+class SchemaError(CodecError):
+    """Raised when a payload does not match the order schema."""
+
+def _type_name(value: Any) -> str:
+    return type(value).__name__
+
+def _check(var: str, kind: Any) -> str:
+    """Expression that is true when var holds a kind."""
+    if isinstance(kind, tuple):
+        return ' or '.join(f'({_check(var, option)})' for option in kind)
+    if kind is float:
+        return f'type({var}) is float or type({var}) is int'
+    return f'type({var}) is {kind.__name__}'
+
+def _compile(cls) -> None:
+    lines = [
+        'def from_dict(data):',
+        '    if type(data) is not dict:',
+        f'        raise SchemaError("{cls.__name__}: expected an object, got " + _type_name(data))'
+    ]
+    fields = list(cls.SCHEMA.items())
+    if fields:
+        lines.append('    try:')
+        lines += [f'        v{index} = data[{name!r}]' for index, (name, _) in enumerate(fields)]
+        lines += [
+            '    except KeyError as e:',
+            f'        raise SchemaError("{cls.__name__}: missing " + repr(e.args[0])) from None'
+        ]
+    namespace = {'SchemaError': SchemaError, '_type_name': _type_name, 'cls': cls}
+    for index, (name, kind) in enumerate(fields):
+        var = f'v{index}'
+        where = f'{cls.__name__}.{name}'
+        if isinstance(kind, list):
+            namespace[f'build{index}'] = kind[0].from_dict
+            lines += [
+                f'    if type({var}) is not list:',
+                f'        raise SchemaError("{where}: expected a list, got " + _type_name({var}))',
+                f'    {var} = [build{index}(element) for element in {var}]'
+            ]
+        elif isinstance(kind, type) and issubclass(kind, Model):
+            namespace[f'build{index}'] = kind.from_dict
+            lines.append(f'    {var} = build{index}({var})')
+        else:
+            expected = '|'.join(option.__name__ for option in kind) \
+                if isinstance(kind, tuple) else kind.__name__
+            lines += [
+                f'    if not ({_check(var, kind)}):',
+                f'        raise SchemaError("{where}: expected {expected}, got " + _type_name({var}))'
+            ]
+    lines.append('    instance = cls.__new__(cls)')
+    lines += [f'    instance.{name} = v{index}' for index, (name, _) in enumerate(fields)]
+    lines.append('    return instance')
+    exec('\n'.join(lines), namespace)
+    cls.from_dict = staticmethod(namespace['from_dict'])
+
+class Model:
+    __slots__ = ()
+    SCHEMA: Dict[str, Any] = {}
+    # Built from SCHEMA by _compile, for Model itself and every subclass
+    from_dict: Callable[[Dict[str, Any]], 'Model']
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _compile(cls)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.SCHEMA:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.SCHEMA:
+            return default
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.SCHEMA
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Back to plain dicts and lists, e.g. for encoding."""
+        result = {}
+        for name in self.SCHEMA:
+            value = getattr(self, name)
+            if isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [element.to_dict() for element in value]
+            result[name] = value
+        return result
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.SCHEMA)
+        return f'{type(self).__name__}({fields})'
+
+_compile(Model)
+
+class Customer(Model):
+    __slots__ = ('id', 'name', 'email')
+    SCHEMA = {'id': str, 'name': str, 'email': str}
+
+class Item(Model):
+    __slots__ = ('product_id', 'product_name', 'quantity', 'price', 'item_total')
+    SCHEMA = {'product_id': str, 'product_name': str, 'quantity': int, 'price': float,
+              'item_total': float}
+
+class Address(Model):
+    __slots__ = ('street', 'city', 'state', 'zip')
+    SCHEMA = {'street': str, 'city': str, 'state': str, 'zip': str}
+
+class Order(Model):
+    __slots__ = ('order_id', 'customer', 'items', 'total_amount', 'shipping_address',
+                 'status', 'priority')
+    SCHEMA = {'order_id': str, 'customer': Customer, 'items': [Item], 'total_amount': float,
+              'shipping_address': Address, 'status': str, 'priority': str}
+
+class OrderMessage(Model):
+    """The envelope MessagePublisher wraps every order in."""
+    __slots__ = ('timestamp', 'data', 'message_id', 'source')
+    SCHEMA = {'timestamp': str, 'data': Order, 'message_id': (int, str), 'source': str}
+
+def decode_order_message(payload: Dict[str, Any]) -> OrderMessage:
+    """Validate a decoded body and build its OrderMessage; raises SchemaError."""
+    return OrderMessage.from_dict(payload)
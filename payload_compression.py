@@ -0,0 +1,81 @@
+import lzma
+import time
+import zlib
+import threading
+from typing import Dict, Any, Optional, Tuple
+from message_codecs import CodecError
+
+# content_encoding value -> (compress(body, level), decompress(body))
+ALGORITHMS = {
+    'zlib': (lambda body, level: zlib.compress(body, level), zlib.decompress),
+    'lzma': (lambda body, level: lzma.compress(body, preset=level), lzma.decompress)
+}
+
+# Encodings that describe the character set rather than a compression
+IDENTITY_ENCODINGS = {None, '', 'utf-8', 'identity'}
+
+class Compressor:
+    """Optional body compression, reflected in the message's content_encoding.
+
+    Bodies smaller than threshold bytes are sent as-is. Sizes and CPU time are
+    accumulated so the threshold and algorithm can be tuned from stats().
+    """
+
+    def __init__(self, algorithm: Optional[str] = None, threshold: int = 1024, level: int = 6):
+        if algorithm is not None and algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown compression algorithm {algorithm!r}")
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.level = level
+        self._lock = threading.Lock()
+        self._stats = {
+            'messages': 0,
+            'compressed': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'cpu_seconds': 0.0
+        }
+
+    def _record(self, compressed: bool, bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+        with self._lock:
+            stats = self._stats
+            stats['messages'] += 1
+            stats['compressed'] += compressed
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['cpu_seconds'] += cpu_seconds
+
+    def compress(self, body: bytes) -> Tuple[bytes, Optional[str]]:
+        """Return the body to send and its content_encoding (None if uncompressed)."""
+        if self.algorithm is None or len(body) < self.threshold:
+            self._record(False, len(body), len(body), 0.0)
+            return body, None
+        started = time.thread_time()
+        compressed = ALGORITHMS[self.algorithm][0](body, self.level)
+        self._record(True, len(body), len(compressed), time.thread_time() - started)
+        return compressed, self.algorithm
+
+    def decompress(self, body: bytes, content_encoding: Optional[str]) -> bytes:
+        if content_encoding in IDENTITY_ENCODINGS:
+            return body
+        try:
+            decompress = ALGORITHMS[content_encoding][1]
+        except KeyError:
+            raise CodecError(f"Unsupported content encoding {content_encoding!r}")
+        started = time.thread_time()
+        try:
+            decompressed = decompress(body)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise CodecError(f"Error decompressing body: {str(e)}") from e
+        self._record(True, len(decompressed), len(body), time.thread_time() - started)
+        return decompressed
+
+    def stats(self) -> Dict[str, Any]:
+        """Totals plus compression ratio and CPU time per compressed message."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['ratio'] = stats['bytes_in'] / stats['bytes_out'] if stats['bytes_out'] else 1.0
+        stats['cpu_us_per_message'] = (
+            stats['cpu_seconds'] / stats['compressed'] * 1e6 if stats['compressed'] else 0.0
+        )
+        return stats
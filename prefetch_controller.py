@@ -0,0 +1,75 @@
+import math
+import threading
+from typing import Dict, Any
+
+class AdaptivePrefetchController:
+    """Chooses a basic_qos prefetch_count from observed timings.
+
+    Each worker needs enough messages buffered to stay busy while its ack
+    travels to the broker and the next delivery travels back, i.e. roughly
+    1 + round_trip / processing_time messages (Little's law), scaled by the
+    number of workers and a headroom factor and clamped to [min, max].
+    """
+
+    def __init__(self, min_prefetch: int, max_prefetch: int, workers: int = 1,
+                 headroom: float = 1.5, smoothing: float = 0.2):
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.workers = max(1, workers)
+        self.headroom = headroom
+        self.smoothing = smoothing
+
+        self.prefetch = min_prefetch
+        self.processing_time = None
+        self.round_trip = None
+        self.adjustments = 0
+        self._round_trip_window = None
+        self._lock = threading.Lock()
+
+    def _smooth(self, current, sample: float) -> float:
+        if current is None:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def record_processing(self, seconds: float) -> None:
+        """Per-message processing time; may be called from worker threads."""
+        with self._lock:
+            self.processing_time = self._smooth(self.processing_time, seconds)
+
+    def record_round_trip(self, seconds: float) -> None:
+        """A broker round-trip sample (QoS RPC time or ack-to-delivery gap).
+
+        Gaps are only a round-trip when the queue has a backlog, so the
+        minimum sample of each interval is what gets folded in.
+        """
+        with self._lock:
+            if self._round_trip_window is None or seconds < self._round_trip_window:
+                self._round_trip_window = seconds
+
+    def target(self) -> int:
+        """Fold the latest samples in and return the prefetch to use next."""
+        with self._lock:
+            if self._round_trip_window is not None:
+                self.round_trip = self._smooth(self.round_trip, self._round_trip_window)
+                self._round_trip_window = None
+            processing_time = self.processing_time
+            round_trip = self.round_trip
+
+        if not processing_time or round_trip is None:
+            return self.prefetch
+        per_worker = 1 + round_trip / processing_time
+        wanted = math.ceil(per_worker * self.workers * self.headroom)
+        return max(self.min_prefetch, min(self.max_prefetch, wanted))
+
+    def update(self, prefetch: int) -> None:
+        if prefetch != self.prefetch:
+            self.prefetch = prefetch
+            self.adjustments += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'prefetch': self.prefetch,
+            'processing_time': self.processing_time,
+            'round_trip': self.round_trip,
+            'adjustments': self.adjustments
+        }
@@ -0,0 +1,272 @@
+"""Open-loop, rate-controlled publishing.
+
+Every message has an intended send time fixed in advance by the target rate,
+and lag and confirm latency are measured from that time rather than from
+when the message actually went out. A publisher that stalls therefore shows
+up as growing lag and latency (no coordinated omission) instead of as a
+quietly lower rate.
+
+    python publish_scheduler.py --profile step --steps 30:1000,30:5000 --burst 50
+"""
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from config import SCHEDULER_CONFIG
+from metrics import percentiles
+
+logger = logging.getLogger(__name__)
+
+class RateProfile:
+    """Target rate over time, as linear segments of (seconds, start_rate, end_rate).
+
+    Rates are in messages per second. The profile ends after its last
+    segment.
+    """
+
+    def __init__(self, segments: List[Tuple[float, float, float]]):
+        if not segments:
+            raise ValueError("A rate profile needs at least one segment")
+        for seconds, start_rate, end_rate in segments:
+            if seconds <= 0 or start_rate < 0 or end_rate < 0:
+                raise ValueError(f"Invalid rate segment {(seconds, start_rate, end_rate)}")
+        self.segments = list(segments)
+        # Start time and messages sent before each segment
+        self._starts = [0.0]
+        self._counts = [0.0]
+        for seconds, start_rate, end_rate in self.segments:
+            self._starts.append(self._starts[-1] + seconds)
+            self._counts.append(self._counts[-1] + (start_rate + end_rate) / 2 * seconds)
+        self.duration = self._starts[-1]
+        self.total = self._counts[-1]
+
+    @classmethod
+    def constant(cls, rate: float, seconds: float) -> 'RateProfile':
+        return cls([(seconds, rate, rate)])
+
+    @classmethod
+    def ramp(cls, start_rate: float, end_rate: float, seconds: float,
+             hold: float = 0) -> 'RateProfile':
+        """Linear ramp, optionally holding the end rate for hold seconds."""
+        segments = [(seconds, start_rate, end_rate)]
+        if hold:
+            segments.append((hold, end_rate, end_rate))
+        return cls(segments)
+
+    @classmethod
+    def steps(cls, steps: List[Tuple[float, float]]) -> 'RateProfile':
+        """Constant rates in turn, from (seconds, rate) pairs."""
+        return cls([(seconds, rate, rate) for seconds, rate in steps])
+
+    @classmethod
+    def spike(cls, base_rate: float, spike_rate: float, seconds: float,
+              spike_at: float, spike_seconds: float) -> 'RateProfile':
+        """base_rate for seconds, with spike_rate from spike_at for spike_seconds."""
+        segments = []
+        if spike_at > 0:
+            segments.append((spike_at, base_rate, base_rate))
+        segments.append((spike_seconds, spike_rate, spike_rate))
+        after = seconds - spike_at - spike_seconds
+        if after > 0:
+            segments.append((after, base_rate, base_rate))
+        return cls(segments)
+
+    def _segment(self, elapsed: float) -> int:
+        return min(bisect_right(self._starts, elapsed) - 1, len(self.segments) - 1)
+
+    def rate(self, elapsed: float) -> float:
+        if not 0 <= elapsed < self.duration:
+            return 0.0
+        index = self._segment(elapsed)
+        seconds, start_rate, end_rate = self.segments[index]
+        return start_rate + (end_rate - start_rate) * (elapsed - self._starts[index]) / seconds
+
+    def messages_by(self, elapsed: float) -> float:
+        """Messages the profile calls for in its first elapsed seconds."""
+        if elapsed <= 0:
+            return 0.0
+        if elapsed >= self.duration:
+            return self.total
+        index = self._segment(elapsed)
+        offset = elapsed - self._starts[index]
+        start_rate = self.segments[index][1]
+        return self._counts[index] + (start_rate + self.rate(elapsed)) / 2 * offset
+
+    def time_for(self, count: float) -> Optional[float]:
+        """When messages_by() reaches count, or None if the profile ends first."""
+        if count > self.total + 1e-9:
+            return None
+        count = min(count, self.total)
+        # The segment that reaches count, not a zero-rate one that follows it
+        index = max(0, min(bisect_left(self._counts, count) - 1, len(self.segments) - 1))
+        seconds, start_rate, end_rate = self.segments[index]
+        needed = count - self._counts[index]
+        if needed <= 0:
+            return self._starts[index]
+        # Solve start_rate * t + slope * t^2 / 2 = needed for t
+        slope = (end_rate - start_rate) / seconds
+        root = math.sqrt(max(0.0, start_rate * start_rate + 2 * slope * needed))
+        offset = 2 * needed / (start_rate + root) if start_rate + root > 0 else seconds
+        return self._starts[index] + min(offset, seconds)
+
+class PublishScheduler:
+    """Publishes to a RateProfile with a token bucket of depth burst.
+
+    The bucket starts full and refills at the profile's rate, so the first
+    burst messages are due at once and the rest as tokens accrue. Intended
+    send times follow a sender that is never late; if the real publisher
+    falls behind, the owed messages are sent as fast as possible (up to
+    max_batch per write) and their lag is recorded. Nothing is skipped.
+    One lag and one latency sample are kept per message.
+    """
+
+    def __init__(self, publisher, profile: RateProfile, burst: Optional[int] = None,
+                 max_batch: Optional[int] = None, report_interval: Optional[float] = None):
+        self.publisher = publisher
+        self.profile = profile
+        self.burst = burst or SCHEDULER_CONFIG['burst']
+        self.max_batch = max_batch or SCHEDULER_CONFIG['max_batch']
+        self.report_interval = SCHEDULER_CONFIG['report_interval'] if report_interval is None \
+            else report_interval
+
+        self.sent = 0
+        self.lags: List[float] = []
+        self.latencies: List[float] = []
+        self.failed = 0
+        self._started = None
+        self._finished = None
+
+    def intended_time(self, index: int) -> Optional[float]:
+        """Seconds after the start at which message index is due."""
+        if index < self.burst:
+            return 0.0
+        return self.profile.time_for(index - self.burst + 1)
+
+    def due_by(self, elapsed: float) -> int:
+        """Messages due in the first elapsed seconds."""
+        # A small epsilon keeps float error from holding back a due message
+        return self.burst + int(self.profile.messages_by(elapsed) + 1e-9)
+
+    def _on_confirm(self, future, intended: float) -> None:
+        if future.exception() is None:
+            self.latencies.append(time.perf_counter() - intended)
+        else:
+            self.failed += 1
+
+    def run(self, orders: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Publish orders on schedule until the profile ends; Ctrl+C stops early."""
+        orders = iter(orders)
+        total = self.due_by(self.profile.duration)
+        publisher = self.publisher
+        self._started = started = time.perf_counter()
+        last_report, reported_sent = started, 0
+        logger.info(f"Publishing {total} messages over {self.profile.duration:.0f}s "
+                    f"(burst {self.burst})")
+        try:
+            while self.sent < total:
+                now = time.perf_counter()
+                due = min(self.due_by(now - started), total)
+                if self.sent >= due:
+                    publisher.idle(max(0.0, started + self.intended_time(self.sent) - now))
+                    continue
+
+                count = min(due - self.sent, self.max_batch)
+                batch = list(islice(orders, count))
+                if not batch:
+                    logger.warning("Order source ran out before the schedule ended")
+                    break
+                intended = [started + self.intended_time(index)
+                            for index in range(self.sent, self.sent + len(batch))]
+                futures = publisher.send_encoded(publisher.encode_orders(batch))
+                sent_at = time.perf_counter()
+                for due_at, future in zip(intended, futures):
+                    self.lags.append(sent_at - due_at)
+                    if future is not None:
+                        future.add_done_callback(
+                            lambda f, due_at=due_at: self._on_confirm(f, due_at))
+                self.sent += len(batch)
+
+                if self.report_interval and sent_at - last_report >= self.report_interval:
+                    elapsed = sent_at - started
+                    achieved = (self.sent - reported_sent) / (sent_at - last_report)
+                    logger.info(f"{elapsed:.0f}s: target {self.profile.rate(elapsed):.0f} msg/s, "
+                                f"achieved {achieved:.0f} msg/s, "
+                                f"lag {(sent_at - intended[-1]) * 1000:.1f}ms")
+                    last_report, reported_sent = sent_at, self.sent
+            publisher.wait_for_confirms()
+        except KeyboardInterrupt:
+            logger.info("Stopping scheduled publishing")
+        self._finished = time.perf_counter()
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        """Achieved vs target rate, schedule lag and confirm latency so far."""
+        finished = self._finished or time.perf_counter()
+        elapsed = finished - self._started if self._started is not None else 0.0
+        scheduled = min(elapsed, self.profile.duration)
+        target = self.due_by(scheduled)
+        return {
+            'seconds': elapsed,
+            'target_messages': target,
+            'sent': self.sent,
+            'target_rate': target / scheduled if scheduled > 0 else 0.0,
+            'achieved_rate': self.sent / elapsed if elapsed > 0 else 0.0,
+            'confirmed': len(self.latencies),
+            'failed': self.failed,
+            'lag_ms': percentiles(self.lags),
+            'confirm_latency_ms': percentiles(self.latencies)
+        }
+
+def parse_steps(text: str) -> List[Tuple[float, float]]:
+    """'30:1000,60:5000' -> [(30.0, 1000.0), (60.0, 5000.0)]"""
+    return [tuple(float(value) for value in step.split(':')) for step in text.split(',')]
+
+def profile_from_args(options: argparse.Namespace) -> RateProfile:
+    if options.profile == 'ramp':
+        return RateProfile.ramp(options.rate, options.to_rate, options.duration, options.hold)
+    if options.profile == 'step':
+        return RateProfile.steps(parse_steps(options.steps))
+    if options.profile == 'spike':
+        return RateProfile.spike(options.rate, options.spike_rate, options.duration,
+                                 options.spike_at, options.spike_seconds)
+    return RateProfile.constant(options.rate, options.duration)
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=['constant', 'ramp', 'step', 'spike'],
+                        default='constant')
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='msg/s: the constant rate, ramp start or spike base')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--to-rate', type=float, default=5000, help='ramp end rate')
+    parser.add_argument('--hold', type=float, default=0, help='seconds to hold the ramp end rate')
+    parser.add_argument('--steps', default='30:1000,30:5000', help='seconds:rate,...')
+    parser.add_argument('--spike-rate', type=float, default=10000)
+    parser.add_argument('--spike-at', type=float, default=20, help='seconds')
+    parser.add_argument('--spike-seconds', type=float, default=5)
+    parser.add_argument('--burst', type=int, default=SCHEDULER_CONFIG['burst'])
+    parser.add_argument('--seed', type=int, help='seed for the generated orders')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    from publisher import MessagePublisher
+    from order_generator import OrderGenerator
+
+    options = parse_args(sys.argv[1:])
+    publisher = MessagePublisher()
+    scheduler = PublishScheduler(publisher, profile_from_args(options), burst=options.burst)
+    try:
+        result = scheduler.run(OrderGenerator(seed=options.seed).stream())
+    finally:
+        publisher.close()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
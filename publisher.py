@@ -1,91 +1,508 @@
 import pika
-import json
 import time
 import random
 import logging
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime, UTC
-from typing import Dict, Any
-from config import RABBITMQ_CONFIG, RETRY_CONFIG
+from itertools import islice
+from typing import Dict, Any, Callable, Iterable, List, Optional
+from message_codecs import get_codec
+from message_ids import next_message_id
+from payload_compression import Compressor
+from publisher_outbox import Outbox, OutboxDrainer
+from connection_helper import ConnectionPool, get_pool, order_priority, order_routing_key
+from config import RABBITMQ_CONFIG, PUBLISHER_CONFIG, OUTBOX_CONFIG, METRICS_CONFIG
+from logging_setup import SampledLogger
+import metrics
 
 logger = logging.getLogger(__name__)
+# Per-message records, subject to LOGGING_CONFIG sampling
+message_log = SampledLogger(__name__)
+
+PUBLISHED = metrics.counter('amqp_messages_published_total', 'Messages sent to the broker')
+CONFIRMED = metrics.counter('amqp_messages_confirmed_total', 'Publishes acked by the broker')
+NACKED = metrics.counter('amqp_messages_nacked_total',
+                         'Publishes nacked by the broker after all retries')
+PUBLISH_RETRIES = metrics.counter('amqp_publish_retries_total', 'Nacked publishes sent again')
+SPOOLED = metrics.counter('amqp_messages_spooled_total', 'Messages written to the outbox')
+CONFIRM_LATENCY = metrics.histogram('amqp_publish_confirm_seconds',
+                                    'Time from publishing a message until the broker acked it')
+
+class PartialPublishError(Exception):
+    """send_encoded() failed after handing the first len(futures) messages over.
+
+    futures holds what send_encoded() would have returned for those; error
+    is what stopped the rest.
+    """
+
+    def __init__(self, error: Exception, futures: List[Optional[Future]]):
+        super().__init__(str(error))
+        self.error = error
+        self.futures = futures
+
+class PendingPublish:
+    """A publish that is waiting for a broker ack/nack in confirm mode."""
+    __slots__ = ('message_id', 'routing_key', 'body', 'properties', 'future', 'attempts',
+                 'sent_at')
+
+    def __init__(self, message_id: Any, routing_key: str, body: bytes,
+                 properties: pika.BasicProperties, future: Future):
+        self.message_id = message_id
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.future = future
+        self.attempts = 1
+        self.sent_at = time.perf_counter()
+
+def pop_confirmed(pending: 'OrderedDict[int, PendingPublish]', delivery_tag: int,
+                  multiple: bool) -> List[PendingPublish]:
+    """Remove and return the publishes covered by a Basic.Ack/Basic.Nack."""
+    if not multiple:
+        confirmed = pending.pop(delivery_tag, None)
+        return [confirmed] if confirmed is not None else []
+
+    confirmed = []
+    while pending:
+        if next(iter(pending)) > delivery_tag:
+            break
+        confirmed.append(pending.popitem(last=False)[1])
+    return confirmed
 
 class MessagePublisher:
-    def __init__(self):
+    def __init__(self, confirm_delivery: Optional[bool] = None,
+                 content_type: Optional[str] = None,
+                 pool: Optional[ConnectionPool] = None,
+                 use_outbox: Optional[bool] = None):
         self.config = RABBITMQ_CONFIG
-        self.connect()
+        self.publisher_config = PUBLISHER_CONFIG
+        if confirm_delivery is None:
+            confirm_delivery = self.publisher_config['confirm_delivery']
+        self.confirm_delivery = confirm_delivery
+        self.max_in_flight = self.publisher_config['max_in_flight']
+        self.codec = get_codec(content_type or self.publisher_config['content_type'])
+        self.compressor = Compressor(
+            self.publisher_config['compression'],
+            threshold=self.publisher_config['compression_threshold'],
+            level=self.publisher_config['compression_level']
+        )
+        self._pending: 'OrderedDict[int, PendingPublish]' = OrderedDict()
+        self._next_delivery_tag = 1
+
+        self.pool = pool or get_pool()
+        self.connection = None
+        self.channel = None
+        self._blocked = False
+        self.spooled_count = 0
+        self.outbox: Optional[Outbox] = None
+        self.drainer: Optional[OutboxDrainer] = None
+        if use_outbox is None:
+            use_outbox = OUTBOX_CONFIG['enabled']
+        if METRICS_CONFIG['enabled']:
+            metrics.start_metrics_server()
+
+        if not use_outbox:
+            self.connect()
+            return
+
+        self.outbox = Outbox()
+        # The drainer replays on its own connection, pika's are not thread-safe
+        self.drainer = OutboxDrainer(self.outbox, lambda: MessagePublisher(
+            confirm_delivery=True, content_type=self.codec.content_type,
+            pool=ConnectionPool(), use_outbox=False
+        ))
+        self.drainer.start()
+        try:
+            self.connect(max_retries=1, connection_attempts=1)
+        except Exception as e:
+            logger.warning(f"Broker unavailable, spooling to the outbox: {str(e)}")
+            self.drainer.broker_available.clear()
+
+    def connect(self, max_retries: Optional[int] = None, connection_attempts: int = 3) -> None:
+        # Connections are long-lived and shared through the pool, which also
+        # skips re-declaring the topology on later channels and reconnects
+        if self.channel is not None:
+            self.pool.release_channel(self.channel, reusable=False)
+            self.channel = None
+        self.connection = self.pool.get_connection(max_retries, connection_attempts)
+        self.connection.add_on_connection_blocked_callback(self._on_blocked)
+        self.connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        self._blocked = False
+        self.channel = self.pool.acquire_channel(self.connection)
+        if self.confirm_delivery:
+            self.enable_confirms()
+
+    def _on_blocked(self, connection, method_frame) -> None:
+        logger.warning("Broker blocked publishing (resource alarm)")
+        self._blocked = True
+
+    def _on_unblocked(self, connection, method_frame) -> None:
+        logger.info("Broker unblocked publishing")
+        self._blocked = False
+
+    def _channel_ready(self) -> bool:
+        """True if publishes can go straight to the broker.
+
+        Never waits on a broker that is down: the drainer probes it, and the
+        channel is only reopened once the drainer reports it back.
+        """
+        if self._blocked and self.connection.is_open:
+            # Only processing I/O can deliver the Connection.Unblocked
+            self.connection.process_data_events(time_limit=0)
+            if self._blocked:
+                return False
+        if self.channel is not None:
+            if self.channel.is_open and self.connection.is_open:
+                return True
+            self.pool.release_channel(self.channel, reusable=False)
+            self.channel = None
+            self.drainer.broker_available.clear()
+            return False
+        if not self.drainer.broker_available.is_set():
+            return False
+        try:
+            self.connect(max_retries=1, connection_attempts=1)
+            return True
+        except Exception as e:
+            logger.warning(f"Broker unavailable again: {str(e)}")
+            self.drainer.broker_available.clear()
+            return False
+
+    def _spool(self, routing_key: str, body: bytes, properties: pika.BasicProperties) -> None:
+        self.outbox.append(routing_key, body, properties)
+        self.spooled_count += 1
+        SPOOLED.inc()
+        self.drainer.notify()
+
+    def _spool_after_error(self, error: Exception) -> None:
+        """Move unconfirmed publishes to the outbox after the broker went away."""
+        if self.outbox is None:
+            raise error
+        logger.warning(f"Broker unavailable ({str(error)}), spooling to the outbox")
+        self.drainer.broker_available.clear()
+        while self._pending:
+            _, pending = self._pending.popitem(last=False)
+            self._spool(pending.routing_key, pending.body, pending.properties)
+            pending.future.set_exception(
+                Exception(f"Message {pending.message_id} spooled to the outbox before confirmation")
+            )
+        if self.channel is not None:
+            self.pool.release_channel(self.channel, reusable=False)
+            self.channel = None
+
+    def enable_confirms(self) -> None:
+        """Put the channel in confirm mode with pipelined (windowed) acks.
 
-    def connect(self) -> None:
-        credentials = pika.PlainCredentials(
-            self.config['credentials']['username'],
-            self.config['credentials']['password']
+        BlockingChannel.confirm_delivery() waits for a broker round-trip on
+        every publish, so confirms are tracked here on the underlying channel
+        and up to max_in_flight publishes are kept unconfirmed at once.
+        """
+        select_ok = []
+        self._pending.clear()
+        self._next_delivery_tag = 1
+        self.channel._impl.confirm_delivery(
+            ack_nack_callback=self._on_delivery_confirmation,
+            callback=select_ok.append
         )
-        
-        for attempt in range(RETRY_CONFIG['max_retries']):
-            try:
-                self.connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(
-                        host=self.config['host'],
-                        port=self.config['port'],
-                        virtual_host=self.config['virtual_host'],
-                        credentials=credentials,
-                        heartbeat=600
-                    )
-                )
-                self.channel = self.connection.channel()
-                
-                # Declare exchange before queue
-                self.channel.exchange_declare(
-                    exchange=self.config['exchange_name'],
-                    exchange_type='direct',
-                    durable=True
-                )
-                
-                # Declare queue and bind to exchange
-                self.channel.queue_declare(
-                    queue=self.config['queue_name'],
-                    durable=True
+        self._wait_for(lambda: bool(select_ok), self.publisher_config['confirm_timeout'])
+        if not select_ok:
+            raise TimeoutError("Timed out enabling publisher confirms")
+        logger.info(f"Publisher confirms enabled (max in flight: {self.max_in_flight})")
+
+    def _wait_for(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Process connection I/O until predicate() is true or timeout expires."""
+        if predicate():
+            return True
+        deadline = time.monotonic() + timeout
+        # The timer only wakes the poller so the deadline is re-checked
+        timer = self.connection.call_later(timeout, lambda: None)
+        try:
+            # Same waiter loop BlockingChannel uses for its own confirms; it
+            # returns as soon as the predicate holds instead of a fixed slice
+            self.connection._flush_output(
+                lambda: predicate() or time.monotonic() >= deadline
+            )
+        finally:
+            self.connection.remove_timeout(timer)
+        return predicate()
+
+    def _send(self, routing_key: str, body: bytes, properties: pika.BasicProperties) -> None:
+        # Queue the frames on the underlying channel; _flush() writes them so
+        # a batch goes out back-to-back instead of one socket write each
+        self.channel._impl.basic_publish(
+            exchange=self.config['exchange_name'],
+            routing_key=routing_key,
+            body=body,
+            properties=properties
+        )
+        if self.confirm_delivery:
+            self._next_delivery_tag += 1
+
+    def _flush(self) -> None:
+        """Write queued frames and pick up any confirms that have arrived."""
+        if self.channel is not None:
+            self.connection._flush_output()
+
+    def _track(self, pending: PendingPublish) -> None:
+        # Only tracked once handed to pika, so a failed send is not spooled twice
+        delivery_tag = self._next_delivery_tag
+        self._send(pending.routing_key, pending.body, pending.properties)
+        self._pending[delivery_tag] = pending
+
+    def _publish_confirmed(self, message_id: Any, routing_key: str, body: bytes,
+                           properties: pika.BasicProperties) -> Future:
+        if len(self._pending) >= self.max_in_flight:
+            if not self._wait_for(lambda: len(self._pending) < self.max_in_flight,
+                                  self.publisher_config['confirm_timeout']):
+                raise TimeoutError(
+                    f"Timed out waiting for confirms ({len(self._pending)} in flight)"
                 )
-                
-                self.channel.queue_bind(
-                    exchange=self.config['exchange_name'],
-                    queue=self.config['queue_name'],
-                    routing_key=self.config['routing_key']
+        future = Future()
+        self._track(PendingPublish(message_id, routing_key, body, properties, future))
+        return future
+
+    def _on_delivery_confirmation(self, frame: pika.frame.Method) -> None:
+        """Resolve pending publishes on Basic.Ack / Basic.Nack from the broker."""
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        confirmed = pop_confirmed(self._pending, method.delivery_tag, method.multiple)
+
+        for pending in confirmed:
+            if acked:
+                CONFIRMED.inc()
+                CONFIRM_LATENCY.observe(time.perf_counter() - pending.sent_at)
+                pending.future.set_result(pending.message_id)
+            elif pending.attempts <= self.publisher_config['max_publish_retries']:
+                logger.warning(f"Message {pending.message_id} nacked by broker, "
+                               f"retrying (attempt {pending.attempts})")
+                PUBLISH_RETRIES.inc()
+                pending.attempts += 1
+                self._track(pending)
+            else:
+                logger.error(f"Message {pending.message_id} nacked by broker, giving up")
+                NACKED.inc()
+                pending.future.set_exception(
+                    Exception(f"Message {pending.message_id} was nacked by the broker")
                 )
-                
-                logger.info("Successfully connected to RabbitMQ")
-                break
-            except Exception as e:
-                logger.error(f"Connection attempt {attempt + 1} failed: {str(e)}")
-                if attempt + 1 < RETRY_CONFIG['max_retries']:
-                    time.sleep(RETRY_CONFIG['retry_delay'])
-                else:
-                    raise
-
-    def publish_message(self, message_data: Dict[str, Any]) -> None:
+
+    def wait_for_confirms(self, timeout: Optional[float] = None) -> bool:
+        """Block until every in-flight publish is acked or nacked for good."""
+        if not self._pending:
+            return True
+        if timeout is None:
+            timeout = self.publisher_config['confirm_timeout']
+        return self._wait_for(lambda: not self._pending, timeout)
+
+    def _fail_pending(self, reason: str) -> None:
+        while self._pending:
+            _, pending = self._pending.popitem(last=False)
+            pending.future.set_exception(Exception(reason))
+
+    def publish_body(self, routing_key: str, body: bytes, properties: pika.BasicProperties,
+                     message_id: Any, on_confirm: Optional[Callable[[Future], None]] = None,
+                     flush: bool = True) -> Optional[Future]:
+        """Publish an already encoded body.
+
+        With the outbox enabled the body is spooled to disk instead while the
+        broker is unreachable or blocking, or while older spooled messages are
+        still waiting to be replayed (so ordering is kept). Spooled messages
+        return None instead of a Future.
+        """
+        if self.outbox is not None and (self.outbox.pending or not self._channel_ready()):
+            self._spool(routing_key, body, properties)
+            return None
+
+        future = None
+        try:
+            if self.confirm_delivery:
+                future = self._publish_confirmed(message_id, routing_key, body, properties)
+                if on_confirm is not None:
+                    future.add_done_callback(on_confirm)
+            else:
+                self._send(routing_key, body, properties)
+            PUBLISHED.inc()
+            if flush:
+                self._flush()
+            return future
+        except pika.exceptions.AMQPError as e:
+            self._spool_after_error(e)
+            if future is None:
+                self._spool(routing_key, body, properties)
+            return None
+
+    def publish_message(self, message_data: Dict[str, Any],
+                        on_confirm: Optional[Callable[[Future], None]] = None) -> Optional[Future]:
+        """Publish an order. In confirm mode returns a Future resolved on ack."""
         try:
             message = {
                 'timestamp': datetime.now(UTC).isoformat(),  # Updated to use timezone-aware datetime
                 'data': message_data,
-                'message_id': int(time.time() * 1000),
+                'message_id': next_message_id(),
                 'source': 'production_system'
             }
-            
-            self.channel.basic_publish(
-                exchange=self.config['exchange_name'],
-                routing_key=self.config['routing_key'],
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # make message persistent
-                    content_type='application/json',
-                    content_encoding='utf-8'
-                )
+            body, compression = self.compressor.compress(self.codec.encode(message))
+            properties = pika.BasicProperties(
+                delivery_mode=2,  # make message persistent
+                message_id=str(message['message_id']),
+                content_type=self.codec.content_type,
+                content_encoding=compression or self.codec.content_encoding,
+                priority=order_priority(message_data)
             )
-            logger.info(f"Published message {message['message_id']}")
+            routing_key = order_routing_key(message_data)
+
+            future = self.publish_body(routing_key, body, properties,
+                                       message['message_id'], on_confirm)
+            message_log.info("Published message %s", message['message_id'])
+            return future
         except Exception as e:
             logger.error(f"Error publishing message: {str(e)}")
             raise
 
-    def generate_random_order(self) -> Dict[str, Any]:
+    def encode_orders(self, orders: Iterable[Dict[str, Any]]) -> List[tuple]:
+        """Encode orders for publish_encoded.
+
+        All messages share one timestamp, taken now. Returns
+        (message_id, routing_key, priority, content_encoding, body) tuples.
+        """
+        timestamp = datetime.now(UTC).isoformat()
+        encode = self.codec.encode
+        compress = self.compressor.compress
+        bodies = []
+        for order in orders:
+            message_id = next_message_id()
+            body, compression = compress(encode({
+                'timestamp': timestamp,
+                'data': order,
+                'message_id': message_id,
+                'source': 'production_system'
+            }))
+            bodies.append((message_id, order_routing_key(order), order_priority(order),
+                           compression, body))
+        return bodies
+
+    def publish_batch(self, orders: Iterable[Dict[str, Any]],
+                      on_confirm: Optional[Callable[[Future], None]] = None) -> Dict[str, Any]:
+        """Publish orders back-to-back and wait once for their confirms.
+
+        Returns the batch statistics (message count, elapsed time, msg/s and,
+        in confirm mode, how many messages were confirmed or failed).
+        on_confirm is called with each message's Future as it resolves.
+        """
+        started = time.perf_counter()
+        return self._publish_encoded(self.encode_orders(orders), on_confirm, started)
+
+    def publish_encoded(self, bodies: List[tuple],
+                        on_confirm: Optional[Callable[[Future], None]] = None) -> Dict[str, Any]:
+        """publish_batch for messages already encoded by encode_orders."""
+        return self._publish_encoded(bodies, on_confirm, time.perf_counter())
+
+    def send_encoded(self, bodies: List[tuple],
+                     on_confirm: Optional[Callable[[Future], None]] = None) -> List[Optional[Future]]:
+        """Publish messages encoded by encode_orders without waiting for confirms.
+
+        Returns one entry per message: its Future in confirm mode, otherwise
+        (or when it was spooled) None. An error partway through raises
+        PartialPublishError with the entries of the messages already sent.
+        """
+        futures = []
+        try:
+            for message_id, routing_key, priority, compression, body in bodies:
+                properties = pika.BasicProperties(
+                    delivery_mode=2,
+                    content_type=self.codec.content_type,
+                    content_encoding=compression or self.codec.content_encoding,
+                    priority=priority,
+                    message_id=str(message_id)
+                )
+                futures.append(self.publish_body(routing_key, body, properties, message_id,
+                                                 on_confirm, flush=False))
+        except Exception as e:
+            raise PartialPublishError(e, futures) from e
+        try:
+            self._flush()
+        except pika.exceptions.AMQPError as e:
+            self._spool_after_error(e)
+        return futures
+
+    def idle(self, seconds: float, until: Optional[Callable[[], bool]] = None) -> None:
+        """Sleep while still processing connection I/O (confirms, heartbeats).
+
+        Returns early once until() is true; another thread can wake the
+        connection with connection.add_callback_threadsafe() to have it
+        re-checked.
+        """
+        until = until or (lambda: False)
+        if self.channel is None or not self.connection.is_open:
+            # No I/O to wait on, so poll
+            deadline = time.monotonic() + seconds
+            while not until() and time.monotonic() < deadline:
+                time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+            return
+        self._wait_for(until, seconds)
+        if self.connection._ready_events:
+            # Wakes from add_callback_threadsafe() become ready timer events that
+            # only process_data_events dispatches; left queued they pile up and
+            # slow down every remove_timeout() in _wait_for
+            self.connection.process_data_events(time_limit=0)
+
+    def _publish_encoded(self, bodies: List[tuple], on_confirm: Optional[Callable[[Future], None]],
+                         started: float) -> Dict[str, Any]:
+        spooled_before = self.spooled_count
+        try:
+            futures = [f for f in self.send_encoded(bodies, on_confirm) if f is not None]
+            try:
+                self.wait_for_confirms()
+            except pika.exceptions.AMQPError as e:
+                self._spool_after_error(e)
+        except Exception as e:
+            logger.error(f"Error publishing batch: {str(e)}")
+            raise
+
+        elapsed = time.perf_counter() - started
+        stats = {
+            'messages': len(bodies),
+            'seconds': elapsed,
+            'rate': len(bodies) / elapsed if elapsed > 0 else 0.0
+        }
+        if self.outbox is not None:
+            stats['spooled'] = self.spooled_count - spooled_before
+        if self.confirm_delivery:
+            stats['confirmed'] = sum(1 for f in futures if f.done() and f.exception() is None)
+            stats['failed'] = len(futures) - stats['confirmed']
+            if stats['failed']:
+                logger.error(f"{stats['failed']} messages in batch were not confirmed")
+        logger.info(f"Published batch of {stats['messages']} messages in "
+                    f"{elapsed:.3f}s ({stats['rate']:.0f} msg/s)")
+        return stats
+
+    def publish_stream(self, orders: Iterable[Dict[str, Any]],
+                       batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Consume an order iterator/generator in batches via publish_batch."""
+        if batch_size is None:
+            batch_size = self.publisher_config['batch_size']
+        totals = {'messages': 0, 'batches': 0, 'seconds': 0.0}
+        if self.confirm_delivery:
+            totals.update(confirmed=0, failed=0)
+
+        iterator = iter(orders)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            stats = self.publish_batch(batch)
+            totals['batches'] += 1
+            for key in totals:
+                if key in stats:
+                    totals[key] += stats[key]
+
+        totals['rate'] = totals['messages'] / totals['seconds'] if totals['seconds'] > 0 else 0.0
+        logger.info(f"Published {totals['messages']} messages in {totals['batches']} batches "
+                    f"({totals['rate']:.0f} msg/s)")
+        return totals
+
+    @staticmethod
+    def generate_random_order() -> Dict[str, Any]:
         """Generate a random order message."""
         products = [
             {'id': 'PROD123', 'name': 'Laptop', 'price': 999.99},
@@ -118,7 +535,7 @@ class MessagePublisher:
         customer_id = f'CUST{random.randint(1000, 9999)}'
         
         return {
-            'order_id': f'ORD{int(time.time() * 1000)}',
+            'order_id': f'ORD{next_message_id()}',
             'customer': {
                 'id': customer_id,
                 'name': f'Customer {customer_id}',
@@ -141,12 +558,16 @@ class MessagePublisher:
         try:
             logger.info("Started continuous message publishing. Press Ctrl+C to stop.")
             message_count = 0
+            # Send times are fixed up front so publish latency does not stretch
+            # the interval; see publish_scheduler for target rates and profiles
+            next_at = time.monotonic()
             while True:
                 order_data = self.generate_random_order()
                 self.publish_message(order_data)
                 message_count += 1
-                logger.info(f"Total messages published: {message_count}")
-                time.sleep(interval)
+                message_log.info("Total messages published: %d", message_count)
+                next_at += interval
+                self.idle(max(0.0, next_at - time.monotonic()))
                 
         except KeyboardInterrupt:
             logger.info(f"Stopping publisher. Total messages sent: {message_count}")
@@ -156,8 +577,20 @@ class MessagePublisher:
             self.close()
 
     def close(self) -> None:
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+        """Release the channel; the pooled connection stays open for reuse."""
+        if self.channel is not None:
+            if self._pending and self.connection.is_open and not self.wait_for_confirms():
+                logger.warning(f"Closing with {len(self._pending)} unconfirmed messages")
+            # A confirm-mode channel still routes acks to this publisher
+            self.pool.release_channel(self.channel, reusable=not self.confirm_delivery)
+            self.channel = None
+        self._fail_pending("Connection closed before the broker confirmed the message")
+        if self.outbox is not None:
+            # Anything not yet replayed stays on disk for the next run
+            self.drainer.stop()
+            self.outbox.close()
+            if self.outbox.pending:
+                logger.warning(f"{self.outbox.pending} messages left in the outbox")
 
 if __name__ == "__main__":
     publisher = MessagePublisher()
@@ -0,0 +1,305 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+import pika
+from config import OUTBOX_CONFIG, RETRY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# body length, metadata length, crc32 of metadata + body
+RECORD_HEADER = struct.Struct('<III')
+
+# BasicProperties fields carried through the outbox
+PROPERTY_FIELDS = ('content_type', 'content_encoding', 'delivery_mode', 'priority',
+                   'message_id', 'timestamp', 'headers')
+
+class OutboxRecord:
+    __slots__ = ('routing_key', 'properties', 'body')
+
+    def __init__(self, routing_key: str, properties: pika.BasicProperties, body: bytes):
+        self.routing_key = routing_key
+        self.properties = properties
+        self.body = body
+
+def _encode_record(routing_key: str, body: bytes, properties: pika.BasicProperties) -> bytes:
+    meta = {'routing_key': routing_key}
+    for field in PROPERTY_FIELDS:
+        value = getattr(properties, field)
+        if value is not None:
+            meta[field] = value
+    meta = json.dumps(meta, separators=(',', ':')).encode()
+    if isinstance(body, str):
+        body = body.encode()
+    crc = zlib.crc32(body, zlib.crc32(meta))
+    return b''.join((RECORD_HEADER.pack(len(body), len(meta), crc), meta, body))
+
+def _decode_record(view: memoryview, offset: int, end: int) -> Tuple[Optional[OutboxRecord], int]:
+    """Parse the record at offset; returns (None, offset) for a torn/corrupt record."""
+    if offset + RECORD_HEADER.size > end:
+        return None, offset
+    body_length, meta_length, crc = RECORD_HEADER.unpack_from(view, offset)
+    meta_start = offset + RECORD_HEADER.size
+    body_start = meta_start + meta_length
+    record_end = body_start + body_length
+    if record_end > end:
+        return None, offset
+    meta = view[meta_start:body_start]
+    body = view[body_start:record_end]
+    if zlib.crc32(body, zlib.crc32(meta)) != crc:
+        return None, offset
+    fields = json.loads(bytes(meta))
+    routing_key = fields.pop('routing_key')
+    return OutboxRecord(routing_key, pika.BasicProperties(**fields), bytes(body)), record_end
+
+class Outbox:
+    """Local append-only spool for messages the broker could not take.
+
+    Records are appended to numbered segment files with a single write each
+    and fsynced in batches by a background thread. The drainer reads them
+    back through mmap in order, and commit() checkpoints its position and
+    deletes segments that have been fully confirmed.
+    """
+
+    def __init__(self, directory: Optional[str] = None, segment_size: Optional[int] = None,
+                 fsync_interval: Optional[float] = None):
+        self.directory = directory or OUTBOX_CONFIG['directory']
+        self.segment_size = segment_size or OUTBOX_CONFIG['segment_size']
+        self.fsync_interval = fsync_interval or OUTBOX_CONFIG['fsync_interval']
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        self.pending = 0
+
+        self._read_segment, self._read_offset = self._load_checkpoint()
+        self._recover()
+        segments = self._segments()
+        self._write_segment = (segments[-1] + 1) if segments else self._read_segment
+        self._write_offset = 0
+        self._fd = self._open_segment(self._write_segment)
+
+        self._syncer = threading.Thread(target=self._sync_loop, name='outbox-fsync', daemon=True)
+        self._syncer.start()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'{segment:012d}.seg')
+
+    def _segments(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.seg'))
+
+    def _open_segment(self, segment: int) -> int:
+        return os.open(self._path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, 'checkpoint')) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _save_checkpoint(self, segment: int, offset: int) -> None:
+        path = os.path.join(self.directory, 'checkpoint')
+        with open(path + '.tmp', 'w') as f:
+            f.write(f'{segment} {offset}')
+        os.replace(path + '.tmp', path)
+
+    def _recover(self) -> None:
+        """Count unsent records left by a previous run and cut off a torn tail."""
+        segments = [s for s in self._segments() if s >= self._read_segment]
+        for segment in [s for s in self._segments() if s < self._read_segment]:
+            os.remove(self._path(segment))
+
+        for segment in segments:
+            offset = self._read_offset if segment == self._read_segment else 0
+            with open(self._path(segment), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= offset:
+                    continue
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        while True:
+                            record, next_offset = _decode_record(view, offset, size)
+                            if record is None:
+                                break
+                            self.pending += 1
+                            offset = next_offset
+                    finally:
+                        view.release()
+            if offset < size:
+                logger.warning(f"Outbox segment {segment} has a torn record at {offset}, truncating")
+                os.truncate(self._path(segment), offset)
+        if self.pending:
+            logger.info(f"Outbox recovered {self.pending} unsent messages")
+
+    def append(self, routing_key: str, body: bytes, properties: pika.BasicProperties) -> None:
+        record = _encode_record(routing_key, body, properties)
+        with self._lock:
+            if self._write_offset and self._write_offset + len(record) > self.segment_size:
+                self._roll()
+            os.write(self._fd, record)
+            self._write_offset += len(record)
+            self.pending += 1
+            self._dirty = True
+
+    def _roll(self) -> None:
+        """Start a new segment; caller holds the lock."""
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._write_segment += 1
+        self._write_offset = 0
+        self._fd = self._open_segment(self._write_segment)
+
+    def _sync_loop(self) -> None:
+        while not self._closed.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = self._fd
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass  # segment was rolled (and fsynced) meanwhile
+
+    def read_batch(self, max_records: int) -> Tuple[Tuple[int, int], List[OutboxRecord]]:
+        """Read up to max_records in order; returns the position after them."""
+        with self._lock:
+            segment, offset = self._read_segment, self._read_offset
+            write_segment, write_offset = self._write_segment, self._write_offset
+
+        records = []
+        while len(records) < max_records:
+            if segment == write_segment:
+                end = write_offset
+            elif os.path.exists(self._path(segment)):
+                end = os.path.getsize(self._path(segment))
+            else:
+                end = 0
+            if offset >= end:
+                if segment >= write_segment:
+                    break
+                segment, offset = segment + 1, 0
+                continue
+
+            with open(self._path(segment), 'rb') as f:
+                with mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        while len(records) < max_records:
+                            record, next_offset = _decode_record(view, offset, end)
+                            if record is None:
+                                break
+                            records.append(record)
+                            offset = next_offset
+                    finally:
+                        view.release()
+            if offset < end and len(records) < max_records:
+                logger.error(f"Corrupt outbox record in segment {segment} at {offset}, skipping segment")
+                offset = end
+        return (segment, offset), records
+
+    def commit(self, position: Tuple[int, int], count: int) -> None:
+        """Mark records up to position as confirmed and drop finished segments."""
+        segment, offset = position
+        with self._lock:
+            first = self._read_segment
+            self._read_segment, self._read_offset = segment, offset
+            self.pending -= count
+            if self.pending == 0 and segment == self._write_segment:
+                # Everything is confirmed; truncate by starting a fresh segment
+                self._roll()
+                self._read_segment, self._read_offset = self._write_segment, 0
+            self._save_checkpoint(self._read_segment, self._read_offset)
+            finished = range(first, self._read_segment)
+        for old in finished:
+            if os.path.exists(self._path(old)):
+                os.remove(self._path(old))
+
+    def close(self) -> None:
+        self._closed.set()
+        self._syncer.join()
+        with self._lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+
+class OutboxDrainer(threading.Thread):
+    """Replays the outbox in order once the broker is reachable again.
+
+    publisher_factory must return a confirm-mode MessagePublisher with its
+    own connection, since pika connections cannot be shared across threads.
+
+    While the broker is down only this thread tries to reach it. The
+    producer spools until broker_available is set again, which happens once
+    the outbox has been replayed in full.
+    """
+
+    def __init__(self, outbox: Outbox, publisher_factory: Callable[[], Any]):
+        super().__init__(name='outbox-drainer', daemon=True)
+        self.outbox = outbox
+        self.publisher_factory = publisher_factory
+        self.replayed_count = 0
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self.broker_available = threading.Event()
+        self.broker_available.set()
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        self.join()
+
+    def run(self) -> None:
+        publisher = None
+        while not self._stopping.is_set():
+            if not self.outbox.pending:
+                self._wakeup.wait(OUTBOX_CONFIG['drain_interval'])
+                self._wakeup.clear()
+                continue
+            try:
+                if publisher is None:
+                    publisher = self.publisher_factory()
+                    logger.info(f"Draining {self.outbox.pending} messages from the outbox")
+                position, records = self.outbox.read_batch(OUTBOX_CONFIG['drain_batch_size'])
+                futures = [
+                    publisher.publish_body(record.routing_key, record.body, record.properties,
+                                           (record.properties.message_id or 'outbox'), flush=False)
+                    for record in records
+                ]
+                if not publisher.wait_for_confirms() or \
+                        any(f.exception() is not None for f in futures):
+                    raise Exception("Outbox batch was not confirmed by the broker")
+                self.outbox.commit(position, len(records))
+                self.replayed_count += len(records)
+                if not self.outbox.pending:
+                    logger.info(f"Outbox drained ({self.replayed_count} messages replayed)")
+                    self.broker_available.set()
+            except Exception as e:
+                logger.error(f"Error draining outbox: {str(e)}")
+                if publisher is not None:
+                    try:
+                        publisher.close()
+                        publisher.pool.close()
+                    except Exception:
+                        pass
+                    publisher = None
+                self._stopping.wait(RETRY_CONFIG['retry_delay'])
+
+        if publisher is not None:
+            publisher.close()
+            publisher.pool.close()
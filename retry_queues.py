@@ -0,0 +1,70 @@
+import copy
+import logging
+from typing import Optional
+import pika
+from config import RETRY_QUEUES_CONFIG
+from connection_helper import consumed_queues, retry_queue_name, dead_letter_queue_name
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Retries a message has been through, set on every copy sent to a retry queue
+RETRY_COUNT_HEADER = 'x-retry-count'
+
+RETRIED = metrics.counter('amqp_messages_retried_total',
+                          'Failed deliveries sent to a delayed retry queue')
+DEAD_LETTERED = metrics.counter('amqp_messages_dead_lettered_total',
+                                'Failed deliveries sent to the dead-letter queue')
+
+class RetryRouter:
+    """Routes failed deliveries through the retry queues declared by topology().
+
+    A delivery that should be retried goes to the retry queue for its next
+    delay with RETRY_COUNT_HEADER incremented; the queue's TTL dead-letters
+    it back to the main exchange under the original routing key. Once every
+    delay has been used, or for deliveries that can never succeed, it goes to
+    the queue's dead-letter queue instead.
+    """
+
+    def __init__(self):
+        self.delays = RETRY_QUEUES_CONFIG['delays']
+        self._queues = {routing_key: queue for queue, routing_key in consumed_queues()}
+
+    @staticmethod
+    def retry_count(properties: pika.BasicProperties) -> int:
+        try:
+            return int((properties.headers or {}).get(RETRY_COUNT_HEADER, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def route(self, ch, routing_key: str, properties: pika.BasicProperties, body: bytes,
+              retry: bool) -> Optional[str]:
+        """Republish a failed delivery; returns the queue it went to.
+
+        Returns None, publishing nothing, for routing keys that do not belong
+        to a consumed queue, which the caller should nack as before. The
+        publish is mandatory and ch is expected to be in confirm mode, so
+        when this returns the broker holds the copy and the original can be
+        acked; a missing queue raises pika.exceptions.UnroutableError and a
+        broker nack raises NackError.
+        """
+        queue = self._queues.get(routing_key)
+        if queue is None:
+            return None
+        retries = self.retry_count(properties)
+        properties = copy.copy(properties)
+        retrying = retry and retries < len(self.delays)
+        if retrying:
+            target = retry_queue_name(queue, self.delays[retries])
+            properties.headers = dict(properties.headers or {}, **{RETRY_COUNT_HEADER: retries + 1})
+        else:
+            target = dead_letter_queue_name(queue)
+        ch.basic_publish(exchange='', routing_key=target, body=body, properties=properties,
+                         mandatory=True)
+        if retrying:
+            RETRIED.inc()
+        else:
+            DEAD_LETTERED.inc()
+            logger.warning(f"Dead-lettered message {properties.message_id} after "
+                           f"{retries} retries")
+        return target
@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Activate virtual environment if it exists, create if it doesn't
+if [ ! -d "venv" ]; then
+    python3 -m venv venv
+    source venv/bin/activate
+    pip install pika
+else
+    source venv/bin/activate
+fi
+
+# Run one consumer process per CPU under the supervisor
+python consumer_supervisor.py
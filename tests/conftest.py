@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import socket
+import multiprocessing
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amqp_broker
+from config import RABBITMQ_CONFIG
+from connection_helper import get_pool
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope='session')
+def broker_address():
+    """An amqp_broker in a child process, shared by the whole session."""
+    host, port = 'localhost', _free_port()
+    process = multiprocessing.Process(target=amqp_broker.run, args=(host, port), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise
+            time.sleep(0.05)
+    yield host, port
+    # Close pooled connections while the broker is still there to close them
+    get_pool().close()
+    process.terminate()
+    process.join()
+
+@pytest.fixture
+def broker(broker_address, monkeypatch):
+    """Point RABBITMQ_CONFIG at the test broker, with names unique to the test."""
+    host, port = broker_address
+    suffix = f'test{time.monotonic_ns()}'
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'host', host)
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'port', port)
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'queue_name', f'{suffix}.queue')
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'exchange_name', f'{suffix}.exchange')
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'routing_key', f'{suffix}.key')
+    return host, port
@@ -0,0 +1,24 @@
+import struct
+from pika import spec
+import amqp_broker
+
+def test_queued_message_does_not_pin_the_receive_chunk():
+    broker = amqp_broker.Broker()
+    connection = amqp_broker.Connection(broker)
+    channel = amqp_broker.Channel(connection, 1)
+    queue = broker.queues['orders'] = amqp_broker.Queue('orders')
+    body = b'{"order_id": "ORD1"}'
+    publish = struct.pack('>I', spec.Basic.Publish.INDEX) \
+        + b''.join(spec.Basic.Publish(routing_key='orders').encode())
+    header = amqp_broker.HEADER_SIZE.pack(spec.Basic.INDEX, 0, len(body)) \
+        + b''.join(spec.BasicProperties(message_id='1').encode())
+    # The frames of one publish, parsed as views into a single receive chunk
+    chunk = memoryview(publish + header + body + b'padding from later frames')
+    channel.on_publish(chunk[:len(publish)])
+    channel.on_header(chunk[len(publish):len(publish) + len(header)])
+    channel.on_body(chunk[len(publish) + len(header):len(publish) + len(header) + len(body)])
+
+    message = queue.get()
+    assert message.body == body
+    for part in (message.route, message.header, message.body):
+        assert isinstance(part, bytes)
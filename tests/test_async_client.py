@@ -0,0 +1,38 @@
+import asyncio
+from config import PRIORITY_CONFIG, SHARDING_CONFIG
+from async_client import AsyncMessagePublisher, AsyncMessageConsumer
+
+async def round_trip(count: int) -> int:
+    """Publish count orders, then consume until they all arrive or a second passes idle."""
+    publisher = AsyncMessagePublisher()
+    consumer = AsyncMessageConsumer(prefetch_count=count)
+    await publisher.connect()
+    await consumer.connect()
+    await consumer.start()
+    received = 0
+    try:
+        await asyncio.gather(*(
+            publisher.publish_message({'order_id': f'ORD{index}', 'priority': 'high',
+                                       'customer': {'id': f'CUST{index}'}})
+            for index in range(count)
+        ))
+        iterator = consumer.__aiter__()
+        while received < count:
+            incoming = await asyncio.wait_for(iterator.__anext__(), 1)
+            incoming.ack()
+            received += 1
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await consumer.stop()
+        await consumer.close()
+        await publisher.close()
+    return received
+
+def test_consumes_every_shard(broker, monkeypatch):
+    monkeypatch.setitem(SHARDING_CONFIG, 'shards', 3)
+    assert asyncio.run(round_trip(30)) == 30
+
+def test_consumes_priority_queues(broker, monkeypatch):
+    monkeypatch.setitem(PRIORITY_CONFIG, 'per_priority_queues', True)
+    assert asyncio.run(round_trip(30)) == 30
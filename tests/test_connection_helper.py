@@ -0,0 +1,17 @@
+from config import RABBITMQ_CONFIG
+from connection_helper import ConnectionPool
+
+def test_replacement_connection_redeclares_topology(broker):
+    pool = ConnectionPool(max_connections=1)
+    try:
+        channel = pool.acquire_channel()
+        # What a broker restart does to non-persisted queues
+        channel.queue_delete(RABBITMQ_CONFIG['queue_name'])
+        pool.release_channel(channel, reusable=False)
+        channel.connection.close()
+
+        channel = pool.acquire_channel()
+        channel.queue_declare(queue=RABBITMQ_CONFIG['queue_name'], passive=True)
+        pool.release_channel(channel)
+    finally:
+        pool.close()
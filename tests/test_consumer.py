@@ -0,0 +1,56 @@
+from config import CONSUMER_CONFIG, PRIORITY_CONFIG
+from connection_helper import get_pool, priority_queue_name
+from consumer import MessageConsumer
+from publisher import MessagePublisher
+
+def test_priority_channels_get_prefetch_and_are_closed(broker, monkeypatch):
+    monkeypatch.setitem(PRIORITY_CONFIG, 'per_priority_queues', True)
+    consumer = MessageConsumer()
+    applied = {}
+
+    def adjust():
+        for level, channel in consumer._priority_channels.items():
+            channel.basic_qos = lambda prefetch_count, level=level: \
+                applied.__setitem__(level, prefetch_count)
+        consumer._set_prefetch(50)
+        consumer.stop_consuming()
+
+    consumer.connection.call_later(0.2, adjust)
+    consumer.start_consuming()
+
+    assert applied == {level: 50 for level in PRIORITY_CONFIG['levels']}
+    assert consumer._priority_channels == {}
+    with get_pool().channel() as channel:
+        for level in PRIORITY_CONFIG['levels']:
+            method = channel.queue_declare(queue=priority_queue_name(level), passive=True).method
+            assert method.consumer_count == 0
+
+class CountingConsumer(MessageConsumer):
+    """Counts messages without the simulated processing time, stopping after expected."""
+
+    def __init__(self, expected: int, **kwargs):
+        super().__init__(**kwargs)
+        self.expected = expected
+
+    def process_message(self, message):
+        with self._count_lock:
+            self.processed_count += 1
+            if self.processed_count == self.expected:
+                self.connection.add_callback_threadsafe(self.stop_consuming)
+
+def test_hot_key_lane_does_not_stall(broker, monkeypatch):
+    monkeypatch.setitem(CONSUMER_CONFIG, 'ordering_key', 'data.customer.id')
+    monkeypatch.setitem(CONSUMER_CONFIG, 'max_lane_depth', 1)
+    monkeypatch.setitem(CONSUMER_CONFIG, 'prefetch_count', 20)
+    count = 60
+    publisher = MessagePublisher(confirm_delivery=True, use_outbox=False)
+    for index in range(count):
+        publisher.publish_message({'order_id': f'ORD{index}', 'priority': 'high',
+                                   'customer': {'id': 'CUST1'}})
+    assert publisher.wait_for_confirms(timeout=5)
+    publisher.close()
+
+    consumer = CountingConsumer(count, worker_threads=4)
+    consumer.connection.call_later(10, consumer.stop_consuming)
+    consumer.start_consuming()
+    assert consumer.processed_count == count
@@ -0,0 +1,28 @@
+from dedup_cache import BloomFilter, DedupCache
+
+def test_lru_evicts_least_recently_seen():
+    cache = DedupCache(max_entries=3)
+    for message_id in ('1', '2', '3'):
+        cache.add(message_id)
+    assert '1' in cache  # touching it makes '2' the oldest
+    cache.add('4')
+    assert '2' not in cache
+    assert all(message_id in cache for message_id in ('1', '3', '4'))
+    assert cache.stats()['entries'] == 3
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(5000, error_rate=0.001)
+    keys = [f'msg-{index}' for index in range(5000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f'other-{index}' in bloom for index in range(20000))
+    assert false_positives / 20000 < 0.01
+
+def test_bloom_generations_remember_evicted_ids():
+    cache = DedupCache(max_entries=10, bloom_capacity=100)
+    for message_id in range(150):
+        cache.add(message_id)
+    # Long gone from the LRU, still in the current or previous Bloom filter
+    assert all(message_id in cache for message_id in range(150))
+    assert cache.stats()['entries'] == 10
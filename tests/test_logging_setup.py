@@ -0,0 +1,36 @@
+import atexit
+import logging
+import multiprocessing
+from logging.handlers import RotatingFileHandler
+import logging_setup
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def child_logs():
+    handlers = logging.getLogger().handlers + list(logging_setup._listener.handlers
+                                               if logging_setup._listener else [])
+    assert not any(isinstance(handler, RotatingFileHandler) for handler in handlers)
+    logging.getLogger('worker').warning('from worker %d', 1)
+
+def test_forked_workers_log_through_the_parent(monkeypatch):
+    collect = Collect()
+    monkeypatch.setattr(logging_setup, '_outputs', [collect])
+    monkeypatch.setattr(logging_setup, '_child_queue', None)
+    monkeypatch.setattr(logging_setup, '_child_listener', None)
+    logging_setup.forward_child_logs()
+    try:
+        process = multiprocessing.Process(target=child_logs)
+        process.start()
+        process.join(timeout=10)
+        assert process.exitcode == 0
+    finally:
+        listener = logging_setup._child_listener
+        listener.stop()
+        atexit.unregister(listener.stop)
+    assert [record.getMessage() for record in collect.records] == ['from worker 1']
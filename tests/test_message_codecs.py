@@ -0,0 +1,47 @@
+import pytest
+from message_codecs import CodecError, JsonCodec, MsgpackCodec, OrderStructCodec
+
+MESSAGE = {
+    'timestamp': '2025-01-06T11:21:39.899123+00:00',
+    'data': {
+        'order_id': 'ORD1',
+        'customer': {'id': 'CUST1', 'name': 'Zoë Müller', 'email': 'zoe@example.com'},
+        'items': [
+            {'product_id': 'P1', 'product_name': 'Widget', 'quantity': 2, 'price': 9.5,
+             'item_total': 19.0},
+            {'product_id': 'P2', 'product_name': 'Gadget', 'quantity': 1, 'price': 5.25,
+             'item_total': 5.25}
+        ],
+        'total_amount': 24.25,
+        'shipping_address': {'street': '1 Main St', 'city': 'Springfield', 'state': 'IL',
+                             'zip': '62701'},
+        'status': 'pending',
+        'priority': 'high'
+    },
+    'message_id': 370190481243506983,
+    'source': 'production_system'
+}
+
+def test_json_round_trip():
+    codec = JsonCodec()
+    assert codec.decode(codec.encode(MESSAGE)) == MESSAGE
+
+def test_msgpack_round_trip():
+    pytest.importorskip('msgpack')
+    codec = MsgpackCodec()
+    assert codec.decode(codec.encode(MESSAGE)) == MESSAGE
+
+def test_order_struct_round_trip():
+    codec = OrderStructCodec()
+    assert codec.decode(codec.encode(MESSAGE)) == MESSAGE
+
+@pytest.mark.parametrize('timestamp', ['yesterday', None, '2025-01-06T11:21:39'])
+def test_order_struct_rejects_bad_timestamps(timestamp):
+    with pytest.raises(CodecError):
+        OrderStructCodec().encode(dict(MESSAGE, timestamp=timestamp))
+
+def test_decode_errors_are_codec_errors():
+    with pytest.raises(CodecError):
+        JsonCodec().decode(b'{not json')
+    with pytest.raises(CodecError):
+        OrderStructCodec().decode(b'\x01\x02')
@@ -0,0 +1,43 @@
+import zlib
+import pytest
+import message_ids
+from message_ids import IdGenerator, MAX_NODE, MAX_SEQUENCE, default_node_id, split_id
+
+def test_default_node_id_folds_host_and_pid(monkeypatch):
+    monkeypatch.setattr(message_ids.socket, 'gethostname', lambda: 'publisher-7')
+    monkeypatch.setattr(message_ids.os, 'getpid', lambda: 123456)
+    assert default_node_id() == (zlib.crc32(b'publisher-7') + 123456) & MAX_NODE
+    assert 0 <= default_node_id() <= MAX_NODE
+
+def test_node_id_is_checked_and_embedded():
+    with pytest.raises(ValueError):
+        IdGenerator(MAX_NODE + 1)
+    generator = IdGenerator(42)
+    assert all(split_id(generator.next_id())[1] == 42 for _ in range(10))
+
+def test_ids_increase_within_a_millisecond(monkeypatch):
+    monkeypatch.setattr(message_ids.time, 'time', lambda: 1750000000.0)
+    generator = IdGenerator(1)
+    ids = [generator.next_id() for _ in range(MAX_SEQUENCE + 1)]
+    assert ids == sorted(set(ids))
+    assert {split_id(i)[0] for i in ids} == {1750000000000}
+    assert [split_id(i)[2] for i in ids] == list(range(MAX_SEQUENCE + 1))
+
+def test_sequence_rollover_runs_ahead_of_the_clock(monkeypatch):
+    monkeypatch.setattr(message_ids.time, 'time', lambda: 1750000000.0)
+    generator = IdGenerator(1)
+    ids = [generator.next_id() for _ in range(MAX_SEQUENCE + 2)]
+    assert ids[-1] > ids[-2]
+    assert split_id(ids[-1])[0] == 1750000000001
+    assert split_id(ids[-1])[2] == 0
+
+    # A clock that steps backwards does not make IDs go backwards either
+    monkeypatch.setattr(message_ids.time, 'time', lambda: 1749999999.0)
+    assert generator.next_id() > ids[-1]
+
+def test_next_ids_matches_next_id(monkeypatch):
+    monkeypatch.setattr(message_ids.time, 'time', lambda: 1750000000.0)
+    one_by_one = IdGenerator(3)
+    reserved = IdGenerator(3)
+    assert list(reserved.next_ids(5000)) == [one_by_one.next_id() for _ in range(5000)]
+    assert reserved.next_id() == one_by_one.next_id()
@@ -0,0 +1,83 @@
+import time
+import pytest
+from concurrent.futures import Future
+from publish_scheduler import PublishScheduler, RateProfile
+
+def test_ramp_messages_and_times():
+    profile = RateProfile.ramp(0, 100, 10, hold=5)
+    assert profile.total == pytest.approx(1000)
+    assert profile.messages_by(5) == pytest.approx(125)
+    assert profile.messages_by(12) == pytest.approx(700)
+    assert profile.time_for(125) == pytest.approx(5)
+    assert profile.time_for(750) == pytest.approx(12.5)
+    assert profile.time_for(1000) == pytest.approx(15)
+    assert profile.time_for(1001) is None
+    for elapsed in (0.5, 3, 9.9, 10, 14):
+        assert profile.time_for(profile.messages_by(elapsed)) == pytest.approx(elapsed)
+
+def test_step_messages_and_times():
+    profile = RateProfile.steps([(10, 100), (10, 300)])
+    assert profile.rate(15) == 300
+    assert profile.messages_by(5) == pytest.approx(500)
+    assert profile.messages_by(15) == pytest.approx(2500)
+    assert profile.time_for(1000) == pytest.approx(10)
+    assert profile.time_for(1300) == pytest.approx(11)
+
+def test_time_for_skips_a_zero_rate_step():
+    profile = RateProfile.steps([(5, 100), (5, 0), (5, 100)])
+    # The 500th message is due when the first step ends, not after the pause
+    assert profile.time_for(500) == pytest.approx(5)
+    assert profile.time_for(510) == pytest.approx(10.1)
+
+def test_intended_times_follow_the_token_bucket():
+    scheduler = PublishScheduler(None, RateProfile.constant(10, 10), burst=5, max_batch=10,
+                                 report_interval=0)
+    assert [scheduler.intended_time(index) for index in range(5)] == [0.0] * 5
+    assert scheduler.intended_time(5) == pytest.approx(0.1)
+    assert scheduler.intended_time(14) == pytest.approx(1.0)
+    assert scheduler.due_by(0) == 5
+    assert scheduler.due_by(1.0) == 15
+    assert scheduler.due_by(10) == 105
+    for index in range(105):
+        assert scheduler.due_by(scheduler.intended_time(index)) > index
+
+class StallingPublisher:
+    """Stands in for MessagePublisher; the first send blocks for stall seconds."""
+
+    def __init__(self, stall: float):
+        self.stall = stall
+        self.batches = []
+
+    def encode_orders(self, orders):
+        return list(orders)
+
+    def send_encoded(self, bodies):
+        if not self.batches:
+            time.sleep(self.stall)
+        self.batches.append(len(bodies))
+        futures = []
+        for _ in bodies:
+            future = Future()
+            future.set_result(None)
+            futures.append(future)
+        return futures
+
+    def idle(self, seconds):
+        time.sleep(seconds)
+
+    def wait_for_confirms(self):
+        return True
+
+def test_a_stall_shows_up_as_lag_not_a_lower_rate():
+    publisher = StallingPublisher(stall=0.3)
+    scheduler = PublishScheduler(publisher, RateProfile.constant(100, 0.5), burst=1,
+                                 max_batch=100, report_interval=0)
+    report = scheduler.run({'order_id': f'ORD{index}'} for index in range(1000))
+
+    # Open loop: every scheduled message is sent, the ones owed after the stall at once
+    assert report['sent'] == scheduler.due_by(0.5) == 51
+    assert max(publisher.batches[1:]) > 20
+    # Lag and latency count from the intended send time, so they include the stall
+    assert report['lag_ms']['max'] >= 250
+    assert report['confirm_latency_ms']['max'] >= 250
+    assert report['confirmed'] == 51
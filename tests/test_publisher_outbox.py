@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import socket
+import pika
+from config import RABBITMQ_CONFIG, OUTBOX_CONFIG, RETRY_CONFIG
+from connection_helper import ConnectionPool, get_pool
+from publisher import MessagePublisher
+from publisher_outbox import Outbox
+
+def append(outbox: Outbox, count: int, start: int = 0) -> None:
+    for index in range(start, start + count):
+        outbox.append('orders', json.dumps({'index': index}).encode(),
+                      pika.BasicProperties(message_id=str(index), delivery_mode=2))
+
+def read_all(outbox: Outbox):
+    position, records = outbox.read_batch(1000)
+    return position, [json.loads(record.body)['index'] for record in records]
+
+def test_recovers_segments_after_restart(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_size=200, fsync_interval=0.01)
+    append(outbox, 20)
+    outbox.close()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.seg')]) > 1
+
+    outbox = Outbox(str(tmp_path), segment_size=200, fsync_interval=0.01)
+    try:
+        assert outbox.pending == 20
+        append(outbox, 5, start=20)
+        _, indexes = read_all(outbox)
+        assert indexes == list(range(25))
+    finally:
+        outbox.close()
+
+def test_truncates_a_torn_tail(tmp_path):
+    outbox = Outbox(str(tmp_path), fsync_interval=0.01)
+    append(outbox, 3)
+    outbox.close()
+    segment = os.path.join(tmp_path, sorted(name for name in os.listdir(tmp_path)
+                                            if name.endswith('.seg'))[-1])
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00half a record')
+
+    outbox = Outbox(str(tmp_path), fsync_interval=0.01)
+    try:
+        assert outbox.pending == 3
+        assert os.path.getsize(segment) == size
+        append(outbox, 1, start=3)
+        _, indexes = read_all(outbox)
+        assert indexes == [0, 1, 2, 3]
+    finally:
+        outbox.close()
+
+def test_commit_checkpoints_the_read_position(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_size=200, fsync_interval=0.01)
+    append(outbox, 10)
+    position, records = outbox.read_batch(4)
+    outbox.commit(position, len(records))
+    assert outbox.pending == 6
+    outbox.close()
+
+    outbox = Outbox(str(tmp_path), segment_size=200, fsync_interval=0.01)
+    try:
+        assert outbox.pending == 6
+        position, indexes = read_all(outbox)
+        assert indexes == list(range(4, 10))
+        outbox.commit(position, len(indexes))
+        assert outbox.pending == 0
+        # Only the fresh segment started by the final commit is left
+        assert len([name for name in os.listdir(tmp_path) if name.endswith('.seg')]) == 1
+    finally:
+        outbox.close()
+
+def test_spools_while_down_then_drains_in_order(broker, monkeypatch, tmp_path):
+    host, port = broker
+    monkeypatch.setitem(OUTBOX_CONFIG, 'directory', str(tmp_path))
+    monkeypatch.setitem(OUTBOX_CONFIG, 'drain_interval', 0.05)
+    monkeypatch.setitem(RETRY_CONFIG, 'retry_delay', 0.1)
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        closed_port = sock.getsockname()[1]
+    monkeypatch.setitem(RABBITMQ_CONFIG, 'port', closed_port)
+
+    # A pool of its own: the shared one may hold a connection from earlier tests
+    pool = ConnectionPool()
+    publisher = MessagePublisher(confirm_delivery=True, pool=pool, use_outbox=True)
+    connects = []
+    connect = publisher.connect
+    monkeypatch.setattr(publisher, 'connect',
+                        lambda **kwargs: connects.append(kwargs) or connect(**kwargs))
+    try:
+        started = time.monotonic()
+        for index in range(50):
+            assert publisher.publish_message({'order_id': f'ORD{index}'}) is None
+        assert time.monotonic() - started < 1
+        assert publisher.spooled_count == 50
+        # Only the drainer probes a broker that is down
+        assert connects == []
+
+        monkeypatch.setitem(RABBITMQ_CONFIG, 'port', port)
+        assert publisher.drainer.broker_available.wait(timeout=10)
+        for index in range(50, 100):
+            assert publisher.publish_message({'order_id': f'ORD{index}'}) is not None
+        assert publisher.wait_for_confirms(timeout=5)
+        assert publisher.spooled_count == 50
+    finally:
+        publisher.close()
+        pool.close()
+
+    order_ids = []
+    with get_pool().channel() as channel:
+        while True:
+            method, properties, body = channel.basic_get(RABBITMQ_CONFIG['queue_name'],
+                                                         auto_ack=True)
+            if method is None:
+                break
+            order_ids.append(json.loads(body)['data']['order_id'])
+    assert order_ids == [f'ORD{index}' for index in range(100)]
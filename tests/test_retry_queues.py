@@ -0,0 +1,44 @@
+from config import RETRY_QUEUES_CONFIG, RABBITMQ_CONFIG
+from connection_helper import get_pool, retry_queue_name, dead_letter_queue_name
+from consumer import MessageConsumer
+from publisher import MessagePublisher
+
+class FailingConsumer(MessageConsumer):
+    def process_message(self, message):
+        raise RuntimeError("always fails")
+
+def consume_for(seconds: float) -> None:
+    consumer = FailingConsumer()
+    consumer.connection.call_later(seconds, consumer.stop_consuming)
+    consumer.start_consuming()
+
+def depth(queue: str) -> int:
+    with get_pool().channel() as channel:
+        return channel.queue_declare(queue=queue, passive=True).method.message_count
+
+def publish_one() -> None:
+    publisher = MessagePublisher(confirm_delivery=True)
+    publisher.publish_message({'order_id': 'ORD1', 'priority': 'high'})
+    publisher.wait_for_confirms()
+    publisher.close()
+
+def test_failures_end_in_dead_letter_queue(broker, monkeypatch):
+    monkeypatch.setitem(RETRY_QUEUES_CONFIG, 'enabled', True)
+    monkeypatch.setitem(RETRY_QUEUES_CONFIG, 'delays', [0.1])
+    publish_one()
+    consume_for(1)
+    queue = RABBITMQ_CONFIG['queue_name']
+    assert depth(dead_letter_queue_name(queue)) == 1
+    assert depth(retry_queue_name(queue, 0.1)) == 0
+    assert depth(queue) == 0
+
+def test_requeues_when_retry_queue_is_missing(broker, monkeypatch):
+    monkeypatch.setitem(RETRY_QUEUES_CONFIG, 'enabled', True)
+    monkeypatch.setitem(RETRY_QUEUES_CONFIG, 'delays', [0.1])
+    publish_one()
+    queue = RABBITMQ_CONFIG['queue_name']
+    with get_pool().channel() as channel:
+        channel.queue_delete(retry_queue_name(queue, 0.1))
+    consume_for(0.5)
+    # Still on the main queue rather than acked after a dropped republish
+    assert depth(queue) == 1
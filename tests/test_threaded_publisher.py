@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import Future
+from connection_helper import ConnectionPool
+from publisher import MessagePublisher
+from threaded_publisher import PublisherThread, ThreadSafePublisher
+
+def test_wakes_do_not_accumulate(broker):
+    publisher = ThreadSafePublisher(io_threads=1, confirm_delivery=True)
+    try:
+        thread = publisher.threads[0]
+        for index in range(300):
+            # Let the I/O thread go idle so every publish has to wake it
+            deadline = time.monotonic() + 1
+            while not thread._idle and time.monotonic() < deadline:
+                time.sleep(0.001)
+            publisher.publish({'order_id': f'ORD{index}', 'priority': 'high'}).result(timeout=5)
+        assert len(thread.publisher.connection._ready_events) < 10
+    finally:
+        publisher.close()
+    assert publisher.published_count == 300
+
+def test_failed_batch_only_fails_unsent_messages(broker, monkeypatch):
+    publisher = MessagePublisher(confirm_delivery=True, pool=ConnectionPool(), use_outbox=False)
+    # Not started: this thread drives _send itself
+    thread = PublisherThread(0, publisher, max_queue=10, max_batch=10, idle_interval=0.05)
+    publish_body = publisher.publish_body
+    calls = []
+
+    def failing_publish_body(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        return publish_body(*args, **kwargs)
+
+    monkeypatch.setattr(publisher, 'publish_body', failing_publish_body)
+    batch = [({'order_id': f'ORD{index}', 'priority': 'high'}, Future()) for index in range(5)]
+    try:
+        thread._send(batch)
+        assert publisher.wait_for_confirms(timeout=5)
+    finally:
+        publisher.close()
+        publisher.pool.close()
+    futures = [future for _, future in batch]
+    assert [future.exception(timeout=5) for future in futures[:2]] == [None, None]
+    assert all(isinstance(future.exception(timeout=0), OSError) for future in futures[2:])
+    assert thread.published_count == 2
@@ -0,0 +1,181 @@
+import queue
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional
+from config import THREADED_PUBLISHER_CONFIG
+from connection_helper import ConnectionPool
+from publisher import MessagePublisher, PartialPublishError
+
+logger = logging.getLogger(__name__)
+
+def _chain(outer: Future, inner: Future) -> None:
+    if inner.exception() is not None:
+        outer.set_exception(inner.exception())
+    else:
+        outer.set_result(inner.result())
+
+class PublisherThread(threading.Thread):
+    """Owns one MessagePublisher and publishes everything handed to it.
+
+    Producers append to a deque (atomic, no lock) and only wake the thread,
+    through the connection's thread-safe callback, when it is idle. They
+    block only when max_queue messages are already waiting.
+    """
+
+    def __init__(self, index: int, publisher: MessagePublisher, max_queue: int, max_batch: int,
+                 idle_interval: float):
+        super().__init__(name=f'publisher-io-{index}', daemon=True)
+        self.publisher = publisher
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.idle_interval = idle_interval
+        self.published_count = 0
+        self._queue: deque = deque()
+        self._idle = False
+        self._stopping = False
+        self._space = threading.Condition()
+        self._space_waiters = 0
+
+    def submit(self, order: Dict[str, Any], future: Future, timeout: Optional[float]) -> None:
+        if self._stopping:
+            raise RuntimeError("Publisher is closed")
+        if len(self._queue) >= self.max_queue:
+            self._wait_for_space(timeout)
+        self._queue.append((order, future))
+        if self._idle:
+            self._idle = False
+            self._wake()
+
+    def _wait_for_space(self, timeout: Optional[float]) -> None:
+        with self._space:
+            self._space_waiters += 1
+            try:
+                if not self._space.wait_for(lambda: len(self._queue) < self.max_queue, timeout):
+                    raise queue.Full(f"{len(self._queue)} messages waiting to be published")
+            finally:
+                self._space_waiters -= 1
+
+    def _wake(self) -> None:
+        try:
+            self.publisher.connection.add_callback_threadsafe(lambda: None)
+        except Exception:
+            # Closed connection: the thread is polling and will notice anyway
+            pass
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Publish what is queued, wait for its confirms, and stop."""
+        self._stopping = True
+        self._wake()
+        self.join(timeout)
+        # Submitted while the thread was exiting
+        while self._queue and not self.is_alive():
+            self._queue.popleft()[1].set_exception(RuntimeError("Publisher is closed"))
+
+    def run(self) -> None:
+        publisher = self.publisher
+        while True:
+            if self._queue:
+                self._send([self._queue.popleft()
+                            for _ in range(min(self.max_batch, len(self._queue)))])
+                if self._space_waiters:
+                    with self._space:
+                        self._space.notify_all()
+                continue
+            if self._stopping:
+                break
+            # Producers check the flag after appending, so one of the two sees the other
+            self._idle = True
+            publisher.idle(self.idle_interval, until=lambda: bool(self._queue) or self._stopping)
+            self._idle = False
+
+        try:
+            publisher.wait_for_confirms()
+        except Exception as e:
+            logger.error(f"Error waiting for confirms on {self.name}: {str(e)}")
+        publisher.close()
+        publisher.pool.close()
+
+    def _send(self, batch: List[tuple]) -> None:
+        error = None
+        try:
+            results = self.publisher.send_encoded(
+                self.publisher.encode_orders([order for order, _ in batch])
+            )
+        except PartialPublishError as e:
+            # Messages already handed over keep their outcome; failing them
+            # too would make callers that retry publish them twice
+            error, results = e.error, e.futures
+        except Exception as e:
+            error, results = e, []
+        for (_, future), result in zip(batch, results):
+            if result is None:
+                future.set_result(None)
+            else:
+                result.add_done_callback(lambda inner, outer=future: _chain(outer, inner))
+        self.published_count += len(results)
+        if error is not None:
+            logger.error(f"Error publishing from {self.name}: {str(error)}")
+            for _, future in batch[len(results):]:
+                future.set_exception(error)
+
+class ThreadSafePublisher:
+    """Publisher that any number of threads can share.
+
+    Calls are handed to io_threads PublisherThreads, each with its own
+    connection, so producers never touch pika themselves and the number of
+    connections does not grow with the number of producer threads. Each
+    producer thread sticks to one I/O thread, which keeps its messages in
+    order. The outbox is one per process, so it is only used with a single
+    I/O thread.
+    """
+
+    def __init__(self, io_threads: Optional[int] = None, confirm_delivery: Optional[bool] = None,
+                 content_type: Optional[str] = None, max_queue: Optional[int] = None):
+        config = THREADED_PUBLISHER_CONFIG
+        io_threads = io_threads or config['io_threads']
+        use_outbox = None if io_threads == 1 else False
+        self.threads = [
+            PublisherThread(
+                index,
+                MessagePublisher(confirm_delivery=confirm_delivery, content_type=content_type,
+                                 pool=ConnectionPool(), use_outbox=use_outbox),
+                max_queue or config['max_queue'], config['max_batch'], config['idle_interval']
+            )
+            for index in range(io_threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+        self._local = threading.local()
+        self._assign = itertools.count()
+
+    def _thread(self) -> PublisherThread:
+        try:
+            return self._local.thread
+        except AttributeError:
+            thread = self._local.thread = self.threads[next(self._assign) % len(self.threads)]
+            return thread
+
+    def publish(self, order: Dict[str, Any], timeout: Optional[float] = None) -> Future:
+        """Queue an order for publishing; safe to call from any thread.
+
+        The Future resolves to the message id once the broker confirms it,
+        or to None once it is sent with confirms off or spooled to the
+        outbox. Blocks while the queue is full, raising queue.Full after
+        timeout seconds.
+        """
+        future = Future()
+        self._thread().submit(order, future, timeout)
+        return future
+
+    @property
+    def published_count(self) -> int:
+        return sum(thread.published_count for thread in self.threads)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Publish everything queued, wait for confirms and close the connections."""
+        for thread in self.threads:
+            thread.stop(timeout)
+        logger.info(f"Threaded publisher closed after {self.published_count} messages")